@@ -0,0 +1 @@
+"""Benchmarks for pyrinnaitouch, run with python -m benchmarks.<name>."""
@@ -0,0 +1,169 @@
+"""Idle CPU per connection and command dispatch latency of RinnaiPollConnection.
+
+Run with: python -m benchmarks.bench_event_loop [--connections N] [--idle-seconds S]
+    [--save FILE] [--compare FILE]
+
+--save writes the results to a JSON file, and --compare prints the change from
+results saved earlier, e.g. before and after a change to the connection, exiting
+with status 1 if any got worse by more than TOLERANCE.
+"""
+import argparse
+import json
+import platform
+from queue import Empty, SimpleQueue
+import random
+import socket
+import statistics
+import sys
+import time
+from typing import Any, Dict
+
+from pyrinnaitouch.pollconnection import RinnaiPollConnection
+from .simulated_unit import start_simulator
+
+COMMAND = '{"CGOM": {"GSO": {"SP": "21" } } }'
+
+# Fraction by which a result may be worse than the baseline before --compare fails.
+# Idle CPU and latency over a loopback socket are noisy, so this is generous.
+TOLERANCE = 0.25
+
+# Results, all lower is better, and how to print them.
+RESULTS = {
+    "idle_cpu_percent_per_connection": "idle CPU per connection:    {:.3f} %",
+    "latency_mean_ms": "dispatch latency mean:      {:.2f} ms",
+    "latency_p50_ms": "dispatch latency p50:       {:.2f} ms",
+    "latency_p95_ms": "dispatch latency p95:       {:.2f} ms",
+    "latency_max_ms": "dispatch latency max:       {:.2f} ms",
+}
+
+
+def free_port(kind: int = socket.SOCK_STREAM) -> int:
+    """Return a currently unused local port."""
+    with socket.socket(socket.AF_INET, kind) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def drain(queue: SimpleQueue) -> None:
+    """Discard anything waiting in the queue."""
+    try:
+        while True:
+            queue.get_nowait()
+    except Empty:
+        pass
+
+
+def run(connections: int, idle_seconds: float, commands: int) -> Dict[str, float]:
+    """Return the results for the given number of connections."""
+    port = free_port()
+    discovery_port = free_port(socket.SOCK_DGRAM)
+    addresses = [f"127.0.0.{index + 1}" for index in range(connections)]
+    unit = start_simulator(port, discovery_port, addresses)
+
+    queues = []
+    polls = []
+    for address in addresses:
+        queue = SimpleQueue()
+        # Decode every status, even those no different from the last, since the
+        # latency is measured until the reply to a command has been decoded.
+        connection = RinnaiPollConnection(
+            address,
+            queue,
+            port=port,
+            discovery_port=discovery_port,
+            full_refresh_interval=0,
+        )
+        connection.start_thread()
+        queues.append(queue)
+        polls.append(connection)
+    for queue in queues:
+        queue.get(timeout=10)
+
+    # Idle: connected, nothing to send. Measures the cost of the event loops alone.
+    time.sleep(1)
+    cpu_start = time.process_time()
+    time.sleep(idle_seconds)
+    idle_cpu = (time.process_time() - cpu_start) / idle_seconds
+
+    # Dispatch latency: send_command until the unit's reply has been decoded.
+    latencies = []
+    connection, queue = polls[0], queues[0]
+    for _ in range(commands):
+        time.sleep(random.uniform(0, 0.05))
+        drain(queue)
+        start = time.perf_counter()
+        connection.send_command(COMMAND)
+        queue.get(timeout=10)
+        latencies.append((time.perf_counter() - start) * 1000)
+
+    for connection in polls:
+        connection.stop_thread()
+    unit.terminate()
+
+    latencies.sort()
+    return {
+        "idle_cpu_percent_per_connection": idle_cpu * 100 / connections,
+        "latency_mean_ms": statistics.mean(latencies),
+        "latency_p50_ms": latencies[len(latencies) // 2],
+        "latency_p95_ms": latencies[int(len(latencies) * 0.95)],
+        "latency_max_ms": latencies[-1],
+    }
+
+
+def compare(results: Dict[str, float], baseline: Dict[str, Any]) -> bool:
+    """Print the change from the baseline. Returns False if anything got worse."""
+    ok = True
+    for name, result in results.items():
+        before = baseline["results"].get(name)
+        if not before:
+            continue
+        change = result / before - 1
+        worse = change > TOLERANCE
+        ok = ok and not worse
+        print(
+            f"{name:<33}{before:>9.3f} -> {result:.3f} ({change:+.0%})"
+            f"{'  WORSE' if worse else ''}"
+        )
+    return ok
+
+
+def main() -> None:
+    """Run the benchmark and print the results."""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--connections", type=int, default=10)
+    parser.add_argument("--idle-seconds", type=float, default=10)
+    parser.add_argument("--commands", type=int, default=50)
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare with results saved earlier")
+    args = parser.parse_args()
+
+    results = run(args.connections, args.idle_seconds, args.commands)
+    print(f"connections:                {args.connections}")
+    for name, line in RESULTS.items():
+        print(line.format(results[name]))
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "connections": args.connections,
+                    "results": results,
+                },
+                file,
+                indent=2,
+            )
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            baseline = json.load(file)
+        if baseline.get("connections") != args.connections:
+            print(f"baseline was run with {baseline.get('connections')} connections")
+        if not compare(results, baseline):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
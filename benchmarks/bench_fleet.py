@@ -0,0 +1,119 @@
+"""Threads, memory and CPU needed to stay connected to many units.
+
+Connects to --units simulated units, either all from one RinnaiFleet, spread across
+the worker processes of a RinnaiShardedFleet, or with a threaded RinnaiSystem each,
+waits until every unit has reported its status, then measures the process while
+the connections idle. In sharded mode only the parent process is measured.
+
+Run with:
+    python -m benchmarks.bench_fleet [--units N ...] [--mode fleet|sharded|threaded]
+"""
+import argparse
+import resource
+import socket
+import threading
+import time
+
+from pyrinnaitouch.fleet import RinnaiFleet
+from pyrinnaitouch.shard import RinnaiShardedFleet
+from pyrinnaitouch.system import RinnaiSystem
+from .bench_event_loop import free_port
+from .simulated_unit import start_simulator
+
+
+def rss_megabytes() -> float:
+    """Return the resident set size of this process."""
+    try:
+        with open("/proc/self/status", encoding="ascii") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # Peak rather than current, but better than nothing.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def addresses(count: int):
+    """Return a distinct loopback address per unit."""
+    return [f"127.0.{index // 250}.{index % 250 + 1}" for index in range(count)]
+
+
+def run(count: int, mode: str, idle_seconds: float, workers: int = None) -> None:
+    """Connect to count units and print what it costs."""
+    port = free_port()
+    discovery_port = free_port(socket.SOCK_DGRAM)
+    unit_addresses = addresses(count)
+    unit = start_simulator(port, discovery_port, unit_addresses, broadcast_interval=2)
+
+    rss_before = rss_megabytes()
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+
+    reported = threading.Semaphore(0)
+    fleet = None
+    if mode == "fleet":
+        fleet = RinnaiFleet()
+    elif mode == "sharded":
+        fleet = RinnaiShardedFleet(workers)
+    systems = []
+    for address in unit_addresses:
+        if fleet is not None:
+            system = fleet.add_unit(address, port, discovery_port)
+        else:
+            system = RinnaiSystem(address, port=port, discovery_port=discovery_port)
+        reported_once = []
+
+        def on_update(reported_once=reported_once):
+            if not reported_once:
+                reported_once.append(True)
+                reported.release()
+
+        system.subscribe_updates(on_update)
+        system.get_status()
+        systems.append(system)
+    if fleet is not None:
+        fleet.start()
+    for _ in range(count):
+        if not reported.acquire(timeout=60):
+            print("Not every unit reported a status")
+            break
+    connect_seconds = time.perf_counter() - start
+    connect_cpu = time.process_time() - cpu_start
+
+    cpu_start = time.process_time()
+    time.sleep(idle_seconds)
+    idle_cpu = (time.process_time() - cpu_start) / idle_seconds
+    threads = threading.active_count()
+    rss = rss_megabytes() - rss_before
+
+    for system in systems:
+        RinnaiSystem.remove_instance(system._connection._ip_address)  # pylint: disable=protected-access
+    if fleet is not None:
+        fleet.stop()
+    unit.terminate()
+    unit.join()
+
+    print(
+        f"{mode:>8} {count:>5} units: {threads:>5} threads, "
+        f"{rss:7.1f} MB RSS, connected in {connect_seconds:5.2f} s "
+        f"using {connect_cpu:5.2f} s CPU, idle CPU {idle_cpu * 100:5.2f} %"
+    )
+
+
+def main() -> None:
+    """Run the benchmark and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--units", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument(
+        "--mode", choices=("fleet", "sharded", "threaded"), default="fleet"
+    )
+    parser.add_argument("--workers", type=int, help="worker processes when sharded")
+    parser.add_argument("--idle-seconds", type=float, default=10)
+    args = parser.parse_args()
+    for count in args.units:
+        run(count, args.mode, args.idle_seconds, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+"""Time from calling a RinnaiSystem command to the change showing up, end to end.
+
+Drives the public RinnaiSystem coroutines (set_unit_temp, turn_unit_zone_on,
+set_evap_fanspeed...) of a threaded connection to a simulated unit, optionally
+through an impairment proxy, one command at a time. For every command it measures:
+
+  enqueue  until the coroutine has returned, i.e. the command is queued
+  ack      until the unit has sent a frame with the command's sequence number
+  stored   until get_stored_status() reflects the change
+
+and reports the 50th, 95th and 99th percentiles of each for every command mix and
+impairment profile chosen. The simulator and proxy run on threads of this process.
+
+Run with:
+    python -m benchmarks.bench_latency [--mix NAME ...] [--profile NAME ...]
+        [--commands N] [--unit-latency S]
+"""
+import argparse
+import asyncio
+from concurrent.futures import Future
+import socket
+import threading
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from pyrinnaitouch.const import RinnaiUnitId
+from pyrinnaitouch.impairment import RinnaiImpairment, RinnaiImpairmentProxy
+from pyrinnaitouch.simulator import RinnaiSimulatedUnit, RinnaiSimulator
+from pyrinnaitouch.system import RinnaiSystem
+from pyrinnaitouch.system_status import RinnaiSystemStatus
+from .bench_event_loop import free_port
+
+# Longest to wait for a command to be reflected before counting it as lost.
+TIMEOUT_SECONDS = 15
+
+# A step returns the coroutine sending a command, and a check that the stored status
+# reflects it. Its argument alternates between 0 and 1, so every command changes
+# something.
+Step = Callable[
+    [RinnaiSystem, int], Tuple[Any, Callable[[RinnaiSystemStatus], bool]]
+]
+
+
+def _set_temp(system: RinnaiSystem, value: int):
+    temp = 20 + value
+    return (
+        system.set_unit_temp(temp),
+        lambda status: status.unit_status.set_temp == temp,
+    )
+
+
+def _zone(system: RinnaiSystem, value: int):
+    on = bool(value)
+    command = system.turn_unit_zone_on if on else system.turn_unit_zone_off
+    return command("B"), lambda status: status.unit_status.zones["B"].user_enabled == on
+
+
+def _fan_speed(system: RinnaiSystem, value: int):
+    speed = 5 + value
+    return system.set_unit_fanspeed(speed), lambda status: status.unit_status.fan_speed == speed
+
+
+def _evap_fan_speed(system: RinnaiSystem, value: int):
+    speed = 5 + value
+    return system.set_evap_fanspeed(speed), lambda status: status.unit_status.fan_speed == speed
+
+
+def _evap_zone(system: RinnaiSystem, value: int):
+    on = bool(value)
+    command = system.turn_evap_zone_on if on else system.turn_evap_zone_off
+    return command("B"), lambda status: status.unit_status.zones["B"].user_enabled == on
+
+
+def _evap_pump(system: RinnaiSystem, value: int):
+    on = not value
+    command = system.turn_evap_pump_on if on else system.turn_evap_pump_off
+    return command(), lambda status: status.unit_status.water_pump_on == on
+
+
+# The unit's mode, and the commands sent in turn.
+MIXES: Dict[str, Tuple[str, Sequence[Step]]] = {
+    "temperature": ("C", (_set_temp,)),
+    "zones": ("H", (_zone,)),
+    "mixed": ("C", (_set_temp, _zone, _fan_speed)),
+    "evap": ("E", (_evap_fan_speed, _evap_zone, _evap_pump)),
+}
+
+# Upstream and downstream impairments, or None to connect to the unit directly.
+PROFILES: Dict[str, Optional[Tuple[Dict[str, Any], Dict[str, Any]]]] = {
+    "direct": None,
+    "wifi": ({"latency": 0.005, "jitter": 0.02}, {"latency": 0.005, "jitter": 0.02}),
+    "congested": (
+        {"latency": 0.05, "jitter": 0.2},
+        {"latency": 0.05, "jitter": 0.2, "bandwidth": 20000, "chunk_size": 256},
+    ),
+}
+
+
+class Sample(NamedTuple):
+    """Seconds from calling a command's coroutine to each milestone."""
+
+    enqueue: float
+    ack: Optional[float]
+    stored: Optional[float]
+
+
+class _Watcher:
+    """Note when the stored status first passes the check of the command in flight."""
+
+    def __init__(self, system: RinnaiSystem) -> None:
+        self._system = system
+        self._check: Optional[Callable[[RinnaiSystemStatus], bool]] = None
+        self.reflected_at: Optional[float] = None
+        self.reflected = threading.Event()
+
+    def expect(self, check: Callable[[RinnaiSystemStatus], bool]) -> None:
+        """Wait for check to pass from now on."""
+        self.reflected_at = None
+        self.reflected.clear()
+        self._check = check
+
+    def __call__(self) -> None:
+        if self._check is not None and not self.reflected.is_set():
+            if self._check(self._system.get_stored_status()):
+                self.reflected_at = time.perf_counter()
+                self.reflected.set()
+
+
+async def _time_command(
+    system: RinnaiSystem, watcher: _Watcher, step: Step, value: int
+) -> Sample:
+    """Send one command and wait for it to be acknowledged and reflected."""
+    start = time.perf_counter()
+    coroutine, check = step(system, value)
+    watcher.expect(check)
+    future: Future = await coroutine
+    enqueued = time.perf_counter() - start
+
+    acked: List[float] = []
+    future.add_done_callback(
+        lambda future: acked.append(time.perf_counter())
+        if future.exception() is None
+        else None
+    )
+    watcher.reflected.wait(TIMEOUT_SECONDS)
+    # Let the acknowledgement catch up, should the status have been quicker.
+    future.exception(TIMEOUT_SECONDS)
+    return Sample(
+        enqueued,
+        acked[0] - start if acked else None,
+        watcher.reflected_at - start if watcher.reflected_at else None,
+    )
+
+
+async def _drive(system: RinnaiSystem, steps: Sequence[Step], commands: int) -> List[Sample]:
+    """Send the commands one at a time and time each."""
+    watcher = _Watcher(system)
+    system.subscribe_updates(watcher)
+    samples = [
+        await _time_command(
+            system, watcher, steps[index % len(steps)], index // len(steps) % 2
+        )
+        for index in range(commands)
+    ]
+    system.unsubscribe_updates(watcher)
+    return samples
+
+
+def run(mix: str, profile: str, commands: int, unit_latency: float) -> List[Sample]:
+    """Return the samples for commands from the mix sent through the profile."""
+    mode, steps = MIXES[mix]
+    discovery_port = free_port(socket.SOCK_DGRAM)
+    simulator = RinnaiSimulator(
+        discovery_port=discovery_port,
+        broadcast_interval=0.2,
+        latency=unit_latency,
+        unit_factory=lambda: RinnaiSimulatedUnit(
+            mode,
+            (RinnaiUnitId.HEATER, RinnaiUnitId.COOLER, RinnaiUnitId.EVAP),
+            zones="ABU",
+        ),
+    ).start()
+    proxy = None
+    port = simulator.port
+    if PROFILES[profile] is not None:
+        upstream, downstream = PROFILES[profile]
+        proxy = RinnaiImpairmentProxy(
+            simulator.port,
+            upstream=RinnaiImpairment(**upstream),
+            downstream=RinnaiImpairment(**downstream),
+        ).start()
+        port = proxy.port
+
+    system = RinnaiSystem("127.0.0.1", port=port, discovery_port=discovery_port)
+    try:
+        watcher = _Watcher(system)
+        system.subscribe_updates(watcher)
+        watcher.expect(lambda status: status.unit_status.unit_id is not None)
+        system.get_status()
+        watcher.reflected.wait(TIMEOUT_SECONDS)
+        watcher.expect(lambda status: status.unit_status.is_on)
+        if mode == "E":
+            asyncio.run(system.turn_evap_on())
+        else:
+            asyncio.run(system.turn_unit_on())
+        watcher.reflected.wait(TIMEOUT_SECONDS)
+        system.unsubscribe_updates(watcher)
+        return asyncio.run(_drive(system, steps, commands))
+    finally:
+        RinnaiSystem.remove_instance("127.0.0.1")
+        if proxy is not None:
+            proxy.stop()
+        simulator.stop()
+
+
+def percentile(values: Sequence[float], percent: float) -> float:
+    """Return the nearest rank percentile of values."""
+    ordered = sorted(values)
+    rank = max(int(round(percent / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def main() -> None:
+    """Run the benchmark and print the results."""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--mix", action="append", choices=sorted(MIXES))
+    parser.add_argument("--profile", action="append", choices=sorted(PROFILES))
+    parser.add_argument("--commands", type=int, default=30)
+    parser.add_argument("--unit-latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    print(f"commands per run:   {args.commands}")
+    print(f"unit latency:       {args.unit_latency * 1000:.0f} ms")
+    print(
+        f"{'mix':<13}{'profile':<11}{'milestone':<10}"
+        f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'lost':>6}"
+    )
+    for mix in args.mix or MIXES:
+        for profile in args.profile or PROFILES:
+            samples = run(mix, profile, args.commands, args.unit_latency)
+            for milestone in Sample._fields:
+                values = [
+                    value
+                    for value in (getattr(sample, milestone) for sample in samples)
+                    if value is not None
+                ]
+                lost = len(samples) - len(values)
+                if not values:
+                    print(f"{mix:<13}{profile:<11}{milestone:<10}{'-':>27}{lost:>6}")
+                    continue
+                print(
+                    f"{mix:<13}{profile:<11}{milestone:<10}"
+                    + "".join(
+                        f"{percentile(values, percent) * 1000:>9.1f}"
+                        for percent in (50, 95, 99)
+                    )
+                    + f"{lost:>6}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""Cost of framing and decoding the statuses received from the unit.
+
+Times each stage a status goes through on its own, over a corpus of frames from
+simulated heater, cooler and evaporative cooler units with single and multiple set
+points and one to five zones, U included:
+
+  framing        RinnaiFrameScanner splitting the stream into frames
+  session        RinnaiSession._process_received_data, i.e. framing, CRC and JSON
+  json           json.loads of a frame's payload
+  system_status  RinnaiSystemStatus.handle_status of a decoded status, as
+                 RinnaiSystem does for every status
+  unit_status    RinnaiUnitStatus.handle_status of the same
+
+Allocations are the peak bytes traced by tracemalloc while a frame is processed,
+as Python has no count of allocations made.
+
+Run with: python -m benchmarks.bench_parser [--save FILE] [--compare FILE]
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Sequence
+
+from pyrinnaitouch.const import RinnaiCapabilities, RinnaiUnitId
+from pyrinnaitouch.framing import RinnaiFrameScanner
+from pyrinnaitouch.session import RinnaiSession
+from pyrinnaitouch.simulator import RinnaiSimulatedUnit
+from pyrinnaitouch.system_status import RinnaiSystemStatus
+from pyrinnaitouch.unit_status import RinnaiUnitStatus
+
+ZONES = ("A", "AU", "ABU", "ABCU", "ABCDU")
+UNITS = (RinnaiUnitId.HEATER, RinnaiUnitId.COOLER, RinnaiUnitId.EVAP)
+CAPABILITIES = {
+    str(RinnaiUnitId.HEATER): RinnaiCapabilities.HEATER,
+    str(RinnaiUnitId.COOLER): RinnaiCapabilities.COOLER,
+    str(RinnaiUnitId.EVAP): RinnaiCapabilities.EVAP,
+}
+# A stage is slower than its baseline if it takes this much longer per frame.
+TOLERANCE = 0.1
+
+
+def corpus() -> List[bytes]:
+    """Return frames as the unit sends them, off and running, in every layout."""
+    frames = []
+    for mode in ("H", "C", "E"):
+        # Evaporative coolers have a single comfort level, whatever the setting.
+        for multi_set_point in (False, True) if mode != "E" else (False,):
+            for zones in ZONES:
+                unit = RinnaiSimulatedUnit(
+                    mode, UNITS, zones=zones, multi_set_point=multi_set_point
+                )
+                unit_id = unit.unit_id
+                for command in (
+                    {},
+                    {unit_id: {"OOP": {"ST": "N"}, "GSO": {"SW": "N"}}},
+                ):
+                    unit.apply(command)
+                    unit.set_temperature(215)
+                    sequence = len(frames) % 255 + 1
+                    frames.append(
+                        f"N{sequence:06d}".encode() + json.dumps(unit.status()).encode()
+                    )
+    return frames
+
+
+def stages(frames: Sequence[bytes]) -> Dict[str, Any]:
+    """Return each stage as a function of one input, and the inputs to use."""
+    scanner = RinnaiFrameScanner()
+    session = RinnaiSession(lambda status: None)
+    payloads = [frame[7:] for frame in frames]
+    statuses = [json.loads(payload) for payload in payloads]
+    units = []
+    for status in statuses:
+        system = RinnaiSystemStatus()
+        system.handle_status(status)
+        unit_id = next(iter(status[1]))
+        units.append((CAPABILITIES[unit_id], system.is_multi_set_point, status))
+
+    def framing(frame: bytes) -> None:
+        scanner.feed(frame)
+        scanner.next_frame().payload.release()
+
+    def handle_unit(args) -> None:
+        capability, multi_set_point, status = args
+        RinnaiUnitStatus().handle_status(
+            capability, multi_set_point, lambda on: None, status
+        )
+
+    return {
+        "framing": (framing, frames),
+        "session": (lambda frame: session.data_received(frame, 0), frames),
+        "json": (lambda payload: json.loads(str(payload, "utf-8")), payloads),
+        "system_status": (lambda status: RinnaiSystemStatus().handle_status(status), statuses),
+        "unit_status": (handle_unit, units),
+    }
+
+
+def measure(stage: Callable[[Any], Any], inputs: Sequence[Any], repeat: int) -> Dict[str, float]:
+    """Return the best time per frame over repeat runs, and the allocations per frame."""
+    for item in inputs:
+        stage(item)
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for item in inputs:
+            stage(item)
+        best = min(best, (time.perf_counter() - start) / len(inputs))
+
+    tracemalloc.start()
+    allocated = 0
+    for item in inputs:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        stage(item)
+        allocated += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return {
+        "frames_per_second": 1 / best,
+        "us_per_frame": best * 1e6,
+        "allocated_bytes_per_frame": allocated / len(inputs),
+    }
+
+
+def compare(results: Dict[str, Dict[str, float]], baseline: Dict[str, Any]) -> bool:
+    """Print the change from the baseline. Returns False if anything got slower."""
+    ok = True
+    for name, result in results.items():
+        before = baseline["stages"].get(name)
+        if before is None:
+            continue
+        change = result["us_per_frame"] / before["us_per_frame"] - 1
+        slower = change > TOLERANCE
+        ok = ok and not slower
+        print(
+            f"{name:<15}{before['us_per_frame']:>10.2f} -> {result['us_per_frame']:.2f} "
+            f"us/frame ({change:+.0%}){'  SLOWER' if slower else ''}"
+        )
+    return ok
+
+
+def main() -> None:
+    """Run the benchmark and print the results."""
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare with results saved earlier")
+    args = parser.parse_args()
+
+    frames = corpus()
+    print(f"corpus:         {len(frames)} frames, {sum(map(len, frames))} bytes")
+    print(f"{'stage':<15}{'frames/s':>12}{'us/frame':>10}{'bytes/frame':>13}")
+    results = {}
+    for name, (stage, inputs) in stages(frames).items():
+        result = results[name] = measure(stage, inputs, args.repeat)
+        print(
+            f"{name:<15}{result['frames_per_second']:>12.0f}"
+            f"{result['us_per_frame']:>10.2f}{result['allocated_bytes_per_frame']:>13.0f}"
+        )
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "frames": len(frames),
+                    "stages": results,
+                },
+                file,
+                indent=2,
+            )
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            baseline = json.load(file)
+        if not compare(results, baseline):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Burst throughput of RinnaiPollConnection at different command window sizes.
+
+Sends a burst of commands that can neither be coalesced nor merged to a simulated unit
+that takes --latency seconds to answer each frame, and times how long it takes for
+all of them to be acknowledged.
+
+Run with: python -m benchmarks.bench_pipelining [--commands N] [--latency S]
+"""
+import argparse
+from concurrent.futures import wait
+from queue import SimpleQueue
+import socket
+import time
+
+from pyrinnaitouch.pollconnection import RinnaiPollConnection
+from .bench_event_loop import free_port
+from .simulated_unit import start_simulator
+
+WINDOWS = (1, 2, 4)
+
+
+def burst(count: int):
+    """Yield commands alternating between units, so each needs its own frame."""
+    for index in range(count):
+        unit = ("HGOM", "CGOM")[index % 2]
+        yield f'{{"{unit}": {{"GSO": {{"F{index}": "Y" }} }} }}'
+
+
+def run(window: int, port: int, discovery_port: int, commands: int) -> float:
+    """Return the seconds taken to have a burst acknowledged with the given window."""
+    queue = SimpleQueue()
+    connection = RinnaiPollConnection(
+        "127.0.0.1",
+        queue,
+        port=port,
+        discovery_port=discovery_port,
+        command_window=window,
+    )
+    connection.start_thread()
+    queue.get(timeout=10)
+
+    start = time.perf_counter()
+    futures = [connection.send_command(command) for command in burst(commands)]
+    wait(futures, timeout=60)
+    elapsed = time.perf_counter() - start
+    failed = sum(1 for future in futures if future.exception(0) is not None)
+
+    connection.stop_thread()
+    if failed:
+        print(f"window {window}: {failed} commands were not acknowledged")
+    return elapsed
+
+
+def main() -> None:
+    """Run the benchmark and print the results."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--commands", type=int, default=40)
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    port = free_port()
+    discovery_port = free_port(socket.SOCK_DGRAM)
+    unit = start_simulator(port, discovery_port, latency=args.latency)
+
+    print(f"commands per burst:   {args.commands}")
+    print(f"unit latency:         {args.latency * 1000:.0f} ms")
+    for window in WINDOWS:
+        elapsed = run(window, port, discovery_port, args.commands)
+        print(
+            f"window {window}:             {elapsed:.2f} s, "
+            f"{args.commands / elapsed:.1f} commands/s"
+        )
+    unit.terminate()
+
+
+if __name__ == "__main__":
+    main()
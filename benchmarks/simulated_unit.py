@@ -0,0 +1,35 @@
+"""Run the bundled unit simulator in a child process, so benchmarks need no hardware."""
+import asyncio
+import multiprocessing
+from typing import Sequence
+
+from pyrinnaitouch.simulator import RinnaiSimulator
+
+
+def _run(ready, *args, **kwargs) -> None:
+    asyncio.run(RinnaiSimulator(*args, **kwargs).serve(ready))
+
+
+def start_simulator(
+    port: int,
+    discovery_port: int,
+    addresses: Sequence[str] = ("127.0.0.1",),
+    latency: float = 0,
+    broadcast_interval: float = 0.5,
+) -> multiprocessing.Process:
+    """Simulate a unit at each of the addresses, without adding to our CPU time."""
+    ready = multiprocessing.Event()
+    process = multiprocessing.Process(
+        target=_run,
+        args=(ready, port, discovery_port),
+        kwargs={
+            "host": "0.0.0.0",
+            "addresses": list(addresses),
+            "latency": latency,
+            "broadcast_interval": broadcast_interval,
+        },
+        daemon=True,
+    )
+    process.start()
+    ready.wait(10)
+    return process
@@ -3,6 +3,11 @@
 """
 
 from .system import RinnaiSystemStatus, RinnaiSystem
+from .fleet import RinnaiFleet
+from .shard import RinnaiShardedFleet
+from .capture import RinnaiCaptureReader, RinnaiCaptureReplay, RinnaiCaptureWriter
+from .diff import RinnaiChange, RinnaiChangeSet
+from .dispatch import RinnaiDispatcher
 from .unit_status import RinnaiUnitStatus
 from .const import (
     RinnaiSchedulePeriod,
@@ -17,6 +22,14 @@ __ALL__ = [
     RinnaiSystemStatus,
     RinnaiUnitStatus,
     RinnaiSystem,
+    RinnaiFleet,
+    RinnaiShardedFleet,
+    RinnaiCaptureWriter,
+    RinnaiCaptureReader,
+    RinnaiCaptureReplay,
+    RinnaiChange,
+    RinnaiChangeSet,
+    RinnaiDispatcher,
     RinnaiSchedulePeriod,
     RinnaiCapabilities,
     RinnaiOperatingMode,
@@ -0,0 +1,291 @@
+"""Handle connectivity with an asyncio transport on the caller's event loop."""
+
+import asyncio
+from concurrent.futures import Future
+import logging
+import time
+from typing import Any, Callable, Dict, Optional
+
+from .cadence import RinnaiPollCadence
+from .discovery import DISCOVERY_PORT, RinnaiDiscovery
+from .pollconnection import (
+    RECEIVE_SIZE,
+    UNIT_PORT,
+    RinnaiConnection,
+    RinnaiConnectionState,
+)
+from .reconnect import RinnaiReconnectPolicy
+from .session import COMMAND_WINDOW, FULL_REFRESH_SECONDS, RinnaiSession
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class _RinnaiProtocol(asyncio.BufferedProtocol):
+    """Forward transport events to the owning connection."""
+
+    def __init__(self, connection: "RinnaiAsyncConnection") -> None:
+        self._connection = connection
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        """Let the transport receive straight into the session's buffer."""
+        return self._connection._get_buffer(sizehint)  # pylint: disable=protected-access
+
+    def buffer_updated(self, nbytes: int) -> None:
+        """Process the received bytes."""
+        self._connection._buffer_updated(nbytes)  # pylint: disable=protected-access
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        """Tell the connection the transport has gone."""
+        self._connection._connection_lost(exc)  # pylint: disable=protected-access
+
+    def pause_writing(self) -> None:
+        """Stop handing frames to the transport while its buffer is full."""
+        self._connection._set_writing_paused(True)  # pylint: disable=protected-access
+
+    def resume_writing(self) -> None:
+        """Carry on writing once the transport has drained."""
+        self._connection._set_writing_paused(False)  # pylint: disable=protected-access
+
+
+class RinnaiAsyncConnection(RinnaiConnection):  # pylint: disable=too-many-instance-attributes
+    """Manage the connection to the unit on an asyncio event loop.
+
+    Uses the same session logic as RinnaiPollConnection, but needs no threads: status
+    frames are decoded and passed to status_handler from within data_received.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        ip_address: str,
+        status_handler: Callable[[Any], None],
+        port: int = UNIT_PORT,
+        discovery_port: int = DISCOVERY_PORT,
+        *,
+        command_window: int = COMMAND_WINDOW,
+        cadence: Optional[RinnaiPollCadence] = None,
+        reconnect: Optional[RinnaiReconnectPolicy] = None,
+        full_refresh_interval: Optional[float] = FULL_REFRESH_SECONDS,
+    ) -> None:
+        """Initialise the connection object.
+
+        command_window is the number of commands that may await acknowledgement from
+        the unit at once. cadence decides how often an idle unit is polled, and
+        reconnect when to connect again after a failure. full_refresh_interval is
+        how often an unchanged status is decoded all the same, see RinnaiSession.
+        """
+        super().__init__(ip_address)
+        self._port = port
+        self._udp_port = discovery_port
+        self._reconnect = reconnect or RinnaiReconnectPolicy()
+
+        self._session = RinnaiSession(
+            status_handler,
+            command_window=command_window,
+            cadence=cadence,
+            full_refresh_interval=full_refresh_interval,
+        )
+
+        # These don't get created until start is called
+        self._loop: asyncio.AbstractEventLoop = None
+        self._task: asyncio.Task = None
+        self._transport: asyncio.Transport = None
+        self._timer: asyncio.TimerHandle = None
+        self._disconnected: asyncio.Future = None
+        self._discovery: RinnaiDiscovery = None
+        self._writing_paused = False
+
+        _LOGGER.debug("Async connection inited")
+
+    def send_command(self, command: str) -> Future:
+        """Queue a command to be sent to the unit.
+
+        Returns a future that resolves once the unit acknowledges the command, which
+        can be awaited with asyncio.wrap_future. Raises RinnaiBackpressureError
+        straight away if too many commands are already waiting for the unit, since
+        blocking would stall the event loop.
+        """
+        future = self._session.send_command(command, timeout=0)
+        self._service_session()
+        return future
+
+    def set_busy(self, busy: bool) -> None:
+        """Tell the connection whether the unit is busy, so it polls faster."""
+        if self._session.set_busy(busy):
+            self._service_session()
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Return counters describing the connection."""
+        return {**self._session.get_metrics(), **self._reconnect.get_metrics()}
+
+    def start(self) -> None:
+        """Attempt connection to the unit from the running event loop. Results are
+        reflected via connection_state property."""
+        if self._task is None or self._task.done():
+            _LOGGER.debug("Starting connection task")
+            self._register_client()
+            self._loop = asyncio.get_running_loop()
+            if self._discovery is None:
+                self._discovery = RinnaiDiscovery.get_instance(self._udp_port)
+                # Listened to on this loop, rather than on a thread of its own.
+                self._discovery.acquire(self._loop)
+            self._task = self._loop.create_task(self._run())
+        else:
+            _LOGGER.error("Cannot start multiple connection tasks")
+
+    def stop(self) -> None:
+        """Stop the connection task, close the transport and release the unit."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        self._close_transport()
+        self._session.close()
+        if self._discovery is not None:
+            self._discovery.release(self._loop)
+            self._discovery = None
+        self._release_client()
+
+    async def _run(self) -> None:
+        """Connect, then wait for the transport to drop. Repeat until cancelled."""
+        while True:
+            # Go straight back to the unit where it was last seen, unless that has
+            # not worked for a while.
+            discovered = self._reconnect.needs_discovery()
+            if discovered:
+                await self._wait_for_broadcast()
+            elif self._socketstate == RinnaiConnectionState.IDLE:
+                self._update_socket_state(RinnaiConnectionState.CONNECTING)
+            if not await self._connect(discovered):
+                continue
+            await self._disconnected
+            self._reconnect.disconnected(time.monotonic())
+
+    async def _wait_for_broadcast(self) -> None:
+        """Wait for the unit to announce itself, unless it was seen recently."""
+        found = self._discovery.discover(
+            self._ip_address, self._reconnect.discovery_max_age(time.monotonic())
+        )
+        try:
+            await asyncio.wrap_future(found)
+            self._update_socket_state(RinnaiConnectionState.CONNECTING)
+        except OSError as e:
+            self._update_socket_state(RinnaiConnectionState.ERROR)
+            _LOGGER.error("Unexpected broadcast error: %s", e)
+        finally:
+            found.cancel()
+
+    async def _connect(self, discovered: bool) -> bool:
+        """Make a single connection attempt, sleeping after failures."""
+        self._reconnect.attempt_started(time.monotonic(), discovered)
+        try:
+            transport, _ = await asyncio.wait_for(
+                self._loop.create_connection(
+                    lambda: _RinnaiProtocol(self), self._ip_address, self._port
+                ),
+                5,
+            )
+        except ConnectionRefusedError:
+            self._update_socket_state(RinnaiConnectionState.REFUSED)
+        except asyncio.TimeoutError:
+            self._update_socket_state(RinnaiConnectionState.TIMEOUT)
+        except OSError as e:
+            self._update_socket_state(RinnaiConnectionState.ERROR)
+            _LOGGER.error('Unexpected connection error: "%s", will retry', e)
+        else:
+            self._connected(transport)
+            return True
+        await asyncio.sleep(self._reconnect.attempt_failed(time.monotonic()))
+        return False
+
+    def _connected(self, transport: asyncio.Transport) -> None:
+        """Start the session on a newly connected transport."""
+        self._reconnect.attempt_succeeded(time.monotonic())
+        self._discovery.touch(self._ip_address)
+        self._transport = transport
+        self._writing_paused = False
+        self._disconnected = self._loop.create_future()
+        # Reset the timestamps and command sequence number
+        self._session.reset(time.monotonic())
+        self._update_socket_state(RinnaiConnectionState.CONNECTED)
+        self._service_session()
+
+    def _get_buffer(self, sizehint: int) -> memoryview:
+        """Return the session's receive buffer for the transport to fill."""
+        return self._session.get_buffer(max(sizehint, RECEIVE_SIZE))
+
+    def _buffer_updated(self, nbytes: int) -> None:
+        """Process received bytes within the current loop iteration."""
+        _LOGGER.debug("Read %d bytes from transport", nbytes)
+        if not self._session.buffer_updated(nbytes, time.monotonic()):
+            self._drop(RinnaiConnectionState.ERROR)
+            return
+        # An acknowledgement may have released the next queued command.
+        self._service_session()
+
+    def _connection_lost(self, exc: Optional[Exception]) -> None:
+        """Handle the transport closing underneath us."""
+        if exc is not None:
+            _LOGGER.error("Socket error: %s. Reconnecting", exc)
+        else:
+            _LOGGER.info("Socket disconnected. Reconnecting")
+        self._transport = None
+        self._cancel_timer()
+        if self._socketstate == RinnaiConnectionState.CONNECTED:
+            self._update_socket_state(RinnaiConnectionState.IDLE)
+        if self._disconnected is not None and not self._disconnected.done():
+            self._disconnected.set_result(None)
+
+    def _service_session(self) -> None:
+        """Send whatever the session has due and rearm the timer for its next deadline."""
+        if self._transport is None or self._transport.is_closing():
+            return
+        now = time.monotonic()
+        if self._session.receive_timed_out(now):
+            _LOGGER.error(
+                "Resetting connection as no data received for at least 30 seconds"
+            )
+            self._drop(RinnaiConnectionState.TIMEOUT)
+            return
+
+        self._session.queue_due_frame(now)
+        self._flush()
+
+        self._cancel_timer()
+        deadline = self._session.next_deadline()
+        if deadline is not None:
+            delay = max(deadline - time.monotonic(), 0)
+            self._timer = self._loop.call_later(delay, self._service_session)
+
+    def _flush(self) -> None:
+        """Hand queued frames to the transport unless it has asked us to pause."""
+        if self._writing_paused:
+            return
+        buffers = self._session.outbound_buffers()
+        if buffers:
+            self._transport.writelines(buffers)
+            self._session.data_sent(sum(len(buffer) for buffer in buffers), time.monotonic())
+
+    def _set_writing_paused(self, paused: bool) -> None:
+        """Track the transport's flow control."""
+        self._writing_paused = paused
+        if not paused and self._transport is not None:
+            self._flush()
+
+    def _drop(self, socketstate: RinnaiConnectionState) -> None:
+        """Abandon the current transport and let _run reconnect."""
+        self._update_socket_state(socketstate)
+        self._close_transport()
+
+    def _close_transport(self) -> None:
+        """Close the transport if one is open."""
+        self._cancel_timer()
+        if self._transport is not None:
+            self._transport.abort()
+            self._transport = None
+        if self._disconnected is not None and not self._disconnected.done():
+            self._disconnected.set_result(None)
+
+    def _cancel_timer(self) -> None:
+        """Cancel the pending session timer."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
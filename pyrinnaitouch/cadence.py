@@ -0,0 +1,68 @@
+"""Adaptive interval between the idle commands used to poll the unit."""
+
+# Seconds between polls while nothing is going on, as with the old fixed keep-alive.
+BASE_INTERVAL = 10
+# Seconds between polls after a command and while the unit is busy.
+FAST_INTERVAL = 2
+# Longest interval to back off to. Must stay well inside the receive watchdog.
+MAX_INTERVAL = 20
+# Seconds to keep polling fast after a command was sent.
+FAST_WINDOW = 30
+# Growth of the interval for every unchanged status received.
+BACKOFF_FACTOR = 1.5
+
+
+class RinnaiPollCadence:
+    """Decide how long the connection may stay idle before polling the unit.
+
+    Polls every fast_interval seconds for fast_window seconds after a command and
+    while the unit reports it is busy (preheating, prewetting, a zone calling for
+    work...), so changes show up sooner. While consecutive statuses are unchanged
+    the interval grows by backoff_factor up to max_interval, cutting idle traffic;
+    any change drops it back to base_interval.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        base_interval: float = BASE_INTERVAL,
+        fast_interval: float = FAST_INTERVAL,
+        max_interval: float = MAX_INTERVAL,
+        fast_window: float = FAST_WINDOW,
+        backoff_factor: float = BACKOFF_FACTOR,
+    ) -> None:
+        """Initialise the cadence at the base interval."""
+        self._base_interval = base_interval
+        self._fast_interval = fast_interval
+        self._max_interval = max_interval
+        self._fast_window = fast_window
+        self._backoff_factor = backoff_factor
+        self._idle_interval = base_interval
+        self._fast_until = 0
+        # Set from the decoded status, possibly from another thread.
+        self.busy = False
+
+    def reset(self) -> None:
+        """Start again from the base interval, e.g. on a new connection."""
+        self._idle_interval = self._base_interval
+        self._fast_until = 0
+
+    def command_sent(self, now: float) -> None:
+        """Poll fast for a while, since the command should change the status."""
+        self._fast_until = now + self._fast_window
+
+    def status_received(self, changed: bool) -> None:
+        """Back off while the status stays the same, start again once it changes."""
+        if changed:
+            self._idle_interval = self._base_interval
+        else:
+            self._idle_interval = min(
+                self._idle_interval * self._backoff_factor, self._max_interval
+            )
+
+    def interval(self, now: float) -> float:
+        """Return the seconds the connection may stay idle before polling."""
+        if self.busy or now < self._fast_until:
+            return min(self._fast_interval, self._idle_interval)
+        return self._idle_interval
@@ -0,0 +1,252 @@
+"""Record the bytes exchanged with a unit, and replay them through the parser.
+
+A capture file starts with MAGIC and is followed by one record per chunk of data
+received from or sent to the unit, each a RECORD header (monotonic timestamp,
+direction and length) and the data. Records are only ever appended, so a capture
+cut short by a crash is still readable up to its last complete record. Closing the
+writer appends an index of record offsets and a TRAILER pointing at it, so a reader
+can find any record without scanning the file.
+"""
+
+from array import array
+import enum
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Any, Callable, Iterator, NamedTuple, Optional, Sequence
+
+from .session import RinnaiSession
+
+_LOGGER = logging.getLogger(__name__)
+
+MAGIC = b"RNCAP001"
+# Timestamp, direction and length of the data that follows.
+RECORD = struct.Struct("<dBI")
+# Offset of each record from the start of the file.
+INDEX_ENTRY = struct.Struct("<Q")
+# Offset of the index, number of records, and TRAILER_MAGIC.
+TRAILER = struct.Struct("<QQ8s")
+TRAILER_MAGIC = b"RNCAPIDX"
+
+
+class RinnaiCaptureDirection(enum.IntEnum):
+    """What a capture record holds."""
+
+    RECEIVED = 1
+    SENT = 2
+    # A new connection to the unit was made. Has no data.
+    CONNECTED = 3
+
+
+class RinnaiCaptureRecord(NamedTuple):
+    """One record of a capture.
+
+    data is copied out of the capture file, so it stays valid after the reader is
+    closed.
+    """
+
+    timestamp: float
+    direction: RinnaiCaptureDirection
+    data: bytes
+
+
+class RinnaiCaptureWriter:
+    """Append the traffic of a connection to a capture file.
+
+    May be shared by the threads of a connection, records are written whole.
+    """
+
+    def __init__(self, path: str) -> None:
+        """Create the capture file, failing if it already exists."""
+        self._file = open(path, "xb")  # pylint: disable=consider-using-with
+        self._file.write(MAGIC)
+        self._offset = len(MAGIC)
+        self._offsets = array("Q")
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Return the number of records written."""
+        return len(self._offsets)
+
+    def record(
+        self,
+        direction: RinnaiCaptureDirection,
+        data: bytes = b"",
+        now: Optional[float] = None,
+    ) -> None:
+        """Append a record of data, taken now (by default, time.monotonic)."""
+        if now is None:
+            now = time.monotonic()
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.write(RECORD.pack(now, direction, len(data)))
+            self._file.write(data)
+            self._offsets.append(self._offset)
+            self._offset += RECORD.size + len(data)
+
+    def flush(self) -> None:
+        """Make everything recorded so far visible to readers."""
+        with self._lock:
+            if not self._file.closed:
+                self._file.flush()
+
+    def close(self) -> None:
+        """Write the index and close the file. Further records are ignored."""
+        with self._lock:
+            if self._file.closed:
+                return
+            for offset in self._offsets:
+                self._file.write(INDEX_ENTRY.pack(offset))
+            self._file.write(TRAILER.pack(self._offset, len(self._offsets), TRAILER_MAGIC))
+            self._file.close()
+
+    def __enter__(self) -> "RinnaiCaptureWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class RinnaiCaptureReader(Sequence):
+    """Read a capture file through mmap, so it never has to fit in memory.
+
+    Records are looked up through the index written when the capture was closed. A
+    capture without one, e.g. because it is still being written, is scanned once
+    for the offsets of its complete records instead.
+    """
+
+    def __init__(self, path: str) -> None:
+        """Map the capture file, raising ValueError if it is not a capture."""
+        with open(path, "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            if size < len(MAGIC):
+                raise ValueError(f"{path} is not a capture file")
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[: len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a capture file")
+        self._index_offset, self._count = self._read_trailer(size)
+        self._offsets: Optional[array] = None
+        if self._index_offset is None:
+            _LOGGER.debug("Capture %s has no index, scanning it", path)
+            self._offsets = self._scan()
+            self._count = len(self._offsets)
+
+    def _read_trailer(self, size: int):
+        """Return the index offset and record count, or None if there is no index."""
+        if size < len(MAGIC) + TRAILER.size:
+            return None, 0
+        index_offset, count, magic = TRAILER.unpack_from(self._map, size - TRAILER.size)
+        if (
+            magic != TRAILER_MAGIC
+            or index_offset + count * INDEX_ENTRY.size + TRAILER.size != size
+        ):
+            return None, 0
+        return index_offset, count
+
+    def _scan(self) -> array:
+        """Return the offsets of the complete records."""
+        offsets = array("Q")
+        offset = len(MAGIC)
+        end = len(self._map)
+        while offset + RECORD.size <= end:
+            length = RECORD.unpack_from(self._map, offset)[2]
+            if offset + RECORD.size + length > end:
+                break
+            offsets.append(offset)
+            offset += RECORD.size + length
+        return offsets
+
+    def __len__(self) -> int:
+        """Return the number of records."""
+        return self._count
+
+    def __getitem__(self, index):
+        """Return the record at index."""
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("capture record index out of range")
+        if self._offsets is not None:
+            offset = self._offsets[index]
+        else:
+            offset = INDEX_ENTRY.unpack_from(
+                self._map, self._index_offset + index * INDEX_ENTRY.size
+            )[0]
+        timestamp, direction, length = RECORD.unpack_from(self._map, offset)
+        start = offset + RECORD.size
+        # Copied, since a view would keep the map from being closed for as long as
+        # anybody held on to the record.
+        return RinnaiCaptureRecord(
+            timestamp, RinnaiCaptureDirection(direction), self._map[start : start + length]
+        )
+
+    def __iter__(self) -> Iterator[RinnaiCaptureRecord]:
+        for index in range(self._count):
+            yield self[index]
+
+    def close(self) -> None:
+        """Unmap the file."""
+        self._map.close()
+
+    def __enter__(self) -> "RinnaiCaptureReader":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+
+class RinnaiCaptureReplay:  # pylint: disable=too-few-public-methods
+    """Feed the data received in a capture through a session, as the connection did.
+
+    status_handler is called with every status decoded, exactly as a connection's
+    would be. speed scales the time between records: 1 replays at the speed the
+    traffic was captured, 2 twice as fast, and None as fast as possible. Unlike a
+    connection, by default every status is decoded, even one identical to the last;
+    full_refresh_interval works as it does for RinnaiSession.
+    """
+
+    def __init__(
+        self,
+        capture: RinnaiCaptureReader,
+        status_handler: Callable[[Any], None],
+        *,
+        speed: Optional[float] = 1,
+        full_refresh_interval: Optional[float] = 0,
+    ) -> None:
+        """Initialise the replay. Nothing is fed until run is called."""
+        self._capture = capture
+        self._session = RinnaiSession(
+            status_handler, full_refresh_interval=full_refresh_interval
+        )
+        self._speed = speed
+        self.records = 0
+        self.bytes_received = 0
+        # Times the data could not be parsed and a connection would have been reset.
+        self.errors = 0
+
+    def run(self) -> None:
+        """Replay the whole capture, returning when done."""
+        start = None
+        first = 0.0
+        for record in self._capture:
+            if start is None:
+                start = time.monotonic()
+                first = record.timestamp
+            if self._speed:
+                due = start + (record.timestamp - first) / self._speed
+                if (delay := due - time.monotonic()) > 0:
+                    time.sleep(delay)
+            self.records += 1
+            if record.direction == RinnaiCaptureDirection.CONNECTED:
+                self._session.reset(time.monotonic())
+            elif record.direction == RinnaiCaptureDirection.RECEIVED:
+                self.bytes_received += len(record.data)
+                if not self._session.data_received(record.data, time.monotonic()):
+                    self.errors += 1
@@ -0,0 +1,229 @@
+"""Queue of commands waiting to be sent to the unit."""
+
+from collections import deque
+from concurrent.futures import Future
+import copy
+import json
+import logging
+from typing import Any, Dict, FrozenSet, Iterator, List, Optional, Tuple
+
+from .const import (
+    GENERAL_SYSTEM_OPERATION,
+    OPERATING_STATE,
+    OVERALL_OPERATION,
+    SWITCH_STATE,
+    SYSTEM,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+# Largest merged command frame, excluding the sequence header.
+MAX_COMMAND_FRAME_SIZE = 512
+
+# (section, field) of the on/off switches. Whether the unit acts on other settings
+# depends on these, so they are always sent on their own.
+_SWITCHES = {
+    (OVERALL_OPERATION, OPERATING_STATE),
+    (GENERAL_SYSTEM_OPERATION, SWITCH_STATE),
+}
+
+
+def _leaf_paths(document: Any, prefix: Tuple[str, ...] = ()) -> Iterator[Tuple[str, ...]]:
+    """Yield the path to every value in a nested JSON object."""
+    if isinstance(document, dict) and document:
+        for key, value in document.items():
+            yield from _leaf_paths(value, prefix + (key,))
+    else:
+        yield prefix
+
+
+def _deep_merge(target: Dict[str, Any], source: Dict[str, Any]) -> None:
+    """Merge source into target, recursing into objects present in both."""
+    for key, value in source.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _deep_merge(target[key], value)
+        else:
+            target[key] = copy.deepcopy(value)
+
+
+class RinnaiCommand:
+    """A command for the unit, with the JSON paths it sets.
+
+    e.g. '{"HGOM": {"ZAO": {"SP": "21" } } }' sets ("HGOM", "ZAO", "SP"), so a later
+    command setting the same path makes this one redundant.
+    """
+
+    def __init__(self, text: str) -> None:
+        """Parse the command to work out what it sets."""
+        self.text = text
+        # Resolved when the frame carrying the command is acknowledged. A command
+        # that supersedes or is merged with others shares their frame's outcome.
+        self.futures: List[Future] = [Future()]
+        self.document: Optional[Dict[str, Any]] = None
+        self.paths: FrozenSet[Tuple[str, ...]] = frozenset()
+        try:
+            document = json.loads(text)
+        except ValueError:
+            document = None
+        if isinstance(document, dict):
+            self.document = document
+            self.paths = frozenset(_leaf_paths(document))
+
+    @property
+    def is_system(self) -> bool:
+        """Return True for system commands (mode switches, setting the time).
+
+        The unit acts on these in sequence, so they are never coalesced and later
+        commands are never coalesced with ones queued before them.
+        """
+        return any(path[0] == SYSTEM for path in self.paths)
+
+    @property
+    def is_switch(self) -> bool:
+        """Return True for commands turning the unit or the system on or off.
+
+        Like system commands, these keep their place relative to everything else.
+        """
+        return any(path[1:3] in _SWITCHES for path in self.paths)
+
+    @property
+    def is_barrier(self) -> bool:
+        """Return True if no command may be coalesced across this one."""
+        return self.is_system or self.is_switch
+
+    @property
+    def unit_id(self) -> Optional[str]:
+        """Return the unit (top level key) addressed, None if there is not just one."""
+        units = {path[0] for path in self.paths}
+        return units.pop() if len(units) == 1 else None
+
+    @property
+    def mergeable(self) -> bool:
+        """Return True if the command may share a frame with others for its unit."""
+        return self.unit_id is not None and not self.is_barrier
+
+    @property
+    def coalesce_key(self) -> Optional[FrozenSet[Tuple[str, ...]]]:
+        """Return the key of commands this one supersedes, None if it never does."""
+        if not self.paths or self.is_barrier:
+            return None
+        return self.paths
+
+    def __len__(self) -> int:
+        """Return the length of the command text."""
+        return len(self.text)
+
+    def __repr__(self) -> str:
+        return f"RinnaiCommand({self.text!r})"
+
+
+class RinnaiCommandQueue:
+    """FIFO of commands where a newer setting replaces a pending older one.
+
+    If a command for the same JSON paths (unit, section, field and zone) is still
+    waiting to be sent, the new command takes its place in the queue instead of
+    being sent after it, so a burst of updates to one setting costs a single round
+    trip to the unit. Not thread safe, callers must hold their own lock.
+    """
+
+    def __init__(self) -> None:
+        """Initialise an empty queue."""
+        self._commands = deque()
+        # Pending commands that can still be superseded, by coalesce key.
+        self._coalescible = {}
+        self._pending_bytes = 0
+        self._superseded = 0
+
+    def __len__(self) -> int:
+        """Return the number of queued commands."""
+        return len(self._commands)
+
+    @property
+    def pending_bytes(self) -> int:
+        """Return the total length of the queued commands."""
+        return self._pending_bytes
+
+    @property
+    def superseded(self) -> int:
+        """Return how many commands were replaced before being sent."""
+        return self._superseded
+
+    def put(self, command: RinnaiCommand) -> bool:
+        """Queue a command. Returns True if it replaced a pending command."""
+        key = command.coalesce_key
+        if command.is_barrier:
+            # Commands queued from now on must not overtake this one.
+            self._coalescible.clear()
+        elif key is not None and key in self._coalescible:
+            pending = self._coalescible[key]
+            _LOGGER.debug("Command %s supersedes %s", command.text, pending.text)
+            self._pending_bytes += len(command) - len(pending)
+            pending.text = command.text
+            pending.document = command.document
+            pending.futures.extend(command.futures)
+            self._superseded += 1
+            return True
+
+        self._commands.append(command)
+        self._pending_bytes += len(command)
+        if key is not None:
+            self._coalescible[key] = command
+        return False
+
+    def pop(self) -> Optional[RinnaiCommand]:
+        """Remove and return the oldest command, or None if the queue is empty."""
+        if not self._commands:
+            return None
+        command = self._commands.popleft()
+        self._pending_bytes -= len(command)
+        key = command.coalesce_key
+        if key is not None and self._coalescible.get(key) is command:
+            del self._coalescible[key]
+        return command
+
+    def pop_frame(
+        self, max_frame_size: int = MAX_COMMAND_FRAME_SIZE
+    ) -> Optional[Tuple[str, List[RinnaiCommand]]]:
+        """Remove the next command, merged with any that can share its frame.
+
+        Consecutive mergeable commands for the same unit are deep-merged into one
+        JSON document as long as it stays within max_frame_size, e.g. several Z?O
+        sections, or GSO plus OOP settings. Returns the frame text and the commands
+        it carries, or None if the queue is empty.
+        """
+        first = self.pop()
+        if first is None:
+            return None
+        batch = [first]
+        text = first.text
+        if not first.mergeable:
+            return text, batch
+
+        document = copy.deepcopy(first.document)
+        paths = set(first.paths)
+        while self._commands:
+            candidate = self._commands[0]
+            if (
+                not candidate.mergeable
+                or candidate.unit_id != first.unit_id
+                or not paths.isdisjoint(candidate.paths)
+            ):
+                break
+            merged = copy.deepcopy(document)
+            _deep_merge(merged, candidate.document)
+            merged_text = json.dumps(merged)
+            if len(merged_text) > max_frame_size:
+                break
+            self.pop()
+            document, text = merged, merged_text
+            paths |= candidate.paths
+            batch.append(candidate)
+        if len(batch) > 1:
+            _LOGGER.debug("Merged %d commands into %s", len(batch), text)
+        return text, batch
+
+    def clear(self) -> None:
+        """Discard all queued commands."""
+        self._commands.clear()
+        self._coalescible.clear()
+        self._pending_bytes = 0
@@ -0,0 +1,64 @@
+"""Heap of named deadlines, so event loops can sleep until the next one is due."""
+
+import heapq
+from typing import Dict, Hashable, List, Optional, Tuple
+
+
+class RinnaiDeadlines:
+    """Keep the earliest of a set of named deadlines at hand.
+
+    Rescheduling a name pushes a new heap entry and leaves the old one behind; stale
+    entries are discarded lazily when they reach the top of the heap, so updates are
+    O(log n) and finding the next deadline is amortised O(1).
+    """
+
+    def __init__(self) -> None:
+        """Initialise an empty set of deadlines."""
+        self._heap: List[Tuple[float, int, Hashable]] = []
+        self._deadlines: Dict[Hashable, float] = {}
+        # Tie breaker, so names never have to be comparable.
+        self._counter = 0
+
+    def __len__(self) -> int:
+        """Return the number of scheduled deadlines."""
+        return len(self._deadlines)
+
+    def __contains__(self, name: Hashable) -> bool:
+        """Return True if name has a deadline scheduled."""
+        return name in self._deadlines
+
+    def set(self, name: Hashable, when: float) -> None:
+        """Schedule (or reschedule) the deadline for name."""
+        if self._deadlines.get(name) == when:
+            return
+        self._deadlines[name] = when
+        self._counter += 1
+        heapq.heappush(self._heap, (when, self._counter, name))
+
+    def cancel(self, name: Hashable) -> None:
+        """Remove the deadline for name, if there is one."""
+        self._deadlines.pop(name, None)
+
+    def clear(self) -> None:
+        """Remove all deadlines."""
+        self._heap.clear()
+        self._deadlines.clear()
+
+    def next(self) -> Optional[Tuple[float, Hashable]]:
+        """Return the earliest (deadline, name), or None if nothing is scheduled."""
+        heap = self._heap
+        while heap:
+            when, _, name = heap[0]
+            if self._deadlines.get(name) == when:
+                return when, name
+            heapq.heappop(heap)
+        return None
+
+    def pop_due(self, now: float) -> List[Hashable]:
+        """Remove and return the names of all deadlines at or before now."""
+        due = []
+        while (entry := self.next()) is not None and entry[0] <= now:
+            heapq.heappop(self._heap)
+            del self._deadlines[entry[1]]
+            due.append(entry[1])
+        return due
@@ -0,0 +1,157 @@
+"""Work out which fields changed between two statuses of a unit."""
+
+import enum
+from typing import Any, Dict, Iterable, Iterator, NamedTuple, Optional
+
+from .const import ALL_ZONES
+
+
+class RinnaiChange(enum.IntFlag):
+    """Parts of the status a change set touches, for quick checks."""
+
+    NONE = 0
+    # Anything at the top of RinnaiSystemStatus without a flag of its own.
+    SYSTEM = enum.auto()
+    MODE = enum.auto()
+    FAULT = enum.auto()
+    # Anything in RinnaiUnitStatus, other than its zones.
+    UNIT = enum.auto()
+    ZONE_A = enum.auto()
+    ZONE_B = enum.auto()
+    ZONE_C = enum.auto()
+    ZONE_D = enum.auto()
+    ZONE_U = enum.auto()
+    ZONES = ZONE_A | ZONE_B | ZONE_C | ZONE_D | ZONE_U
+
+
+# Types of the values of most fields, which need no further look.
+_PLAIN = frozenset((str, int, bool, float, type(None)))
+
+_TOP_LEVEL_FLAGS = {"mode": RinnaiChange.MODE, "has_fault": RinnaiChange.FAULT}
+_ZONE_FLAGS = {zone: RinnaiChange["ZONE_" + zone] for zone in ALL_ZONES}
+
+
+class RinnaiFieldChange(NamedTuple):
+    """A field that changed, by its dotted path, e.g. unit_status.zones.B.temperature.
+
+    old is None for a field that was not there before, e.g. in a zone that has just
+    appeared, and new is None for one that has gone.
+    """
+
+    path: str
+    old: Any
+    new: Any
+
+
+class RinnaiChangeSet:
+    """The fields that changed from one status to the next."""
+
+    def __init__(self, changes: Dict[str, RinnaiFieldChange], mask: RinnaiChange) -> None:
+        """Initialise the change set from the changes by path, and their mask."""
+        self._changes = changes
+        self.mask = mask
+
+    def __bool__(self) -> bool:
+        return bool(self._changes)
+
+    def __len__(self) -> int:
+        return len(self._changes)
+
+    def __iter__(self) -> Iterator[RinnaiFieldChange]:
+        return iter(self._changes.values())
+
+    def __contains__(self, path: str) -> bool:
+        return path in self._changes
+
+    def __repr__(self) -> str:
+        return f"RinnaiChangeSet({list(self._changes.values())!r}, {self.mask!r})"
+
+    @property
+    def paths(self):
+        """Return the paths of the fields that changed."""
+        return self._changes.keys()
+
+    def get(self, path: str) -> Optional[RinnaiFieldChange]:
+        """Return the change to the field at path, or None if it did not change."""
+        return self._changes.get(path)
+
+    def affects(self, mask: RinnaiChange) -> bool:
+        """Return True if any of the parts in mask changed."""
+        return bool(self.mask & mask)
+
+    def select(self, paths: Iterable[str]) -> "RinnaiChangeSet":
+        """Return a change set of just the changes to the fields at paths."""
+        changes = {path: self._changes[path] for path in paths if path in self._changes}
+        mask = RinnaiChange.NONE
+        for path in changes:
+            mask |= _flag(path)
+        return RinnaiChangeSet(changes, mask)
+
+    def merge(self, later: "RinnaiChangeSet") -> "RinnaiChangeSet":
+        """Return the changes from before this change set to after the later one.
+
+        Fields the later one changed back to what they were before this are left out.
+        """
+        changes = dict(self._changes)
+        for path, change in later._changes.items():  # pylint: disable=protected-access
+            earlier = changes.get(path)
+            if earlier is None:
+                changes[path] = change
+            elif earlier.old == change.new:
+                del changes[path]
+            else:
+                changes[path] = RinnaiFieldChange(path, earlier.old, change.new)
+        mask = RinnaiChange.NONE
+        for path in changes:
+            mask |= _flag(path)
+        return RinnaiChangeSet(changes, mask)
+
+
+def snapshot(status: Any) -> Dict[str, Any]:
+    """Return every field of a status by its dotted path, for comparing with diff."""
+    fields: Dict[str, Any] = {}
+    _collect(status, "", fields)
+    return fields
+
+
+def _collect(value: Any, prefix: str, fields: Dict[str, Any]) -> None:
+    """Add the fields of a status object or dict to fields, under prefix."""
+    items = value.items() if isinstance(value, dict) else vars(value).items()
+    for key, item in items:
+        if type(item) in _PLAIN or isinstance(item, enum.Enum):
+            fields[prefix + key] = item
+        elif isinstance(item, dict) or hasattr(item, "__dict__"):
+            # Nothing in an empty one yet, e.g. the zones before the first status.
+            if item:
+                _collect(item, prefix + key + ".", fields)
+        else:
+            fields[prefix + key] = item
+
+
+def _flag(path: str) -> RinnaiChange:
+    """Return the part of the status the field at path is in."""
+    if not path.startswith("unit_status."):
+        return _TOP_LEVEL_FLAGS.get(path, RinnaiChange.SYSTEM)
+    if path.startswith("unit_status.zones."):
+        return _ZONE_FLAGS.get(path.split(".", 3)[2], RinnaiChange.ZONES)
+    return RinnaiChange.UNIT
+
+
+def diff(old: Optional[Dict[str, Any]], new: Dict[str, Any]) -> RinnaiChangeSet:
+    """Return the changes from one snapshot to the next.
+
+    With no old snapshot every field counts as changed.
+    """
+    if old is None:
+        old = {}
+    changes = {}
+    mask = RinnaiChange.NONE
+    for path, value in new.items():
+        previous = old.get(path)
+        if previous != value or path not in old:
+            changes[path] = RinnaiFieldChange(path, previous, value)
+            mask |= _flag(path)
+    for path in old.keys() - new.keys():
+        changes[path] = RinnaiFieldChange(path, old[path], None)
+        mask |= _flag(path)
+    return RinnaiChangeSet(changes, mask)
@@ -0,0 +1,335 @@
+"""Process-wide listener for the UDP broadcasts modules use to announce themselves."""
+
+import asyncio
+from collections import defaultdict
+from concurrent.futures import Future, InvalidStateError
+import logging
+import selectors
+import socket
+import threading
+import time
+from typing import Any, Dict, List, NamedTuple, Optional, Union
+
+_LOGGER = logging.getLogger(__name__)
+
+BROADCAST_PREFIX = b"Rinnai_NBW2_Module"
+DISCOVERY_PORT = 50000
+
+# Receive buffer to ask for, so that bursts of broadcasts from many units are not
+# dropped before the listener gets to them.
+RECEIVE_BUFFER_SIZE = 1 << 20
+
+# A unit seen this recently is connected to straight away, without waiting for its
+# next broadcast.
+RECENTLY_SEEN_SECONDS = 120
+
+
+class RinnaiModuleInfo(NamedTuple):
+    """A module that has announced itself on the network."""
+
+    ip_address: str
+    # The module name from the broadcast, e.g. "Rinnai_NBW2_Module".
+    module: str
+    # The broadcast as received, the rest of which is not understood yet.
+    payload: bytes
+    # time.monotonic() of the last broadcast, or of the last successful connection.
+    last_seen: float
+
+
+class _DiscoveryProtocol(asyncio.DatagramProtocol):
+    """Forward broadcasts received on an event loop to the discovery listener."""
+
+    def __init__(self, discovery: "RinnaiDiscovery") -> None:
+        self._discovery = discovery
+
+    def datagram_received(self, data: bytes, addr: Any) -> None:
+        """Record the broadcast."""
+        self._discovery._datagram_received(data, addr[0])  # pylint: disable=protected-access
+
+    def error_received(self, exc: Exception) -> None:
+        """Log errors on the socket, which stays open."""
+        _LOGGER.error("Unexpected broadcast error: %s", exc)
+
+
+class _ThreadListener:
+    """Receives broadcasts on a socket and thread of its own."""
+
+    loop = None
+
+    def __init__(self, discovery: "RinnaiDiscovery", sock: socket.socket) -> None:
+        """Start the thread listening on sock, which it closes once stopped."""
+        self._stop = threading.Event()
+        wake_reader, self._wake_writer = socket.socketpair()
+        selector = selectors.DefaultSelector()
+        selector.register(sock, selectors.EVENT_READ)
+        selector.register(wake_reader, selectors.EVENT_READ)
+        self._thread = threading.Thread(
+            target=discovery._listen,  # pylint: disable=protected-access
+            args=(sock, selector, wake_reader, self._stop),
+            name="RinnaiDiscovery",
+            daemon=True,
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Ask the thread to stop, without waiting for it."""
+        self._stop.set()
+        try:
+            self._wake_writer.send(b"\0")
+        except OSError:
+            pass
+
+    def join(self) -> None:
+        """Wait for the thread to stop."""
+        self._thread.join(5)
+        self._wake_writer.close()
+
+
+class _LoopListener:
+    """Receives broadcasts on a socket of its own, on an asyncio event loop."""
+
+    def __init__(
+        self, discovery: "RinnaiDiscovery", sock: socket.socket, loop: asyncio.AbstractEventLoop
+    ) -> None:
+        """Start listening on sock from the loop, which closes it once stopped."""
+        self.loop = loop
+        self._sock = sock
+        self._transport: Optional[asyncio.DatagramTransport] = None
+        # Only looked at on the loop, after being set.
+        self._stopped = False
+        asyncio.run_coroutine_threadsafe(self._open(discovery), loop)
+
+    async def _open(self, discovery: "RinnaiDiscovery") -> None:
+        try:
+            transport, _ = await self.loop.create_datagram_endpoint(
+                lambda: _DiscoveryProtocol(discovery), sock=self._sock
+            )
+        except OSError as e:
+            _LOGGER.error("Unexpected broadcast error: %s", e)
+            self._sock.close()
+            return
+        if self._stopped:
+            transport.close()
+        else:
+            self._transport = transport
+
+    def stop(self) -> None:
+        """Stop listening, from any thread."""
+        self._stopped = True
+        try:
+            self.loop.call_soon_threadsafe(self._close)
+        except RuntimeError:
+            # The loop has been closed, so nothing is listening any more.
+            self._sock.close()
+
+    def _close(self) -> None:
+        if self._transport is not None:
+            self._transport.close()
+
+    def join(self) -> None:
+        """Nothing to wait for, the loop closes the socket."""
+
+
+class RinnaiDiscovery:  # pylint: disable=too-many-instance-attributes
+    """Listen on the discovery port on behalf of every connection in the process.
+
+    Only one socket can be bound to the port, so connections share one instance per
+    port (see get_instance). Broadcasts are kept in an inventory by IP address, and
+    connections waiting for a unit are woken as soon as it is heard from. A unit
+    seen recently does not have to be waited for at all.
+
+    The port is listened on by a thread while any threaded connection holds the
+    listener, and otherwise on the event loop of an asyncio connection holding it,
+    so that asyncio connections need no threads.
+    """
+
+    instances: Dict[int, "RinnaiDiscovery"] = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(self, port: int = DISCOVERY_PORT, address: str = "0.0.0.0") -> None:
+        """Initialise the listener. Nothing is bound until it is acquired."""
+        self._port = port
+        self._address = address
+        # Guards everything below, which is shared with the listening thread.
+        self._lock = threading.Lock()
+        self._inventory: Dict[str, RinnaiModuleInfo] = {}
+        self._waiters: Dict[str, List[Future]] = defaultdict(list)
+        # Users without an event loop, and the number on each event loop.
+        self._thread_users = 0
+        self._loop_users: Dict[asyncio.AbstractEventLoop, int] = {}
+        self._error: Optional[OSError] = None
+        self._listener: Union[_ThreadListener, _LoopListener, None] = None
+
+    @staticmethod
+    def get_instance(port: int = DISCOVERY_PORT) -> "RinnaiDiscovery":
+        """Get the single listener for the given port."""
+        with RinnaiDiscovery._instances_lock:
+            if port not in RinnaiDiscovery.instances:
+                RinnaiDiscovery.instances[port] = RinnaiDiscovery(port)
+            return RinnaiDiscovery.instances[port]
+
+    def inventory(self) -> Dict[str, RinnaiModuleInfo]:
+        """Return the modules heard from so far, by IP address."""
+        with self._lock:
+            return dict(self._inventory)
+
+    def acquire(self, loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+        """Register a user of the listener, starting it if need be.
+
+        An asyncio connection passes its event loop, which the port is listened on
+        from unless a threaded connection holds the listener too.
+        """
+        with self._lock:
+            if loop is None:
+                self._thread_users += 1
+            else:
+                self._loop_users[loop] = self._loop_users.get(loop, 0) + 1
+            stopped = self._reconcile()
+        if stopped is not None:
+            stopped.join()
+
+    def release(self, loop: Optional[asyncio.AbstractEventLoop] = None) -> None:
+        """Unregister a user of the listener, stopping it once nobody is left."""
+        with self._lock:
+            if loop is None:
+                self._thread_users = max(self._thread_users - 1, 0)
+            elif loop in self._loop_users:
+                self._loop_users[loop] -= 1
+                if not self._loop_users[loop]:
+                    del self._loop_users[loop]
+            stopped = self._reconcile()
+        if stopped is not None:
+            stopped.join()
+            _LOGGER.debug("Discovery listener on port %d stopped", self._port)
+
+    def discover(
+        self, ip_address: str, max_age: float = RECENTLY_SEEN_SECONDS
+    ) -> Future:
+        """Return a future resolving to the RinnaiModuleInfo of the unit at ip_address.
+
+        Resolves straight away if the unit was seen within max_age seconds, otherwise
+        on its next broadcast. Fails with OSError if the port cannot be listened on.
+        The caller may cancel the future once it is no longer interested.
+        """
+        future = Future()
+        with self._lock:
+            info = self._inventory.get(ip_address)
+            if info is not None and time.monotonic() - info.last_seen <= max_age:
+                future.set_result(info)
+                return future
+            if self._listener is None:
+                # Binding failed before, try again.
+                self._reconcile()
+                if self._listener is None:
+                    future.set_exception(self._error)
+                    return future
+            waiters = self._waiters[ip_address]
+            waiters[:] = [waiter for waiter in waiters if not waiter.done()]
+            waiters.append(future)
+        return future
+
+    def touch(self, ip_address: str) -> None:
+        """Record that the unit was just known to be reachable.
+
+        Connections call this once connected, so that connecting again soon after
+        does not have to wait for the unit's next broadcast.
+        """
+        with self._lock:
+            info = self._inventory.get(ip_address)
+            if info is None:
+                info = RinnaiModuleInfo(ip_address, "", b"", 0)
+            self._inventory[ip_address] = info._replace(last_seen=time.monotonic())
+
+    def _reconcile(self) -> Union[_ThreadListener, _LoopListener, None]:
+        """Listen the way the users need, starting or replacing the listener.
+
+        Called with _lock held. Returns the listener stopped, if any, to be joined
+        once _lock is released.
+        """
+        if self._thread_users:
+            loop = None
+        elif self._listener is not None and self._listener.loop in self._loop_users:
+            loop = self._listener.loop
+        elif self._loop_users:
+            loop = next(iter(self._loop_users))
+        else:
+            stopped, self._listener = self._listener, None
+            if stopped is not None:
+                stopped.stop()
+            return stopped
+        if self._listener is not None and self._listener.loop is loop:
+            return None
+        stopped, self._listener = self._listener, None
+        if stopped is not None:
+            stopped.stop()
+        self._start(loop)
+        return stopped
+
+    def _start(self, loop: Optional[asyncio.AbstractEventLoop]) -> None:
+        """Bind the port and listen, on a thread or the loop. Called with _lock held."""
+        sock = None
+        try:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER_SIZE)
+            sock.bind((self._address, self._port))
+        except OSError as e:
+            _LOGGER.error("Unexpected broadcast error: %s", e)
+            self._error = e
+            if sock is not None:
+                sock.close()
+            return
+        sock.setblocking(False)
+        self._error = None
+        if loop is None:
+            self._listener = _ThreadListener(self, sock)
+        else:
+            self._listener = _LoopListener(self, sock, loop)
+        _LOGGER.debug("Discovery listener on port %d started", self._port)
+
+    def _listen(
+        self,
+        sock: socket.socket,
+        selector: selectors.BaseSelector,
+        wake_reader: socket.socket,
+        stop: threading.Event,
+    ) -> None:
+        """Thread receiving broadcasts on sock until stop is set."""
+        try:
+            while not stop.is_set():
+                for key, _ in selector.select():
+                    if key.fileobj is wake_reader:
+                        wake_reader.recv(4096)
+                        continue
+                    # Drain everything that has arrived, not just one datagram.
+                    while True:
+                        try:
+                            data, addr = sock.recvfrom(1024)
+                        except (BlockingIOError, InterruptedError):
+                            break
+                        except OSError as e:
+                            _LOGGER.error("Unexpected broadcast error: %s", e)
+                            break
+                        self._datagram_received(data, addr[0])
+        finally:
+            selector.close()
+            sock.close()
+            wake_reader.close()
+
+    def _datagram_received(self, data: bytes, ip_address: str) -> None:
+        """Record a module broadcast and wake whoever is waiting for it."""
+        if not data.startswith(BROADCAST_PREFIX):
+            return
+        _LOGGER.debug("Broadcast data: %s", data.hex())
+        _LOGGER.debug("Broadcast received from address: %s", ip_address)
+        module = data.split(b"\0", 1)[0].decode("ascii", "replace")
+        info = RinnaiModuleInfo(ip_address, module, data, time.monotonic())
+        with self._lock:
+            self._inventory[ip_address] = info
+            waiters = self._waiters.pop(ip_address, [])
+        for waiter in waiters:
+            try:
+                waiter.set_result(info)
+            except InvalidStateError:
+                # Cancelled by the caller.
+                pass
@@ -0,0 +1,186 @@
+"""Call status subscribers off the thread handling the statuses."""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+_LOGGER = logging.getLogger(__name__)
+
+# Threads calling the subscribers of all the systems sharing a dispatcher.
+DISPATCH_WORKERS = 4
+# A subscriber taking longer than this to handle an update is flagged as slow.
+SLOW_HANDLER_SECONDS = 0.1
+
+# Combines the arguments of an update still waiting with those of a newer one.
+Conflate = Callable[[Tuple, Tuple], Tuple]
+
+
+class RinnaiMailbox:
+    """The latest update for one subscriber, until it gets round to handling it.
+
+    A mailbox holds at most one update. Posting another before the subscriber has
+    been called replaces it (or is combined with it by conflate, e.g. to merge change
+    sets), and counts as dropping one. The mailbox is called like the handler it
+    wraps, so it can be added to an Event in its place.
+    """
+
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(
+        self,
+        handler: Callable[..., Any],
+        dispatcher: "RinnaiDispatcher",
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+        conflate: Optional[Conflate] = None,
+    ) -> None:
+        """Initialise the mailbox for handler, serviced by the loop if given."""
+        self.handler = handler
+        self.name = getattr(handler, "__qualname__", None) or repr(handler)
+        self._dispatcher = dispatcher
+        self._loop = loop
+        self._conflate = conflate
+        self._lock = threading.Lock()
+        # The arguments of the update waiting, and when it was posted.
+        self._pending: Optional[Tuple[Tuple, float]] = None
+        # Whether a worker or the loop is due to call the handler.
+        self._scheduled = False
+        self._delivered = 0
+        self._dropped = 0
+        self._errors = 0
+        self._slow_calls = 0
+        self._handler_seconds = 0.0
+        self._max_handler_seconds = 0.0
+        self._wait_seconds = 0.0
+        self.slow = False
+
+    def __call__(self, *args: Any) -> None:
+        """Post an update, replacing any the subscriber has not handled yet."""
+        now = time.monotonic()
+        if self._loop is None and self._dispatcher.inline:
+            self._deliver(args, now)
+            return
+        with self._lock:
+            if self._pending is not None:
+                self._dropped += 1
+                if self._conflate is not None:
+                    args = self._conflate(self._pending[0], args)
+            self._pending = (args, now)
+            if self._scheduled:
+                return
+            self._scheduled = True
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._drain)
+        else:
+            self._dispatcher.submit(self._drain)
+
+    def _drain(self) -> None:
+        """Call the handler until no update is waiting."""
+        while True:
+            with self._lock:
+                if self._pending is None:
+                    self._scheduled = False
+                    return
+                args, posted = self._pending
+                self._pending = None
+            self._deliver(args, posted)
+
+    def _deliver(self, args: Tuple, posted: float) -> None:
+        """Call the handler with one update, timing it."""
+        start = time.monotonic()
+        try:
+            self.handler(*args)
+        except Exception:  # pylint: disable=broad-except
+            self._errors += 1
+            _LOGGER.exception("Error in subscriber %s", self.name)
+        elapsed = time.monotonic() - start
+        self._delivered += 1
+        self._wait_seconds += start - posted
+        self._handler_seconds += elapsed
+        self._max_handler_seconds = max(self._max_handler_seconds, elapsed)
+        slow = elapsed > self._dispatcher.slow_handler_seconds
+        if slow:
+            self._slow_calls += 1
+            if not self.slow:
+                _LOGGER.warning(
+                    "Subscriber %s took %.3f s to handle an update", self.name, elapsed
+                )
+        self.slow = slow
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Get counters describing how the subscriber keeps up with updates."""
+        delivered = self._delivered
+        return {
+            "delivered": delivered,
+            "dropped": self._dropped,
+            "errors": self._errors,
+            "slow_calls": self._slow_calls,
+            "slow": self.slow,
+            "mean_handler_seconds": self._handler_seconds / delivered if delivered else 0.0,
+            "max_handler_seconds": self._max_handler_seconds,
+            "mean_wait_seconds": self._wait_seconds / delivered if delivered else 0.0,
+        }
+
+
+class RinnaiDispatcher:
+    """Calls subscribers on a small pool of threads, so none holds up the others.
+
+    Every subscriber gets a RinnaiMailbox of its own and is called by one worker at
+    a time, in the order of its updates, skipping any that were superseded while it
+    was busy. A subscriber can instead be called on its own event loop. A dispatcher
+    can be shared by many systems, and get_default returns the one they share unless
+    given their own. With workers=0 subscribers without a loop are called straight
+    away on the thread posting the update, as Event would.
+    """
+
+    _default: Optional["RinnaiDispatcher"] = None
+    _default_lock = threading.Lock()
+
+    def __init__(
+        self,
+        workers: int = DISPATCH_WORKERS,
+        slow_handler_seconds: float = SLOW_HANDLER_SECONDS,
+    ) -> None:
+        """Initialise the dispatcher. Its threads are started as they are needed."""
+        self.slow_handler_seconds = slow_handler_seconds
+        self._executor: Optional[ThreadPoolExecutor] = None
+        if workers:
+            self._executor = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="RinnaiDispatcher"
+            )
+
+    @staticmethod
+    def get_default() -> "RinnaiDispatcher":
+        """Get the dispatcher shared by the systems not given one of their own."""
+        with RinnaiDispatcher._default_lock:
+            if RinnaiDispatcher._default is None:
+                RinnaiDispatcher._default = RinnaiDispatcher()
+            return RinnaiDispatcher._default
+
+    @property
+    def inline(self) -> bool:
+        """Return True if subscribers are called on the thread posting updates."""
+        return self._executor is None
+
+    def mailbox(
+        self,
+        handler: Callable[..., Any],
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+        conflate: Optional[Conflate] = None,
+    ) -> RinnaiMailbox:
+        """Return a mailbox calling handler, on the loop if given."""
+        return RinnaiMailbox(handler, self, loop, conflate)
+
+    def submit(self, function: Callable[[], Any]) -> None:
+        """Call function on one of the workers."""
+        if self._executor is None:
+            function()
+        else:
+            self._executor.submit(function)
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop the workers, once they have handled the updates already posted."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait)
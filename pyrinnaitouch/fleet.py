@@ -0,0 +1,526 @@
+"""Drive the connections to many units from a single selector loop."""
+
+from collections import deque
+from concurrent.futures import Future
+import errno
+import logging
+import selectors
+import socket
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from .cadence import RinnaiPollCadence
+from .deadlines import RinnaiDeadlines
+from .discovery import DISCOVERY_PORT, RinnaiDiscovery
+from .pollconnection import (
+    CONNECT_TIMEOUT_SECONDS,
+    RECEIVE_SIZE,
+    UNIT_PORT,
+    RinnaiConnection,
+    RinnaiConnectionState,
+    state_for_errno,
+)
+from .reconnect import RinnaiReconnectPolicy
+from .session import COMMAND_WINDOW, FULL_REFRESH_SECONDS, RinnaiSession
+
+_LOGGER = logging.getLogger(__name__)
+
+
+class RinnaiFleetConnection(RinnaiConnection):  # pylint: disable=too-many-instance-attributes
+    """Connection to one unit, driven by a RinnaiFleet rather than a thread of its own.
+
+    Has the same start/stop interface as RinnaiAsyncConnection. Status frames are
+    decoded and passed to status_handler on the fleet's thread.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        fleet: "RinnaiFleet",
+        ip_address: str,
+        status_handler: Callable[[Any], None],
+        port: int = UNIT_PORT,
+        discovery_port: int = DISCOVERY_PORT,
+        *,
+        command_window: int = COMMAND_WINDOW,
+        cadence: Optional[RinnaiPollCadence] = None,
+        reconnect: Optional[RinnaiReconnectPolicy] = None,
+        full_refresh_interval: Optional[float] = FULL_REFRESH_SECONDS,
+    ) -> None:
+        """Initialise the connection object."""
+        super().__init__(ip_address)
+        self._fleet = fleet
+        self._port = port
+        self._udp_port = discovery_port
+        self._reconnect = reconnect or RinnaiReconnectPolicy()
+        self._session = RinnaiSession(
+            status_handler,
+            command_window=command_window,
+            cadence=cadence,
+            full_refresh_interval=full_refresh_interval,
+        )
+
+        # Only touched from the fleet's thread.
+        self._selector: selectors.BaseSelector = None
+        self._discovery: RinnaiDiscovery = None
+        self._discovering: Future = None
+        self._socket: socket.socket = None
+        self._registered_mask = 0
+        # While connecting, when to give up. After a failure, when to try again.
+        self._connect_deadline: Optional[float] = None
+        self._retry_time: Optional[float] = None
+
+    def send_command(self, command: str) -> Future:
+        """Queue a command to be sent to the unit.
+
+        Returns a future that resolves once the unit acknowledges the command. Raises
+        RinnaiBackpressureError straight away if too many commands are already
+        waiting for the unit, since blocking could stall the whole fleet.
+        """
+        future = self._session.send_command(command, timeout=0)
+        self._fleet.wake(self)
+        return future
+
+    def set_busy(self, busy: bool) -> None:
+        """Tell the connection whether the unit is busy, so it polls faster."""
+        if self._session.set_busy(busy):
+            self._fleet.wake(self)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Return counters describing the connection."""
+        return {**self._session.get_metrics(), **self._reconnect.get_metrics()}
+
+    def start(self) -> None:
+        """Hand the connection to the fleet, which connects to the unit."""
+        self._register_client()
+        self._fleet.add(self)
+
+    def stop(self) -> None:
+        """Take the connection out of the fleet and release the unit."""
+        self._fleet.remove(self)
+        self._release_client()
+
+    def _attach(self, selector: selectors.BaseSelector) -> None:
+        """Start being driven by the fleet. Called on the fleet's thread."""
+        self._selector = selector
+        self._discovery = RinnaiDiscovery.get_instance(self._udp_port)
+        self._discovery.acquire()
+
+    def _detach(self) -> None:
+        """Close everything down. Called on the fleet's thread."""
+        self._close_socket()
+        if self._discovering is not None:
+            self._discovering.cancel()
+            self._discovering = None
+        self._session.close()
+        if self._discovery is not None:
+            self._discovery.release()
+            self._discovery = None
+        self._selector = None
+
+    def _service(self, now: float) -> Optional[float]:
+        """Move the connection along. Returns when it next needs attention, if ever."""
+        if self._socketstate == RinnaiConnectionState.CONNECTED:
+            return self._service_session(now)
+
+        if self._socket is not None:
+            # Connecting, and the socket has not become writable yet.
+            if now < self._connect_deadline:
+                return self._connect_deadline
+            self._close_socket()
+            return self._connect_failed(RinnaiConnectionState.TIMEOUT, now)
+
+        if self._retry_time is not None:
+            if now < self._retry_time:
+                return self._retry_time
+            self._retry_time = None
+
+        # Go straight back to the unit where it was last seen, unless that has not
+        # worked for a while.
+        discovered = self._reconnect.needs_discovery()
+        if discovered:
+            if self._discovering is None:
+                self._discovering = self._discovery.discover(
+                    self._ip_address, self._reconnect.discovery_max_age(now)
+                )
+                self._discovering.add_done_callback(lambda _: self._fleet.wake(self))
+            if not self._discovering.done():
+                return None
+            found, self._discovering = self._discovering, None
+            try:
+                found.result()
+                self._update_socket_state(RinnaiConnectionState.CONNECTING)
+            except OSError as e:
+                self._update_socket_state(RinnaiConnectionState.ERROR)
+                _LOGGER.error("Unexpected broadcast error: %s", e)
+        elif self._socketstate == RinnaiConnectionState.IDLE:
+            self._update_socket_state(RinnaiConnectionState.CONNECTING)
+        return self._begin_connect(now, discovered)
+
+    def _begin_connect(self, now: float, discovered: bool) -> Optional[float]:
+        """Start a non-blocking connection attempt."""
+        self._reconnect.attempt_started(now, discovered)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        try:
+            result = sock.connect_ex((self._ip_address, self._port))
+        except OSError as e:
+            result = e.errno
+        if result not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            sock.close()
+            return self._connect_failed(state_for_errno(result), now)
+        self._socket = sock
+        self._connect_deadline = now + CONNECT_TIMEOUT_SECONDS
+        self._watch(selectors.EVENT_WRITE)
+        return self._connect_deadline
+
+    def _connect_failed(self, socketstate: RinnaiConnectionState, now: float) -> float:
+        """Record a failed connection attempt and schedule the next one."""
+        self._update_socket_state(socketstate)
+        self._retry_time = now + self._reconnect.attempt_failed(now)
+        return self._retry_time
+
+    def _failed(self, now: float) -> float:
+        """Drop the unit after its handling raised, and back off before trying again.
+
+        Returns when to try again. Called on the fleet's thread.
+        """
+        if self._socketstate == RinnaiConnectionState.CONNECTED:
+            self._reconnect.disconnected(now)
+        self._close_socket()
+        self._connect_deadline = None
+        self._retry_time = now + self._reconnect.attempt_failed(now)
+        self._update_socket_state(RinnaiConnectionState.ERROR)
+        return self._retry_time
+
+    def _handle_events(self, mask: int, now: float) -> None:
+        """React to the socket becoming readable or writable."""
+        if self._socketstate != RinnaiConnectionState.CONNECTED:
+            error = self._socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if error:
+                self._close_socket()
+                self._connect_failed(state_for_errno(error), now)
+                return
+            self._connect_deadline = None
+            self._reconnect.attempt_succeeded(now)
+            self._discovery.touch(self._ip_address)
+            self._update_socket_state(RinnaiConnectionState.CONNECTED)
+            # Reset the timestamps and command sequence number
+            self._session.reset(now)
+            self._watch(selectors.EVENT_READ)
+            return
+
+        if mask & selectors.EVENT_READ:
+            try:
+                with self._session.get_buffer(RECEIVE_SIZE) as view:
+                    nbytes = self._socket.recv_into(view)
+            except (BlockingIOError, InterruptedError):
+                nbytes = None
+            except OSError as ose:
+                _LOGGER.error("Socket error on recv: %s. Reconnecting", ose)
+                self._disconnect(RinnaiConnectionState.IDLE)
+                return
+            if nbytes == 0:
+                _LOGGER.info("Socket disconnected. Reconnecting")
+                self._disconnect(RinnaiConnectionState.IDLE)
+                return
+            if nbytes and not self._session.buffer_updated(nbytes, now):
+                self._disconnect(RinnaiConnectionState.ERROR)
+                return
+
+        if mask & selectors.EVENT_WRITE:
+            self._flush(now)
+
+    def _service_session(self, now: float) -> Optional[float]:
+        """Send whatever the session has due, and return its next deadline."""
+        if self._session.receive_timed_out(now):
+            _LOGGER.error(
+                "Resetting connection as no data received for at least 30 seconds"
+            )
+            self._disconnect(RinnaiConnectionState.TIMEOUT)
+            return self._service(now)
+        self._session.queue_due_frame(now)
+        self._flush(now)
+        if self._socketstate != RinnaiConnectionState.CONNECTED:
+            return self._service(now)
+        mask = selectors.EVENT_READ
+        if self._session.outbound_pending():
+            mask |= selectors.EVENT_WRITE
+        self._watch(mask)
+        return self._session.next_deadline()
+
+    def _flush(self, now: float) -> None:
+        """Write as much of the outbound data as the socket will take."""
+        buffers = self._session.outbound_buffers()
+        if not buffers:
+            return
+        try:
+            num_sent = self._socket.sendmsg(buffers)
+        except (BlockingIOError, InterruptedError):
+            num_sent = 0
+        except OSError as ose:
+            _LOGGER.error("Socket error on send: %s. Reconnecting", ose)
+            self._disconnect(RinnaiConnectionState.IDLE)
+            return
+        self._session.data_sent(num_sent, now)
+
+    def _disconnect(self, socketstate: RinnaiConnectionState) -> None:
+        """Drop the connection, to be re-established by _service."""
+        self._close_socket()
+        self._reconnect.disconnected(time.monotonic())
+        self._update_socket_state(socketstate)
+
+    def _watch(self, mask: int) -> None:
+        """Select the socket for the given events."""
+        if mask == self._registered_mask:
+            return
+        if self._registered_mask:
+            self._selector.modify(self._socket, mask, self)
+        else:
+            self._selector.register(self._socket, mask, self)
+        self._registered_mask = mask
+
+    def _close_socket(self) -> None:
+        """Stop selecting for and close the socket, if there is one."""
+        if self._socket is None:
+            return
+        if self._registered_mask:
+            self._selector.unregister(self._socket)
+            self._registered_mask = 0
+        self._socket.close()
+        self._socket = None
+
+
+class RinnaiFleet:  # pylint: disable=too-many-instance-attributes
+    """Run the connections to any number of units on one thread.
+
+    Every unit's socket is registered with a single selector, connects are
+    non-blocking, and the loop sleeps until the earliest of the units' deadlines, so
+    a unit that is slow or unreachable never holds the others up. Each unit gets the
+    full RinnaiSystem interface through add_unit.
+    """
+
+    def __init__(self) -> None:
+        """Initialise the fleet. Nothing runs until start is called."""
+        # Created by start and closed by stop, along with the wakeup sockets.
+        self._selector: Optional[selectors.BaseSelector] = None
+        self._deadlines = RinnaiDeadlines()
+        self._connections = set()
+
+        # Connections to add, remove and look at, handed over from other threads.
+        self._lock = threading.Lock()
+        self._pending = deque()
+        self._woken = set()
+        self._wake_reader: Optional[socket.socket] = None
+        self._wake_writer: Optional[socket.socket] = None
+
+        self._thread_exit_flag = False
+        self._thread: threading.Thread = None
+
+    def __len__(self) -> int:
+        """Return the number of connections in the fleet."""
+        return len(self._connections)
+
+    def add_unit(
+        self,
+        ip_address: str,
+        port: int = UNIT_PORT,
+        discovery_port: int = DISCOVERY_PORT,
+    ):
+        """Create a RinnaiSystem for the unit at ip_address, driven by this fleet.
+
+        Call get_status on it to connect, as with any other RinnaiSystem.
+        """
+        # Imported here as system depends on this module.
+        from .system import RinnaiSystem  # pylint: disable=import-outside-toplevel
+
+        return RinnaiSystem(
+            ip_address, fleet=self, port=port, discovery_port=discovery_port
+        )
+
+    def create_connection(
+        self,
+        ip_address: str,
+        status_handler: Callable[[Any], None],
+        port: int = UNIT_PORT,
+        discovery_port: int = DISCOVERY_PORT,
+        **kwargs,
+    ) -> RinnaiFleetConnection:
+        """Create a connection to the unit, driven by this fleet once started."""
+        return RinnaiFleetConnection(
+            self, ip_address, status_handler, port, discovery_port, **kwargs
+        )
+
+    def start(self) -> None:
+        """Start the fleet's thread."""
+        if self._thread is None or not self._thread.is_alive():
+            self._thread_exit_flag = False
+            self._selector = selectors.DefaultSelector()
+            self._wake_reader, self._wake_writer = socket.socketpair()
+            self._wake_reader.setblocking(False)
+            self._wake_writer.setblocking(False)
+            self._selector.register(self._wake_reader, selectors.EVENT_READ)
+            self._thread = threading.Thread(
+                target=self._event_loop, name="RinnaiFleet", daemon=True
+            )
+            self._thread.start()
+            # For the connections handed over before the thread was started.
+            self._wake()
+        else:
+            _LOGGER.error("Cannot start multiple fleet threads")
+
+    def stop(self) -> None:
+        """Stop the fleet's thread, closing and releasing every connection.
+
+        Connections handed to the fleet but not yet taken on are released too.
+        """
+        # pylint: disable=protected-access
+        if self._thread is not None:
+            self._thread_exit_flag = True
+            self._wake()
+            self._thread.join(5)
+            if self._thread.is_alive():
+                # Everything is left to the thread, which still uses it.
+                _LOGGER.error("Could not stop fleet thread")
+                return
+            self._thread = None
+        with self._lock:
+            pending, self._pending = self._pending, deque()
+            self._woken = set()
+        waiting = set()
+        for add, connection in pending:
+            if add:
+                if connection not in self._connections:
+                    waiting.add(connection)
+            else:
+                waiting.discard(connection)
+                if connection in self._connections:
+                    self._connections.discard(connection)
+                    connection._detach()
+        for connection in self._connections:
+            connection._detach()
+        for connection in self._connections | waiting:
+            connection._release_client()
+        self._connections.clear()
+        self._deadlines.clear()
+        if self._selector is not None:
+            self._selector.close()
+            self._selector = None
+        for wake_socket in (self._wake_reader, self._wake_writer):
+            if wake_socket is not None:
+                wake_socket.close()
+        self._wake_reader = self._wake_writer = None
+
+    def add(self, connection: RinnaiFleetConnection) -> None:
+        """Start driving the connection. May be called from any thread."""
+        with self._lock:
+            self._pending.append((True, connection))
+        self._wake()
+
+    def remove(self, connection: RinnaiFleetConnection) -> None:
+        """Stop driving the connection and close it. May be called from any thread."""
+        with self._lock:
+            self._pending.append((False, connection))
+        self._wake()
+
+    def wake(self, connection: RinnaiFleetConnection) -> None:
+        """Have the fleet look at the connection soon. May be called from any thread."""
+        with self._lock:
+            self._woken.add(connection)
+        self._wake()
+
+    def _wake(self) -> None:
+        """Wake the fleet's thread up, if it is running."""
+        writer = self._wake_writer
+        if writer is None:
+            return
+        try:
+            writer.send(b"\0")
+        except (BlockingIOError, InterruptedError):
+            # Plenty of wakeups are already pending.
+            pass
+        except OSError:
+            # Closed by stop in the meantime.
+            pass
+
+    def _event_loop(self) -> None:
+        """Thread that services every connection in the fleet."""
+        _LOGGER.debug("Starting fleet event loop")
+        # pylint: disable=protected-access
+        while not self._thread_exit_flag:
+            entry = self._deadlines.next()
+            timeout = None
+            if entry is not None:
+                timeout = max(entry[0] - time.monotonic(), 0)
+            events = self._selector.select(timeout)
+
+            now = time.monotonic()
+            due = set()
+            for key, mask in events:
+                if key.fileobj is self._wake_reader:
+                    self._drain_wakeups()
+                    continue
+                try:
+                    key.data._handle_events(mask, now)
+                except Exception:  # pylint: disable=broad-except
+                    self._failed(key.data, now)
+                due.add(key.data)
+
+            self._take_pending(due)
+
+            now = time.monotonic()
+            due.update(self._deadlines.pop_due(now))
+            for connection in due:
+                if connection not in self._connections:
+                    continue
+                try:
+                    deadline = connection._service(now)
+                except Exception:  # pylint: disable=broad-except
+                    deadline = self._failed(connection, now)
+                if deadline is None:
+                    self._deadlines.cancel(connection)
+                else:
+                    self._deadlines.set(connection, deadline)
+        _LOGGER.debug("Fleet event loop stopped")
+
+    def _take_pending(self, due: set) -> None:
+        """Add and remove the connections handed over, and add those woken to due."""
+        # pylint: disable=protected-access
+        with self._lock:
+            pending, self._pending = self._pending, deque()
+            due |= self._woken
+            self._woken = set()
+        for add, connection in pending:
+            if add and connection not in self._connections:
+                self._connections.add(connection)
+                connection._attach(self._selector)
+                due.add(connection)
+            elif not add and connection in self._connections:
+                self._connections.discard(connection)
+                self._deadlines.cancel(connection)
+                connection._detach()
+                due.discard(connection)
+
+    def _failed(self, connection: RinnaiFleetConnection, now: float) -> float:
+        """Disconnect a unit whose handling raised, so the others carry on.
+
+        Returns when to try the unit again. Called from an exception handler.
+        """
+        # pylint: disable=protected-access
+        _LOGGER.exception(
+            "Error handling unit %s, disconnecting it", connection._ip_address
+        )
+        try:
+            return connection._failed(now)
+        except Exception:  # pylint: disable=broad-except
+            # Most likely a socket state handler, which has been told all the same.
+            _LOGGER.exception("Error disconnecting unit %s", connection._ip_address)
+            return connection._retry_time
+
+    def _drain_wakeups(self) -> None:
+        """Discard pending wakeups."""
+        try:
+            while self._wake_reader.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
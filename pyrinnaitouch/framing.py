@@ -0,0 +1,288 @@
+"""Incremental framing of the unit's *HELLO* / N###### [...] wire format."""
+
+from collections import deque
+import logging
+import re
+from typing import List, NamedTuple, Optional
+
+_LOGGER = logging.getLogger(__name__)
+
+HELLO = b"*HELLO*"
+# N followed by the six digit sequence number.
+HEADER_LENGTH = 7
+# Frames this large without a closing bracket are treated as garbage.
+MAX_FRAME_SIZE = 65536
+# Initial size of the receive buffer, it grows if a frame does not fit.
+RECEIVE_BUFFER_SIZE = 16384
+# Most frames handed to a single sendmsg call.
+MAX_SEND_BUFFERS = 64
+
+_OPEN_BRACKET = ord("[")
+_QUOTE = ord('"')
+_BACKSLASH = ord("\\")
+
+# Everything up to the next bracket, complete strings included, so one match covers
+# the run between two brackets. It stops short of a string that is cut off.
+_SKIP = re.compile(rb'[^\[\]"]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^\[\]"]*)*', re.DOTALL)
+# The rest of a string that was cut off, up to its closing quote.
+_STRING = re.compile(rb'[^"\\]*(?:\\.[^"\\]*)*', re.DOTALL)
+_HEADER = re.compile(rb"N\d{6}")
+
+
+class RinnaiFrame(NamedTuple):
+    """A complete frame received from the unit.
+
+    sequence is None for the *HELLO* greeting, otherwise it is the sequence number
+    from the frame header and payload is the JSON array that followed it.
+    """
+
+    sequence: Optional[int]
+    payload: memoryview
+
+
+class RinnaiFrameScanner:  # pylint: disable=too-many-instance-attributes
+    """Split a byte stream into frames without rescanning data already seen.
+
+    The scanner remembers how far into the current frame it got, the bracket depth
+    and whether it is inside a JSON string (and just after an escape), so every byte
+    is only examined once no matter how the frame is fragmented.
+
+    Received data lives in a preallocated buffer that the socket can fill directly
+    (get_buffer / buffer_updated, as used by recv_into and asyncio.BufferedProtocol).
+    Frames are consumed by advancing an offset, and the unconsumed tail is only moved
+    to the front when there is not enough free space left. Payloads are returned as
+    memoryview slices of that buffer; they are only valid until more data is added,
+    and must be released before then.
+    """
+
+    def __init__(
+        self,
+        max_frame_size: int = MAX_FRAME_SIZE,
+        buffer_size: int = RECEIVE_BUFFER_SIZE,
+    ) -> None:
+        """Initialise the scanner."""
+        self._buffer = bytearray(buffer_size)
+        self._max_frame_size = max_frame_size
+        # End of the received data within the buffer.
+        self._end = 0
+        # Start of the frame currently being scanned.
+        self._start = 0
+        # Next byte to be examined within that frame.
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        # Most unconsumed bytes ever held at once.
+        self._high_water_mark = 0
+
+    def __len__(self) -> int:
+        """Return the number of unconsumed bytes."""
+        return self._end - self._start
+
+    @property
+    def high_water_mark(self) -> int:
+        """Return the largest number of bytes that have been buffered at once."""
+        return self._high_water_mark
+
+    @property
+    def capacity(self) -> int:
+        """Return the current size of the receive buffer."""
+        return len(self._buffer)
+
+    def get_buffer(self, size_hint: int) -> memoryview:
+        """Return a writable view of at least size_hint free bytes at the end of the
+        buffer, for the socket to receive into."""
+        if len(self._buffer) - self._end < size_hint:
+            self._make_room(size_hint)
+        return memoryview(self._buffer)[self._end :]
+
+    def buffer_updated(self, nbytes: int) -> None:
+        """Record that nbytes were written into the view from get_buffer."""
+        self._end += nbytes
+        self._high_water_mark = max(self._high_water_mark, self._end - self._start)
+
+    def feed(self, data: bytes) -> None:
+        """Copy received bytes into the buffer."""
+        with self.get_buffer(len(data)) as view:
+            view[: len(data)] = data
+        self.buffer_updated(len(data))
+
+    def clear(self) -> None:
+        """Discard all buffered data and scanning state."""
+        self._end = self._start = 0
+        self._reset_scan()
+
+    def _make_room(self, size: int) -> None:
+        """Move unconsumed data to the front of the buffer, growing it if needed."""
+        pending = self._end - self._start
+        if len(self._buffer) - pending >= size:
+            # Same sized slice assignment, so views handed out earlier stay valid.
+            self._buffer[:pending] = self._buffer[self._start : self._end]
+        else:
+            capacity = len(self._buffer)
+            while capacity - pending < size:
+                capacity *= 2
+            _LOGGER.debug("Growing receive buffer to %d bytes", capacity)
+            buffer = bytearray(capacity)
+            buffer[:pending] = self._buffer[self._start : self._end]
+            self._buffer = buffer
+        self._pos -= self._start
+        self._start = 0
+        self._end = pending
+
+    def next_frame(self) -> Optional[RinnaiFrame]:
+        """Return the next complete frame, or None if more data is needed.
+
+        Raises ValueError if the data cannot be resynchronised to a frame header.
+        """
+        while self._end - self._start >= HEADER_LENGTH:
+            start = self._start
+            if self._pos == start:
+                if self._buffer.startswith(HELLO, start, self._end):
+                    self._start = self._pos = start + len(HELLO)
+                    return RinnaiFrame(None, memoryview(self._buffer)[start : self._start])
+                if _HEADER.match(self._buffer, start, self._end) is None:
+                    self._resync(start + 1)
+                    continue
+                if self._end <= start + HEADER_LENGTH:
+                    return None
+                if self._buffer[start + HEADER_LENGTH] != _OPEN_BRACKET:
+                    self._resync(start + 1)
+                    continue
+                self._pos = start + HEADER_LENGTH
+
+            end = self._scan()
+            if end is None:
+                if self._pos - start > self._max_frame_size:
+                    raise ValueError(
+                        f"No end of frame found within {self._max_frame_size} bytes"
+                    )
+                return None
+
+            sequence = int(self._buffer[start + 1 : start + HEADER_LENGTH])
+            self._start = end
+            if self._start == self._end:
+                # Everything is consumed, so later data can start at the front again
+                # without copying anything.
+                self._start = self._end = 0
+            self._reset_scan()
+            return RinnaiFrame(
+                sequence, memoryview(self._buffer)[start + HEADER_LENGTH : end]
+            )
+        return None
+
+    def _resync(self, pos: int) -> None:
+        """Skip garbage up to the next frame header."""
+        _LOGGER.warning("Error parsing data, attempting recovery")
+        match = _HEADER.search(self._buffer, pos, self._end)
+        if match is None:
+            _LOGGER.debug("Current buffer: %s", self._buffer[self._start : self._end])
+            raise ValueError("Buffer does not start with '*HELLO*' or 'N'")
+        _LOGGER.debug("Discarded %s", self._buffer[self._start : match.start()])
+        self._start = self._pos = match.start()
+        self._reset_scan()
+
+    def _scan(self) -> Optional[int]:
+        """Advance through the JSON array, returning its end offset once complete."""
+        buffer = self._buffer
+        end = self._end
+        pos = self._pos
+        if self._escape:
+            if pos >= end:
+                return None
+            pos += 1
+            self._escape = False
+        while True:
+            if self._in_string:
+                pos = self._skip_string(pos)
+                if pos is None:
+                    return None
+
+            pos = _SKIP.match(buffer, pos, end).end()
+            if pos >= end:
+                self._pos = end
+                return None
+            char = buffer[pos]
+            pos += 1
+            if char == _QUOTE:
+                # A string the data runs out in the middle of.
+                self._in_string = True
+            elif char == _OPEN_BRACKET:
+                self._depth += 1
+            else:
+                self._depth -= 1
+                if self._depth == 0:
+                    return pos
+
+    def _skip_string(self, pos: int) -> Optional[int]:
+        """Advance past the closing quote of a JSON string.
+
+        Returns None, with the position saved, if the data runs out first.
+        """
+        end = self._end
+        pos = _STRING.match(self._buffer, pos, end).end()
+        if pos >= end:
+            self._pos = end
+            return None
+        if self._buffer[pos] == _BACKSLASH:
+            # Only left unmatched as the last byte, with the escaped one still to come.
+            self._pos = end
+            self._escape = True
+            return None
+        self._in_string = False
+        return pos + 1
+
+    def _reset_scan(self) -> None:
+        """Reset the per-frame scanning state."""
+        self._pos = self._start
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+
+class RinnaiOutboundQueue:
+    """Encoded frames waiting to be written to the socket.
+
+    Frames are kept as the bytes objects they were encoded to, and a partial write
+    only advances an offset into the first frame, so nothing is copied until the
+    kernel takes it.
+    """
+
+    def __init__(self) -> None:
+        """Initialise the queue."""
+        self._frames = deque()
+        # Bytes of the first frame that have already been sent.
+        self._offset = 0
+        self._pending = 0
+
+    def __len__(self) -> int:
+        """Return the number of bytes still to be sent."""
+        return self._pending
+
+    def append(self, frame: bytes) -> None:
+        """Queue an encoded frame."""
+        self._frames.append(frame)
+        self._pending += len(frame)
+
+    def buffers(self) -> List[memoryview]:
+        """Return views of the unsent data, suitable for socket.sendmsg."""
+        views = []
+        for frame in self._frames:
+            views.append(memoryview(frame)[self._offset if not views else 0 :])
+            if len(views) == MAX_SEND_BUFFERS:
+                break
+        return views
+
+    def advance(self, nbytes: int) -> None:
+        """Drop nbytes of sent data from the front of the queue."""
+        self._pending -= nbytes
+        nbytes += self._offset
+        while self._frames and nbytes >= len(self._frames[0]):
+            nbytes -= len(self._frames.popleft())
+        self._offset = nbytes
+
+    def clear(self) -> None:
+        """Discard everything that has not been sent."""
+        self._frames.clear()
+        self._offset = 0
+        self._pending = 0
@@ -0,0 +1,302 @@
+"""TCP proxy that makes the network between a connection and a unit worse on purpose.
+
+Put a RinnaiImpairmentProxy between a connection and the simulator (or anything
+else speaking to it over TCP) to see how the connection copes with congested Wi-Fi:
+slow and jittery links, frames split into tiny pieces, stalls and resets.
+"""
+
+import asyncio
+import logging
+import random
+import socket
+import struct
+import threading
+import time
+from typing import List, Optional, Set
+
+_LOGGER = logging.getLogger(__name__)
+
+# Bytes read at a time from either side.
+READ_SIZE = 65536
+# Bytes held by the proxy in each direction before it stops reading, so that the
+# sender sees its socket buffer fill up as it would on a congested link.
+BUFFER_LIMIT = 65536
+# Seconds between the pieces data is split into, so the receiver reads each one on
+# its own rather than finding them merged in its socket buffer.
+CHUNK_INTERVAL_SECONDS = 0.001
+
+
+class RinnaiImpairment:  # pylint: disable=too-many-instance-attributes
+    """What to do to the bytes going one way through a RinnaiImpairmentProxy.
+
+    latency seconds are added to every piece, plus up to jitter more at random,
+    without ever reordering bytes. bandwidth caps the bytes per second.
+    chunk_size splits everything into pieces of at most that many bytes, each sent
+    separately and at least chunk_interval seconds after the one before. All of
+    these may be changed while the proxy runs, and apply to data read from then on.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        latency: float = 0,
+        jitter: float = 0,
+        bandwidth: Optional[float] = None,
+        chunk_size: Optional[int] = None,
+        rng: Optional[random.Random] = None,
+        *,
+        chunk_interval: float = CHUNK_INTERVAL_SECONDS,
+    ) -> None:
+        """Initialise the impairment. With no arguments, bytes pass straight through."""
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.chunk_size = chunk_size
+        self.chunk_interval = chunk_interval
+        self._rng = rng or random.Random()
+        # Nothing is forwarded until then. See RinnaiImpairmentProxy.stall.
+        self.stalled_until = 0.0
+        # The next connection to forward more than this many bytes is reset once
+        # that many have gone through. See RinnaiImpairmentProxy.reset_after.
+        self.reset_after: Optional[int] = None
+        self.bytes_forwarded = 0
+
+    def pieces(self, data: bytes) -> List[bytes]:
+        """Split data into the pieces to send."""
+        if not self.chunk_size:
+            return [data]
+        return [
+            data[start : start + self.chunk_size]
+            for start in range(0, len(data), self.chunk_size)
+        ]
+
+    def delay(self) -> float:
+        """Return the seconds a piece read now is held for."""
+        if self.jitter:
+            return self.latency + self._rng.uniform(0, self.jitter)
+        return self.latency
+
+    def transmission_time(self, size: int) -> float:
+        """Return the seconds size bytes take to go through at the bandwidth cap."""
+        return size / self.bandwidth if self.bandwidth else 0
+
+
+class _Pipe:  # pylint: disable=too-many-instance-attributes
+    """Bytes going one way through a proxied connection."""
+
+    def __init__(
+        self,
+        impairment: RinnaiImpairment,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        self._impairment = impairment
+        self._reader = reader
+        self._writer = writer
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._queued_bytes = 0
+        self._drained = asyncio.Event()
+        self._drained.set()
+        # When the last piece queued is due out.
+        self._last_due = 0.0
+        self.forwarded = 0
+
+    async def read(self) -> None:
+        """Read until the sender closes, queueing the pieces to send."""
+        while data := await self._reader.read(READ_SIZE):
+            now = time.monotonic()
+            for index, piece in enumerate(self._impairment.pieces(data)):
+                due = now + self._impairment.delay()
+                if index:
+                    # Kept apart, or the kernel would merge the pieces again.
+                    due = max(due, self._last_due + self._impairment.chunk_interval)
+                # Never earlier than the piece before, as TCP does not reorder.
+                self._last_due = max(due, self._last_due)
+                self._queue.put_nowait((self._last_due, piece))
+                self._queued_bytes += len(piece)
+            if self._queued_bytes >= BUFFER_LIMIT:
+                self._drained.clear()
+                await self._drained.wait()
+        self._queue.put_nowait(None)
+
+    async def write(self, reset: "asyncio.Future[None]") -> None:
+        """Send queued pieces when due, or reset the connection if told to."""
+        impairment = self._impairment
+        while (item := await self._queue.get()) is not None:
+            due, piece = item
+            while (delay := max(due, impairment.stalled_until) - time.monotonic()) > 0:
+                await asyncio.sleep(delay)
+            # One piece at a time goes over the link, taking as long as it takes.
+            if impairment.bandwidth:
+                await asyncio.sleep(impairment.transmission_time(len(piece)))
+            limit = impairment.reset_after
+            if limit is not None and self.forwarded + len(piece) > limit:
+                impairment.reset_after = None
+                piece = piece[: max(limit - self.forwarded, 0)]
+                self._send(piece)
+                await self._writer.drain()
+                if not reset.done():
+                    reset.set_result(None)
+                return
+            self._send(piece)
+            await self._writer.drain()
+            self._queued_bytes -= len(piece)
+            if self._queued_bytes < BUFFER_LIMIT:
+                self._drained.set()
+        if self._writer.can_write_eof():
+            self._writer.write_eof()
+
+    def _send(self, piece: bytes) -> None:
+        self._writer.write(piece)
+        self.forwarded += len(piece)
+        self._impairment.bytes_forwarded += len(piece)
+
+
+class RinnaiImpairmentProxy:  # pylint: disable=too-many-instance-attributes
+    """Forward TCP connections to a target through upstream and downstream impairments.
+
+    upstream applies to bytes from the connection to the target (commands),
+    downstream to bytes back from the target (statuses). Runs on a thread of its
+    own with start/stop or as a context manager, so a test can change the
+    impairments, stall or reset connections, and wait for the results as it goes.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        target_port: int,
+        target_host: str = "127.0.0.1",
+        *,
+        port: int = 0,
+        host: str = "127.0.0.1",
+        upstream: Optional[RinnaiImpairment] = None,
+        downstream: Optional[RinnaiImpairment] = None,
+    ) -> None:
+        """Initialise the proxy. Nothing is served until it is started."""
+        self._target = (target_host, target_port)
+        # The port actually listened on, once started.
+        self.port = port
+        self._host = host
+        self.upstream = upstream or RinnaiImpairment()
+        self.downstream = downstream or RinnaiImpairment()
+
+        self.connections = 0
+        self.resets = 0
+        self._active: Set["asyncio.Future[None]"] = set()
+        self._handlers: Set[asyncio.Task] = set()
+        self._stopping = False
+
+        self._loop: asyncio.AbstractEventLoop = None
+        self._thread: threading.Thread = None
+        self._stopped: asyncio.Event = None
+
+    def start(self) -> "RinnaiImpairmentProxy":
+        """Serve from a thread of its own, returning once listening."""
+        ready = threading.Event()
+        self._thread = threading.Thread(
+            target=asyncio.run,
+            args=(self.serve(ready),),
+            name="RinnaiImpairmentProxy",
+            daemon=True,
+        )
+        self._thread.start()
+        ready.wait(10)
+        return self
+
+    def stop(self) -> None:
+        """Stop serving, if started with start."""
+        if self._thread is None:
+            return
+        self._loop.call_soon_threadsafe(self._stopped.set)
+        self._thread.join(5)
+        self._thread = None
+
+    def __enter__(self) -> "RinnaiImpairmentProxy":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def stall(self, seconds: float) -> None:
+        """Forward nothing either way for the given time, without disconnecting."""
+        until = time.monotonic() + seconds
+        self.upstream.stalled_until = until
+        self.downstream.stalled_until = until
+
+    def reset(self) -> None:
+        """Reset every connection through the proxy, on both sides."""
+        self._loop.call_soon_threadsafe(self._reset_all)
+
+    def reset_after(self, downstream_bytes: int) -> None:
+        """Reset the next connection to receive more than this many bytes, mid-stream."""
+        self.downstream.reset_after = downstream_bytes
+
+    async def serve(self, ready: Optional[threading.Event] = None) -> None:
+        """Serve on the running event loop until stopped."""
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        server = await asyncio.start_server(self._handle, self._host, self.port)
+        self.port = server.sockets[0].getsockname()[1]
+        if ready is not None:
+            ready.set()
+        async with server:
+            await self._stopped.wait()
+            # Close every connection, without counting it as a reset.
+            self._stopping = True
+            self._reset_all()
+            await asyncio.gather(*self._handlers, return_exceptions=True)
+
+    def _reset_all(self) -> None:
+        for reset in list(self._active):
+            if not reset.done():
+                reset.set_result(None)
+
+    async def _handle(
+        self, client_reader: asyncio.StreamReader, client_writer: asyncio.StreamWriter
+    ) -> None:
+        """Proxy one connection until either side closes or it is reset."""
+        self.connections += 1
+        handler = asyncio.current_task()
+        self._handlers.add(handler)
+        handler.add_done_callback(self._handlers.discard)
+        try:
+            target_reader, target_writer = await asyncio.open_connection(*self._target)
+        except OSError as e:
+            _LOGGER.debug("Could not reach the target: %s", e)
+            _abort(client_writer)
+            return
+        reset = self._loop.create_future()
+        self._active.add(reset)
+        pipes = [
+            _Pipe(self.upstream, client_reader, target_writer),
+            _Pipe(self.downstream, target_reader, client_writer),
+        ]
+        tasks = [self._loop.create_task(pipe.read()) for pipe in pipes]
+        tasks += [self._loop.create_task(pipe.write(reset)) for pipe in pipes]
+        writers = asyncio.gather(*tasks[2:], return_exceptions=True)
+        try:
+            await asyncio.wait((reset, writers), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            self._active.discard(reset)
+            for task in tasks:
+                task.cancel()
+            if reset.done():
+                self.resets += not self._stopping
+                _abort(client_writer)
+                _abort(target_writer)
+            else:
+                client_writer.close()
+                target_writer.close()
+            # Collect the outcome of the cancelled pipes, errors included.
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def _abort(writer: asyncio.StreamWriter) -> None:
+    """Close the connection with a reset rather than the usual FIN."""
+    sock = writer.get_extra_info("socket")
+    if sock is not None:
+        try:
+            sock.setsockopt(
+                socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0)
+            )
+        except OSError:
+            pass
+    writer.transport.abort()
@@ -1,19 +1,35 @@
 """Handle connectivity with non-blocking sockets and connection reporting."""
 
 from collections import defaultdict
+from concurrent.futures import Future
 import enum
-import json
+import errno
 import logging
-from queue import Empty, SimpleQueue
-import re
+import os
+from queue import SimpleQueue
+from typing import Any, Dict, Optional, Union
 import selectors
 import socket
 import threading
 import time
-from time import sleep
+
+from .cadence import RinnaiPollCadence
+from .capture import RinnaiCaptureDirection, RinnaiCaptureWriter
+from .discovery import DISCOVERY_PORT, RinnaiDiscovery
+from .reconnect import RinnaiReconnectPolicy
+from .session import COMMAND_WINDOW, FULL_REFRESH_SECONDS, RinnaiSession
+from .statusmailbox import EXIT, RinnaiStatusMailbox
 
 _LOGGER = logging.getLogger(__name__)
 
+# Number of bytes to make room for on every receive.
+RECEIVE_SIZE = 8192
+
+# TCP port the module listens on.
+UNIT_PORT = 27847
+
+CONNECT_TIMEOUT_SECONDS = 5
+
 
 class RinnaiConnectionState(enum.Enum):
     """Possible connection states for this class."""
@@ -26,40 +42,137 @@ class RinnaiConnectionState(enum.Enum):
     ERROR = 6
 
 
-class RinnaiPollConnection:  # pylint: disable=too-many-instance-attributes
-    """Manage the non-blocking connection to the unit."""
+class RinnaiConnection:
+    """Connection bookkeeping shared by the threaded and asyncio connections."""
 
     # Global map of IP addresses currently in use. Only used to track when multiple
     # connections are attempted, since we know how poorly the hardware handles this.
     clients = defaultdict(int)
 
-    def __init__(self, ip_address: str, status_queue: SimpleQueue) -> None:
-        """Initialise the connection object."""
+    def __init__(self, ip_address: str) -> None:
+        """Register the connection and reject duplicates to the same unit."""
         self._ip_address = ip_address
-        self._port = 27847
-        self._command_sequence = 1
-        self._last_command_time = 0
-        self._last_received_time = 0
-        self._command_timeout_seconds = 10
-        self._hello_received = False
-        self._last_received_sequence_num = 0
-        self._command_wait = False
-        self._command_wait_timeout_seconds = 5
-        #self._connection_reconnect_delay_seconds = 1
-        self._udp_address = "0.0.0.0"
-        self._udp_port = 50000
-
-        RinnaiPollConnection.clients[ip_address] += 1
-        if RinnaiPollConnection.clients[ip_address] > 1:
+        self._registered = False
+        self._register_client()
+
+        self._socketstate = RinnaiConnectionState.IDLE
+
+        # List of functions to call whenever _socketstate changes
+        # Provides a single argument, RinnaiConnectionState
+        self._connection_state_handlers = []
+
+    def _register_client(self) -> None:
+        """Increment the connection tracker for this unit, unless already counted."""
+        if self._registered:
+            return
+        if RinnaiConnection.clients[self._ip_address] > 0:
             _LOGGER.error(
                 "Attempting duplicate connection to unit at %s, which the hardware "
                 "will not support",
-                ip_address,
+                self._ip_address,
             )
             raise RuntimeError("Cannot have two connections to the same address")
+        RinnaiConnection.clients[self._ip_address] += 1
+        self._registered = True
+
+    def _release_client(self) -> None:
+        """Decrement the connection tracker for this unit, if not already done."""
+        if not self._registered:
+            return
+        self._registered = False
+        RinnaiConnection.clients[self._ip_address] -= 1
+        if RinnaiConnection.clients[self._ip_address] < 0:
+            _LOGGER.error(
+                "Somehow we have a negative number of connections; something has "
+                "gone very wrong"
+            )
+            # Try to restore some sanity
+            RinnaiConnection.clients[self._ip_address] = 0
 
-        # Queue of commands (each as a string) to send to the unit.
-        self._sendqueue = SimpleQueue()
+    def _update_socket_state(self, socketstate: RinnaiConnectionState) -> None:
+        """Update the connection state and call all registered handlers."""
+        # Ignore unchanged states.
+        if not isinstance(socketstate, RinnaiConnectionState):
+            raise TypeError("Invalid socket state")
+
+        if self._socketstate != socketstate:
+            self._socketstate = socketstate
+            for handler in self._connection_state_handlers:
+                try:
+                    handler(self._socketstate)
+                except (ValueError, TypeError) as e:
+                    _LOGGER.error("Invalid socket state handler (%s)", e)
+            _LOGGER.debug("Socket state is now %s", self._socketstate)
+
+    def socket_state(self) -> RinnaiConnectionState:
+        """Return the current state of the socket."""
+        return self._socketstate
+
+    def register_socket_state_handler(self, handler) -> None:
+        """Register a new handler interested in socket state updates.
+
+        The new handler immediately gets called with the current status, and if
+        successfully executed is added to the handler list. Duplicate handlers are
+        ignored.
+        """
+        if handler not in self._connection_state_handlers:
+            try:
+                handler(self._socketstate)
+                self._connection_state_handlers.append(handler)
+            except TypeError as te:
+                _LOGGER.error(
+                    "Registration failed - could not call socket handler: %s", te
+                )
+
+    def unregister_socket_state_handler(self, handler) -> None:
+        """Unregister a socket state handler."""
+        if handler in self._connection_state_handlers:
+            self._connection_state_handlers.remove(handler)
+
+
+class RinnaiPollConnection(RinnaiConnection):  # pylint: disable=too-many-instance-attributes
+    """Manage the non-blocking connection to the unit."""
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        ip_address: str,
+        status_queue: Union[SimpleQueue, RinnaiStatusMailbox],
+        port: int = UNIT_PORT,
+        discovery_port: int = DISCOVERY_PORT,
+        *,
+        command_window: int = COMMAND_WINDOW,
+        cadence: Optional[RinnaiPollCadence] = None,
+        reconnect: Optional[RinnaiReconnectPolicy] = None,
+        full_refresh_interval: Optional[float] = FULL_REFRESH_SECONDS,
+        capture: Optional[RinnaiCaptureWriter] = None,
+    ) -> None:
+        """Initialise the connection object.
+
+        command_window is the number of commands that may await acknowledgement from
+        the unit at once. cadence decides how often an idle unit is polled, and
+        reconnect when to connect again after a failure. Everything sent and
+        received is recorded to capture, if given; closing it is up to the caller.
+        full_refresh_interval is how often an unchanged status is decoded all the
+        same, see RinnaiSession. Decoded statuses are put on status_queue, then
+        "sys.exit" once the connection stops; a RinnaiStatusMailbox keeps only the
+        latest status should whatever takes them fall behind.
+        """
+        super().__init__(ip_address)
+        self._port = port
+        self._udp_port = discovery_port
+        self._reconnect = reconnect or RinnaiReconnectPolicy()
+        self._capture = capture
+
+        # Outbound queue of JSON status
+        self._status_queue = status_queue
+
+        # Framing, sequencing and keep-alive state for the unit.
+        self._session = RinnaiSession(
+            self._status_queue.put,
+            command_window=command_window,
+            cadence=cadence,
+            full_refresh_interval=full_refresh_interval,
+        )
 
         # Checked in all manner of places, should only be set on shutdown.
         self._thread_exit_flag = False
@@ -67,32 +180,47 @@ class RinnaiPollConnection:  # pylint: disable=too-many-instance-attributes
         # These don't get created until start_thread is called
         self._socket: socket.socket = None
         self._socketthread: threading.Thread = None
-        self._socketstate = RinnaiConnectionState.IDLE
+        self._discovery: RinnaiDiscovery = None
 
-        self._readbuffer = bytearray()
-        self._writebuffer = bytearray()
+        # Written to whenever the monitoring thread needs to look at the session
+        # before its next deadline, e.g. because a command was queued. Created by
+        # start_thread and closed by stop_thread.
+        self._wake_reader: Optional[socket.socket] = None
+        self._wake_writer: Optional[socket.socket] = None
 
-        # List of functions to call whenever _socketstate changes
-        # Provides a single argument, RinnaiConnectionState
-        self._connection_state_handlers = []
+        _LOGGER.debug("Poll connection inited")
 
-        # Outbound queue of JSON status
-        self._status_queue = status_queue
+    def send_command(self, command: str) -> Future:
+        """Queue a command to be sent to the unit.
 
-        _LOGGER.debug("Poll connection inited")
+        Returns a future that resolves once the unit acknowledges the command. Raises
+        RinnaiBackpressureError straight away if too many commands are already
+        waiting for the unit, since RinnaiSystem's commands call this from an event
+        loop that must not block.
+        """
+        future = self._session.send_command(command, timeout=0)
+        self._wake()
+        return future
+
+    def set_busy(self, busy: bool) -> None:
+        """Tell the connection whether the unit is busy, so it polls faster."""
+        if self._session.set_busy(busy):
+            self._wake()
 
-    def send_command(self, command):
-        """Queue a command to be sent to the unit."""
-        self._sendqueue.put(command)
+    def get_metrics(self) -> Dict[str, Any]:
+        """Return counters describing the connection."""
+        return {**self._session.get_metrics(), **self._reconnect.get_metrics()}
 
     def __del__(self):
         """Destructor to ensure the thread is stopped and the socket closed."""
-        self.stop_thread()
+        if self._registered:
+            self.stop_thread()
 
     def stop_thread(self) -> None:
         """Stop the thread, close the socket, and decrement the connection tracker."""
         if self._socketthread is not None and self._socketthread.is_alive():
             self._thread_exit_flag = True
+            self._wake()
             self._socketthread.join(5)
             if self._socketthread.is_alive():
                 _LOGGER.error("Could not stop monitoring thread")
@@ -103,6 +231,10 @@ class RinnaiPollConnection:  # pylint: disable=too-many-instance-attributes
                 self._socketthread = None
                 _LOGGER.debug("Monitoring thread confirmed stopped")
 
+        if self._socketthread is None:
+            # Left open for a thread that could not be stopped, as it still uses them.
+            self._close_wakeups()
+
         if self._socket is not None:
             # Do our best to tidy up the socket.
             try:
@@ -117,57 +249,16 @@ class RinnaiPollConnection:  # pylint: disable=too-many-instance-attributes
 
             self._socket = None
 
-        # Let anybody listening to the status know that we're exiting.
-        self._status_queue.put("sys.exit")
-
-        RinnaiPollConnection.clients[self._ip_address] -= 1
-        if RinnaiPollConnection.clients[self._ip_address] < 0:
-            _LOGGER.error(
-                "Somehow we have a negative number of connections; something has "
-                "gone very wrong"
-            )
-            # Try to restore some sanity
-            RinnaiPollConnection.clients[self._ip_address] = 0
-
-    def _update_socket_state(self, socketstate: RinnaiConnectionState) -> None:
-        """Update the connection state and call all registered handlers."""
-        # Ignore unchanged states.
-        if not isinstance(socketstate, RinnaiConnectionState):
-            raise TypeError("Invalid socket state")
-
-        if self._socketstate != socketstate:
-            self._socketstate = socketstate
-            for handler in self._connection_state_handlers:
-                try:
-                    handler(self._socketstate)
-                except (ValueError, TypeError) as e:
-                    _LOGGER.error("Invalid socket state handler (%s)", e)
-            _LOGGER.debug("Socket state is now %s", self._socketstate)
-
-    def socket_state(self) -> RinnaiConnectionState:
-        """Return the current state of the socket."""
-        return self._socketstate
+        self._session.close()
 
-    def register_socket_state_handler(self, handler) -> None:
-        """Register a new handler interested in socket state updates.
+        if self._discovery is not None:
+            self._discovery.release()
+            self._discovery = None
 
-        The new handler immediately gets called with the current status, and if
-        successfully executed is added to the handler list. Duplicate handlers are
-        ignored.
-        """
-        if handler not in self._connection_state_handlers:
-            try:
-                handler(self._socketstate)
-                self._connection_state_handlers.append(handler)
-            except TypeError as te:
-                _LOGGER.error(
-                    "Registration failed - could not call socket handler: %s", te
-                )
+        # Let anybody listening to the status know that we're exiting.
+        self._status_queue.put(EXIT)
 
-    def unregister_socket_state_handler(self, handler) -> None:
-        """Unregister a socket state handler."""
-        if handler in self._connection_state_handlers:
-            self._connection_state_handlers.remove(handler)
+        self._release_client()
 
     def start_thread(self) -> None:
         """Attempt connection to the unit. Results are reflected via connection_state
@@ -175,6 +266,15 @@ class RinnaiPollConnection:  # pylint: disable=too-many-instance-attributes
 
         if self._socketthread is None or not self._socketthread.is_alive():
             _LOGGER.debug("Starting connection thread")
+            self._register_client()
+            # Forget any stop request left over from a previous run.
+            self._thread_exit_flag = False
+            self._wake_reader, self._wake_writer = socket.socketpair()
+            self._wake_reader.setblocking(False)
+            self._wake_writer.setblocking(False)
+            if self._discovery is None:
+                self._discovery = RinnaiDiscovery.get_instance(self._udp_port)
+                self._discovery.acquire()
             self._socketthread = threading.Thread(
                 target=self._event_loop, name="RinnaiPollConnection"
             )
@@ -189,56 +289,46 @@ class RinnaiPollConnection:  # pylint: disable=too-many-instance-attributes
             # Connect, then monitor. Repeat ad infinitum, unless we've been told
             # to exit.
             self._create_socket_and_connect()
+            if self._thread_exit_flag:
+                break
             # Note that this only returns on disconnect/socket error, or when the thread
             # exit flag is set.
             self._monitor_socket_and_queue()
+            self._reconnect.disconnected(time.monotonic())
 
     def _monitor_socket_and_queue(self) -> None:
-        # Create the selector and register for read events on the socket and the send
-        # queue.  Write events on the socket aren't selected for until we have something
-        # to say.
+        # Create the selector and register for read events on the socket. Write events
+        # on the socket are only selected for while we have something to say.
         selector = selectors.DefaultSelector()
-        selector.register(self._socket, selectors.EVENT_READ)
-
-        self._readbuffer.clear()
-        self._writebuffer.clear()
+        registered_mask = selectors.EVENT_READ
+        selector.register(self._socket, registered_mask)
+        selector.register(self._wake_reader, selectors.EVENT_READ)
 
         while (
             not self._thread_exit_flag
             and self._socketstate == RinnaiConnectionState.CONNECTED
         ):
             mask = selectors.EVENT_READ
-            if len(self._writebuffer) > 0:
+            if self._session.outbound_pending() > 0:
                 mask |= selectors.EVENT_WRITE
-                _LOGGER.debug("Selecting for write")
-
-            selector.modify(self._socket, selectors.EVENT_READ)
-
-            events = selector.select(0.1)
-            for _key, mask in events:
+            if mask != registered_mask:
+                _LOGGER.debug("Selecting for write: %s", bool(mask & selectors.EVENT_WRITE))
+                selector.modify(self._socket, mask)
+                registered_mask = mask
+
+            # Sleep until the session's next deadline, unless woken up by data from
+            # the unit or a queued command.
+            deadline = self._session.next_deadline()
+            timeout = None
+            if deadline is not None:
+                timeout = max(deadline - time.monotonic(), 0)
+            events = selector.select(timeout)
+            for key, mask in events:
+                if key.fileobj is self._wake_reader:
+                    self._drain_wakeups()
+                    continue
                 if mask & selectors.EVENT_READ:
-                    # There is data available on the socket. Receive it into the buffer
-                    # for now, process after we've been through all the events.
-                    self._last_received_time = time.time()
-                    try:
-                        newbytes = self._socket.recv(8096)
-                        _LOGGER.debug("Read %d bytes from socket", len(newbytes))
-
-                        if len(newbytes) == 0:
-                            # The socket has disconnected. This will be caught on the
-                            # next loop and reconnection attempted.
-                            _LOGGER.info("Socket disconnected. Reconnecting")
-                            self._update_socket_state(RinnaiConnectionState.IDLE)
-                        else:
-                            self._readbuffer.extend(newbytes)
-                            _LOGGER.debug(
-                                "Receive buffer now has %d bytes of data to process",
-                                len(self._readbuffer),
-                            )
-
-                    except OSError as ose:
-                        _LOGGER.error("Socket error on recv: %s. Reconnecting", ose)
-                        self._update_socket_state(RinnaiConnectionState.IDLE)
+                    self._attempt_receive()
 
                 if mask & selectors.EVENT_WRITE:
                     # We are able to write to the socket, and have something to say.
@@ -246,152 +336,182 @@ class RinnaiPollConnection:  # pylint: disable=too-many-instance-attributes
 
             # Now process the command queue. We don't wait for anything to arrive here,
             # the waiting only happens in the select socket call.
+            if self._session.queue_due_frame(time.monotonic()):
+                # A command (or idle poll) is ready to be sent, attempt to send it
+                # straight away.
+                self._attempt_send()
 
-            while True:
-                try:
-                    if (self._command_wait and ((time.time() - self._last_command_time) < self._command_wait_timeout_seconds)):
-                        break
-                    command = self._sendqueue.get_nowait()
-                    # A command is ready to be sent. Format it, place it into the
-                    # writebuffer and attempt to send it.
-                    self._command_sequence = max(self._command_sequence + 1, self._last_received_sequence_num + 1)
-                    self._command_sequence %=255
-                    sequence_header = "N" + str(self._command_sequence).zfill(6)
-                    self._writebuffer.extend(sequence_header.encode())
-                    self._writebuffer.extend(command.encode())
-                    _LOGGER.debug("Sending command %d", self._command_sequence)
-                    self._attempt_send()
-                    self._command_wait = True
-                
-                except Empty:
-                    # Nothing in the queue for now. Consider sending an empty command
-                    # if it's been long enough, and then break out of this loop.
-                    if (
-                        time.time() - self._last_command_time
-                        > self._command_timeout_seconds
-                    ):
-                        self._command_sequence = max(self._command_sequence + 1, self._last_received_sequence_num + 1)
-                        self._command_sequence %=255
-                        sequence_header = "N" + str(self._command_sequence).zfill(6)
-                        self._writebuffer.extend(sequence_header.encode())
-                        self._writebuffer.extend(b"NA")
-                        _LOGGER.debug("Sending idle command %d", self._command_sequence)
-                        self._attempt_send()
-
-                        # Update the time here in case the socket doesn't become
-                        # write available quickly.
-                        self._last_command_time = time.time()
-                        self._command_wait = True
-                        
-                    break
-
-            if time.time() - self._last_received_time > 30:
+            if self._session.receive_timed_out(time.monotonic()):
                 _LOGGER.error(
                     "Resetting connection as no data received for at least 30 seconds"
                 )
                 self._update_socket_state(RinnaiConnectionState.TIMEOUT)
 
-            self._process_received_data()
+        selector.close()
+
+    def _attempt_receive(self) -> None:
+        """Receive the data available on the socket.
+
+        It goes straight into the session's buffer, which frames it and forwards any
+        complete status.
+        """
+        try:
+            with self._session.get_buffer(RECEIVE_SIZE) as view:
+                nbytes = self._socket.recv_into(view)
+                self._record(RinnaiCaptureDirection.RECEIVED, view[:nbytes])
+            _LOGGER.debug("Read %d bytes from socket", nbytes)
+
+            if nbytes == 0:
+                # The socket has disconnected. This will be caught on the next loop
+                # and reconnection attempted.
+                _LOGGER.info("Socket disconnected. Reconnecting")
+                self._update_socket_state(RinnaiConnectionState.IDLE)
+            elif not self._session.buffer_updated(nbytes, time.monotonic()):
+                self._update_socket_state(RinnaiConnectionState.ERROR)
+
+        except OSError as ose:
+            _LOGGER.error("Socket error on recv: %s. Reconnecting", ose)
+            self._update_socket_state(RinnaiConnectionState.IDLE)
+
+    def _record(self, direction: RinnaiCaptureDirection, data: bytes = b"") -> None:
+        """Record traffic to the capture, if there is one."""
+        if self._capture is not None and (
+            data or direction == RinnaiCaptureDirection.CONNECTED
+        ):
+            self._capture.record(direction, data)
+
+    def _wake(self) -> None:
+        """Wake the monitoring thread up, if it is running."""
+        writer = self._wake_writer
+        if writer is None:
+            return
+        try:
+            writer.send(b"\0")
+        except (BlockingIOError, InterruptedError):
+            # Plenty of wakeups are already pending.
+            pass
+        except OSError:
+            # Closed by stop_thread in the meantime.
+            pass
+
+    def _drain_wakeups(self) -> None:
+        """Discard pending wakeups."""
+        try:
+            while self._wake_reader.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError):
+            pass
+
+    def _close_wakeups(self) -> None:
+        """Close the sockets used to wake the monitoring thread up."""
+        for wake_socket in (self._wake_reader, self._wake_writer):
+            if wake_socket is not None:
+                wake_socket.close()
+        self._wake_reader = self._wake_writer = None
 
     def _attempt_send(self) -> None:
-        # Attempt to send the contents of the write buffer. Only remove bytes that are
-        # successfully sent,  which may not be all that we requested. Any bytes
-        # remaining in the buffer will be caught in the next select call.
+        # Attempt to send the queued frames in a single gather write. Only bytes that
+        # are successfully sent are dropped from the queue, which may not be all that
+        # we requested. Anything remaining is sent once the socket reports it is
+        # writable again.
+        buffers = self._session.outbound_buffers()
+        if not buffers:
+            return
         try:
-            num_sent = self._socket.send(self._writebuffer)
-            _LOGGER.debug("Sent %d of %d bytes", num_sent, len(self._writebuffer))
-            self._writebuffer = self._writebuffer[num_sent:]
-
-            self._last_command_time = time.time()
-            if len(self._writebuffer) > 0:
-                _LOGGER.warning(
-                    "There are %d bytes remaining to send. There may be network "
-                    "congestion, or the connection is about to fail",
-                    len(self._writebuffer),
-                )
+            if hasattr(self._socket, "sendmsg"):
+                num_sent = self._socket.sendmsg(buffers)
+            else:
+                num_sent = self._socket.send(buffers[0])
+        except (BlockingIOError, InterruptedError):
+            num_sent = 0
         except OSError as ose:
             _LOGGER.error("Socket error on send: %s. Reconnecting", ose)
             self._update_socket_state(RinnaiConnectionState.IDLE)
+            return
+
+        if num_sent and self._capture is not None:
+            # Only joined when capturing, to keep the copy off the send path.
+            self._record(RinnaiCaptureDirection.SENT, b"".join(buffers)[:num_sent])
+        self._session.data_sent(num_sent, time.monotonic())
+        remaining = self._session.outbound_pending()
+        _LOGGER.debug("Sent %d of %d bytes", num_sent, num_sent + remaining)
+        if remaining > 0:
+            _LOGGER.warning(
+                "There are %d bytes remaining to send. There may be network "
+                "congestion, or the connection is about to fail",
+                remaining,
+            )
 
-    def _process_received_data(self) -> None:
-        # _LOGGER.debug("Number of bytes in buffer: %d", len(self._readbuffer))
-
-        # Constants
-        HELLO = b"*HELLO*"  # pylint: disable=invalid-name
-        START_MARKER = b"N"  # pylint: disable=invalid-name
-        # At least 7 bytes are required for either the *HELLO* or NXXXXXX portions.
-        # No point trying if less data than that is in the buffer.
-        while len(self._readbuffer) >= 7:
-            if self._readbuffer.startswith(HELLO):
-                if not self._hello_received:
-                    _LOGGER.info("Hello message successfully received from unit")
-                    self._readbuffer = self._readbuffer[len(HELLO) :]
-                else:
-                    _LOGGER.error(
-                        "Hello message received more than once! Has the unit reset "
-                        "somehow?"
-                    )
-            elif self._readbuffer.startswith(START_MARKER):
-                if match := re.match(r"N(\d{6})(\[.*?\])", self._readbuffer.decode()):
-                    # First match is sequence number
-                    # Second match is the JSON status to be parsed. Note that the match
-                    # requires the closing bracket to be present, to ensure we have a
-                    # complete status.
-                    self._last_received_sequence_num = int(match.group(1)[1:])
-                    _LOGGER.debug(
-                        "Received sequence number %d", self._last_received_sequence_num
-                    )
-                    if (self._command_wait and (self._last_received_sequence_num >= self._command_sequence)):
-                        self._command_wait = False
-                        _LOGGER.debug("Command wait end")
-
-                    try:
-                        json_status = json.loads(
-                            self._readbuffer[match.start(2) : match.end(2)]
-                        )
-                        self._status_queue.put(json_status)
-                    except json.JSONDecodeError:
-                        _LOGGER.error("Could not parse JSON data")
-
-                    self._readbuffer = self._readbuffer[match.end() :]
-                else:
-                    _LOGGER.debug("Did not match regexp: %s", self._readbuffer)
-            # Something has already gone wrong, but maybe we can recover by looking for
-            # the next marker.
-            elif match := re.match(r"N(\d{6})", self._readbuffer.decode()):
-                # Cut everything before the NXXXXXX pattern.
-                _LOGGER.warning("Error parsing data, attempting recovery")
-                _LOGGER.debug("Discarded %s", self._readbuffer[: match.start(1) - 1])
-                self._readbuffer = self._readbuffer[match.start(1) :]
+    def _wait(
+        self,
+        timeout: Optional[float],
+        done: Optional[Future] = None,
+        writable: Optional[socket.socket] = None,
+    ) -> bool:
+        """Wait for up to timeout seconds, or for ever if None, unless told to exit.
+
+        Returns True as soon as done completes or writable becomes writable, and
+        False on timeout or exit. Everything the thread waits for outside of
+        _monitor_socket_and_queue goes through here, so stop_thread never has to wait
+        for it.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if done is not None:
+            done.add_done_callback(lambda _: self._wake())
+        with selectors.DefaultSelector() as selector:
+            selector.register(self._wake_reader, selectors.EVENT_READ)
+            if writable is not None:
+                selector.register(writable, selectors.EVENT_WRITE)
+            while not self._thread_exit_flag:
+                if done is not None and done.done():
+                    return True
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                for key, _ in selector.select(remaining):
+                    if key.fileobj is writable:
+                        return True
+                    self._drain_wakeups()
+        return False
+
+    def _wait_for_discovery(self) -> None:
+        """Wait for the unit to announce itself, unless it was seen recently."""
+        found = self._discovery.discover(
+            self._ip_address, self._reconnect.discovery_max_age(time.monotonic())
+        )
+        if not self._wait(None, done=found):
+            found.cancel()
+            return
+        try:
+            found.result()
+            self._update_socket_state(RinnaiConnectionState.CONNECTING)
+        except OSError as e:
+            self._update_socket_state(RinnaiConnectionState.ERROR)
+            _LOGGER.error("Unexpected broadcast error: %s", e)
+
+    def _connect(self) -> int:
+        """Make a single connection attempt. Returns 0 on success, else an errno."""
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setblocking(False)
+        try:
+            error = self._socket.connect_ex((self._ip_address, self._port))
+        except OSError as e:
+            error = e.errno or errno.EIO
+        if error in (errno.EINPROGRESS, errno.EWOULDBLOCK):
+            if self._wait(CONNECT_TIMEOUT_SECONDS, writable=self._socket):
+                error = self._socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            elif self._thread_exit_flag:
+                error = errno.EINTR
             else:
-                _LOGGER.error(
-                    "Buffer does not start with '*HELLO*' or 'N'. Something hasn't "
-                    "parsed correctly, reconnecting"
-                )
-                _LOGGER.debug("Current buffer: %s", self._readbuffer)
-                self._update_socket_state(RinnaiConnectionState.ERROR)
+                error = errno.ETIMEDOUT
+        if error:
+            self._socket.close()
+            self._socket = None
+        return error
 
     def _create_socket_and_connect(self) -> None:
-        #time.sleep(self._connection_reconnect_delay_seconds)
-        #self._update_socket_state(RinnaiConnectionState.CONNECTING)
-        
-        while (
-            self._socketstate == RinnaiConnectionState.IDLE
-            and not self._thread_exit_flag
-        ):
-            try:
-                self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                self._socket.bind((self._udp_address, self._udp_port))
-                data, addr = self._socket.recvfrom(1024)
-                Rinnai = b'Rinnai_NBW2_Module'                                         
-                if data.startswith(Rinnai):                                             
-                    _LOGGER.debug("Broadcast data: %s", data.hex())                                          
-                    _LOGGER.debug("Broadcast received from address: %s", addr[0])                                              
-                    self._update_socket_state(RinnaiConnectionState.CONNECTING)
-            except OSError as e:
-                self._update_socket_state(RinnaiConnectionState.ERROR)
-                _LOGGER.error("Unexpected broadcast error: %s", e)
-                
         # If an old socket exists, try and clean it up.
         if self._socket is not None:
             try:
@@ -401,39 +521,48 @@ class RinnaiPollConnection:  # pylint: disable=too-many-instance-attributes
                 # It's not worth reporting anything here as we already knew the socket
                 # was a bit broken.
                 pass
+            self._socket = None
 
         while (
             self._socketstate != RinnaiConnectionState.CONNECTED
             and not self._thread_exit_flag
         ):
-            try:
-                # Set up the socket and update the state
-                self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                self._socket.settimeout(5)
-                self._socket.connect((self._ip_address, self._port))
-
-                # If we've made it to here, we connected successfully.
+            # Go straight back to the unit where it was last seen, unless that has
+            # not worked for a while.
+            discovered = self._reconnect.needs_discovery()
+            if discovered:
+                self._wait_for_discovery()
+                if self._thread_exit_flag:
+                    break
+            elif self._socketstate == RinnaiConnectionState.IDLE:
+                self._update_socket_state(RinnaiConnectionState.CONNECTING)
+
+            self._reconnect.attempt_started(time.monotonic(), discovered)
+            error = self._connect()
+            if self._thread_exit_flag:
+                break
+            if not error:
+                self._reconnect.attempt_succeeded(time.monotonic())
+                self._discovery.touch(self._ip_address)
                 self._update_socket_state(RinnaiConnectionState.CONNECTED)
-
+                self._record(RinnaiCaptureDirection.CONNECTED)
                 # Reset the timestamps and command sequence number
-                self._last_command_time = time.time()
-                self._last_received_time = self._last_command_time
-                self._command_sequence = 1
+                self._session.reset(time.monotonic())
+                continue
 
-                # Switch to non-blocking mode.
-                self._socket.settimeout(0)
+            socketstate = state_for_errno(error)
+            if socketstate == RinnaiConnectionState.ERROR:
+                _LOGGER.error(
+                    'Unexpected connection error: "%s", will retry', os.strerror(error)
+                )
+            self._update_socket_state(socketstate)
+            self._wait(self._reconnect.attempt_failed(time.monotonic()))
 
-            except ConnectionRefusedError:
-                self._update_socket_state(RinnaiConnectionState.REFUSED)
-                sleep(5)
-            except TimeoutError:
-                self._update_socket_state(RinnaiConnectionState.TIMEOUT)
-                sleep(5)
-            except (ConnectionError, BlockingIOError, InterruptedError):
-                # All of these things could be transient, so try again after a
-                # small wait.
-                sleep(10)
-            except OSError as e:
-                self._update_socket_state(RinnaiConnectionState.ERROR)
-                _LOGGER.error('Unexpected connection error: "%s", will retry', e)
-                sleep(10)
+
+def state_for_errno(error: int) -> RinnaiConnectionState:
+    """Return the connection state to report for a failed connect."""
+    if error == errno.ECONNREFUSED:
+        return RinnaiConnectionState.REFUSED
+    if error == errno.ETIMEDOUT:
+        return RinnaiConnectionState.TIMEOUT
+    return RinnaiConnectionState.ERROR
@@ -0,0 +1,139 @@
+"""When and how to reconnect to a unit after the connection drops."""
+
+from collections import deque
+import random
+from typing import Any, Deque, Dict, NamedTuple, Optional
+
+from .discovery import RECENTLY_SEEN_SECONDS
+
+# Seconds to wait after the first failed attempt.
+INITIAL_DELAY = 1
+# Longest wait between attempts.
+MAX_DELAY = 60
+# Growth of the wait for every further failed attempt.
+BACKOFF_FACTOR = 2
+# Failed attempts at the last known endpoint before waiting for a broadcast again.
+DISCOVERY_AFTER_FAILURES = 3
+# Number of attempts kept in the history.
+HISTORY_SIZE = 100
+
+
+class RinnaiReconnectAttempt(NamedTuple):
+    """A single connection attempt."""
+
+    # time.monotonic() when the attempt started.
+    started: float
+    # Seconds until it succeeded or failed.
+    duration: float
+    succeeded: bool
+    # Whether the attempt waited for the unit's broadcast first.
+    discovered: bool
+
+
+class RinnaiReconnectPolicy:  # pylint: disable=too-many-instance-attributes
+    """Decide when to try connecting again, and whether to wait for discovery first.
+
+    Once the unit has been connected to, its endpoint is known, so after a drop the
+    connection goes straight back to it. Only after discovery_after_failures failed
+    attempts in a row does it wait for the unit to broadcast again. Failed attempts
+    are retried after a delay that starts at initial_delay and grows by
+    backoff_factor up to max_delay, randomised to between half and all of that so
+    that many clients dropped at once do not retry in lockstep.
+
+    Every attempt is kept in attempts, and get_metrics reports the time taken to
+    reconnect, measured from the drop to the successful attempt.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        initial_delay: float = INITIAL_DELAY,
+        max_delay: float = MAX_DELAY,
+        backoff_factor: float = BACKOFF_FACTOR,
+        discovery_after_failures: int = DISCOVERY_AFTER_FAILURES,
+        rng: Optional[random.Random] = None,
+    ) -> None:
+        """Initialise the policy for a unit that has not been connected to yet."""
+        self._initial_delay = initial_delay
+        self._max_delay = max_delay
+        self._backoff_factor = backoff_factor
+        self._discovery_after_failures = discovery_after_failures
+        self._rng = rng or random.Random()
+
+        self.attempts: Deque[RinnaiReconnectAttempt] = deque(maxlen=HISTORY_SIZE)
+        self._known = False
+        self._failures = 0
+        self._attempt_started: Optional[float] = None
+        self._attempt_discovered = False
+        self._last_failure: Optional[float] = None
+        self._dropped: Optional[float] = None
+
+        self._failed_attempts = 0
+        self._reconnects = 0
+        self._reconnect_seconds_total = 0.0
+        self._last_reconnect_seconds: Optional[float] = None
+
+    def needs_discovery(self) -> bool:
+        """Return whether to wait for the unit's broadcast before the next attempt."""
+        return not self._known or self._failures >= self._discovery_after_failures
+
+    def discovery_max_age(self, now: float) -> float:
+        """Return how old a broadcast may be and still count for the next attempt.
+
+        Before the first connection anything recent will do. After failures only a
+        broadcast heard since the last failed attempt shows the unit is back.
+        """
+        if not self._known or self._last_failure is None:
+            return RECENTLY_SEEN_SECONDS
+        return max(now - self._last_failure, 0)
+
+    def attempt_started(self, now: float, discovered: bool) -> None:
+        """Record the start of a connection attempt."""
+        self._attempt_started = now
+        self._attempt_discovered = discovered
+
+    def attempt_succeeded(self, now: float) -> None:
+        """Record that the attempt connected."""
+        self._record(now, True)
+        self._known = True
+        self._failures = 0
+        if self._dropped is not None:
+            self._last_reconnect_seconds = now - self._dropped
+            self._reconnect_seconds_total += self._last_reconnect_seconds
+            self._reconnects += 1
+            self._dropped = None
+
+    def attempt_failed(self, now: float) -> float:
+        """Record that the attempt failed. Returns the seconds to wait before the next."""
+        self._record(now, False)
+        self._failures += 1
+        self._failed_attempts += 1
+        self._last_failure = now
+        delay = min(
+            self._initial_delay * self._backoff_factor ** (self._failures - 1),
+            self._max_delay,
+        )
+        return self._rng.uniform(delay / 2, delay)
+
+    def disconnected(self, now: float) -> None:
+        """Record that an established connection dropped."""
+        self._dropped = now
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Return counters describing the attempts so far."""
+        mean = None
+        if self._reconnects:
+            mean = self._reconnect_seconds_total / self._reconnects
+        return {
+            "reconnects": self._reconnects,
+            "connect_failures": self._failed_attempts,
+            "consecutive_connect_failures": self._failures,
+            "last_reconnect_seconds": self._last_reconnect_seconds,
+            "mean_reconnect_seconds": mean,
+        }
+
+    def _record(self, now: float, succeeded: bool) -> None:
+        started = now if self._attempt_started is None else self._attempt_started
+        self.attempts.append(
+            RinnaiReconnectAttempt(started, now - started, succeeded, self._attempt_discovered)
+        )
+        self._attempt_started = None
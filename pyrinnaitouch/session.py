@@ -0,0 +1,464 @@
+"""Transport independent protocol state for a connection to the unit."""
+
+from collections import deque
+from concurrent.futures import Future, InvalidStateError
+import json
+import logging
+import threading
+import zlib
+from typing import Any, Callable, Deque, Dict, Iterable, List, NamedTuple, Optional
+
+from .cadence import RinnaiPollCadence
+from .commandqueue import MAX_COMMAND_FRAME_SIZE, RinnaiCommand, RinnaiCommandQueue
+from .deadlines import RinnaiDeadlines
+from .framing import RinnaiFrameScanner, RinnaiOutboundQueue
+from .util import RinnaiBackpressureError, RinnaiCommandError
+
+_LOGGER = logging.getLogger(__name__)
+
+IDLE_COMMAND = "NA"
+
+# Time without any data from the unit after which the connection is considered dead.
+RECEIVE_TIMEOUT_SECONDS = 30
+
+# Bytes of queued and unsent commands at which callers are pushed back, and the level
+# the backlog has to drain to before they are let through again.
+SEND_HIGH_WATER = 4096
+SEND_LOW_WATER = 1024
+
+# Command frames that may be awaiting acknowledgement at once. The hardware is only
+# known to cope with one.
+COMMAND_WINDOW = 1
+
+# Longest a status identical to the last one goes without being decoded anyway.
+FULL_REFRESH_SECONDS = 60
+
+# Command sequence numbers wrap around at this value.
+SEQUENCE_MODULUS = 255
+
+# Names of the session's deadlines.
+KEEPALIVE = "keepalive"
+COMMAND_WAIT = "command_wait"
+WATCHDOG = "watchdog"
+
+
+def sequence_reached(received: int, sent: int) -> bool:
+    """Return True if sequence number received is at or after sent.
+
+    Sequence numbers wrap around, so received counts as later when it is less than
+    half the sequence space ahead of sent, e.g. 2 is after 250.
+    """
+    return (received - sent) % SEQUENCE_MODULUS < SEQUENCE_MODULUS // 2
+
+
+class RinnaiCommandAck(NamedTuple):
+    """The unit's acknowledgement of a command."""
+
+    sequence: int
+    # Seconds from the frame being sent until the unit acknowledged it.
+    latency: float
+
+
+class _InFlight(NamedTuple):
+    """A frame sent to the unit and not yet acknowledged."""
+
+    sequence: int
+    sent_time: float
+    futures: List[Future]
+
+
+def _resolve(
+    futures: Iterable[Future],
+    result: Optional[RinnaiCommandAck] = None,
+    error: Optional[Exception] = None,
+) -> None:
+    """Complete the futures, skipping any the caller has cancelled."""
+    for future in futures:
+        try:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        except InvalidStateError:
+            pass
+
+
+class RinnaiSession:  # pylint: disable=too-many-instance-attributes
+    """Framing, command sequencing, keep-alive and receive watchdog for one unit.
+
+    The session does no I/O itself. The connection classes feed it the bytes they
+    receive, ask it for the data to send and tell it when data has gone out, so the
+    same protocol rules apply whether the socket is driven by a thread or by an
+    asyncio event loop.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        status_handler: Callable[[Any], None],
+        *,
+        high_water: int = SEND_HIGH_WATER,
+        low_water: int = SEND_LOW_WATER,
+        max_command_frame_size: int = MAX_COMMAND_FRAME_SIZE,
+        command_window: int = COMMAND_WINDOW,
+        cadence: Optional[RinnaiPollCadence] = None,
+        full_refresh_interval: Optional[float] = FULL_REFRESH_SECONDS,
+    ) -> None:
+        """Initialise the session.
+
+        command_window is the number of command frames that may be sent before the
+        first of them is acknowledged. cadence decides how long the connection may
+        stay idle before the unit is polled. A status byte for byte identical to the
+        last one is not decoded or handled again unless full_refresh_interval seconds
+        have passed since the last one that was; 0 decodes every status, and None
+        only ever decodes changes.
+        """
+        self._command_sequence = 1
+        self._last_command_time = 0
+        self._last_received_time = 0
+        self._cadence = cadence if cadence is not None else RinnaiPollCadence()
+        self._poll_interval = self._cadence.interval(0)
+        # CRC of the last status payload, to tell whether the status changed.
+        self._last_payload_crc: Optional[int] = None
+        self._full_refresh_interval = full_refresh_interval
+        self._last_decode_time = 0.0
+        self._statuses_decoded = 0
+        self._statuses_skipped = 0
+        self._hello_received = False
+        self._last_received_sequence_num = 0
+        self._command_wait_timeout_seconds = 5
+        # Frames awaiting acknowledgement, oldest first.
+        self._in_flight: Deque[_InFlight] = deque()
+        self._command_window = max(command_window, 1)
+        # When the keep-alive, command wait and receive watchdog next need attention.
+        self._deadlines = RinnaiDeadlines()
+
+        # Queue of commands to send to the unit, and the frames released from it
+        # that have not been written to the socket yet. Commands may be queued from
+        # any thread, so both are guarded by _send_condition.
+        self._sendqueue = RinnaiCommandQueue()
+        # Pending commands for the same unit are merged into frames up to this size.
+        self._max_command_frame_size = max_command_frame_size
+        self._commands_sent = 0
+        self._command_frames_sent = 0
+        self._outbound = RinnaiOutboundQueue()
+        self._send_condition = threading.Condition()
+        self._high_water = high_water
+        self._low_water = low_water
+        # Set once the backlog reaches the high water mark, until it is drained to
+        # the low water mark.
+        self._send_paused = False
+        self._send_backpressure_timeout_seconds = 5
+
+        self._scanner = RinnaiFrameScanner()
+
+        # Called with every decoded JSON status received from the unit.
+        self._status_handler = status_handler
+
+    def send_command(self, command: str, timeout: Optional[float] = None) -> Future:
+        """Queue a command to be sent to the unit.
+
+        Returns a future that resolves to a RinnaiCommandAck once the unit has sent a
+        frame with a sequence number at or after the command's, or fails with
+        RinnaiCommandError if the acknowledgement times out or the connection drops.
+
+        If the backlog of unsent commands has reached the high water mark, wait up to
+        timeout seconds (by default _send_backpressure_timeout_seconds) for it to drain
+        to the low water mark, then raise RinnaiBackpressureError.
+        """
+        if timeout is None:
+            timeout = self._send_backpressure_timeout_seconds
+        with self._send_condition:
+            if self._send_paused and not self._send_condition.wait_for(
+                lambda: not self._send_paused, timeout
+            ):
+                raise RinnaiBackpressureError(
+                    f"{self.backlog} bytes of commands are waiting for the unit"
+                )
+            pending = RinnaiCommand(command)
+            self._sendqueue.put(pending)
+            self._update_flow_control()
+        return pending.futures[0]
+
+    @property
+    def backlog(self) -> int:
+        """Return the bytes of commands queued or not yet written to the socket."""
+        return self._sendqueue.pending_bytes + len(self._outbound)
+
+    def reset(self, now: float) -> None:
+        """Reset the session state for a freshly established connection."""
+        self._command_sequence = 1
+        self._fail_in_flight(RinnaiCommandError("Connection to the unit was reset"))
+        self._deadlines.clear()
+        self._cadence.reset()
+        self._last_payload_crc = None
+        self._command_activity(now)
+        self._receive_activity(now)
+        self._scanner.clear()
+        with self._send_condition:
+            # A partially written frame means nothing on a new connection.
+            self._outbound.clear()
+            self._update_flow_control()
+
+    def close(self) -> None:
+        """Fail the futures of all commands that have not been acknowledged."""
+        error = RinnaiCommandError("Connection to the unit was closed")
+        self._fail_in_flight(error)
+        with self._send_condition:
+            while (command := self._sendqueue.pop()) is not None:
+                _resolve(command.futures, error=error)
+            self._outbound.clear()
+            self._update_flow_control()
+
+    def data_received(self, data: bytes, now: float) -> bool:
+        """Process bytes received from the unit.
+
+        Returns False if the received data cannot be parsed and the connection should
+        be reset.
+        """
+        self._scanner.feed(data)
+        return self.buffer_updated(0, now)
+
+    def get_buffer(self, size_hint: int) -> memoryview:
+        """Return a writable view for the socket to receive directly into."""
+        return self._scanner.get_buffer(size_hint)
+
+    def buffer_updated(self, nbytes: int, now: float) -> bool:
+        """Process nbytes written into the view returned by get_buffer.
+
+        Returns False if the received data cannot be parsed and the connection should
+        be reset.
+        """
+        self._receive_activity(now)
+        self._scanner.buffer_updated(nbytes)
+        _LOGGER.debug(
+            "Receive buffer now has %d bytes of data to process", len(self._scanner)
+        )
+        return self._process_received_data(now)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Return counters describing the session."""
+        return {
+            "receive_buffer_size": self._scanner.capacity,
+            "receive_buffer_high_water": self._scanner.high_water_mark,
+            "send_backlog": self.backlog,
+            "send_paused": self._send_paused,
+            "commands_queued": len(self._sendqueue),
+            "commands_superseded": self._sendqueue.superseded,
+            "commands_sent": self._commands_sent,
+            "command_frames_sent": self._command_frames_sent,
+            "commands_merged": self._commands_sent - self._command_frames_sent,
+            "commands_in_flight": len(self._in_flight),
+            "command_window": self._command_window,
+            "poll_interval": self._poll_interval,
+            "statuses_decoded": self._statuses_decoded,
+            "statuses_skipped": self._statuses_skipped,
+        }
+
+    def queue_due_frame(self, now: float) -> bool:
+        """Move the frames that are due onto the outbound queue.
+
+        Queued commands are released while fewer than command_window frames are
+        awaiting acknowledgement; a frame that is not acknowledged in time is given
+        up on. If nothing has been sent for a while an idle command is produced
+        instead to keep the connection alive. Returns True if a frame was queued.
+        """
+        while (
+            self._in_flight
+            and now - self._in_flight[0].sent_time >= self._command_wait_timeout_seconds
+        ):
+            expired = self._in_flight.popleft()
+            _LOGGER.debug("Command wait timed out")
+            _resolve(
+                expired.futures,
+                error=RinnaiCommandError(
+                    f"Command {expired.sequence} was not acknowledged within "
+                    f"{self._command_wait_timeout_seconds} seconds"
+                ),
+            )
+
+        queued = False
+        with self._send_condition:
+            while len(self._in_flight) < self._command_window:
+                if self._sendqueue:
+                    command, batch = self._sendqueue.pop_frame(self._max_command_frame_size)
+                    self._commands_sent += len(batch)
+                    self._command_frames_sent += 1
+                    futures = [future for item in batch for future in item.futures]
+                    self._cadence.command_sent(now)
+                    _LOGGER.debug("Sending command %d", self._next_sequence())
+                elif (
+                    not self._in_flight
+                    and now - self._last_command_time >= self._cadence.interval(now)
+                ):
+                    # Nothing in the queue for a while, send an empty command.
+                    command = IDLE_COMMAND
+                    futures = []
+                    _LOGGER.debug("Sending idle command %d", self._next_sequence())
+                else:
+                    break
+                self._in_flight.append(_InFlight(self._command_sequence, now, futures))
+                # Update the time here in case the socket doesn't become write
+                # available quickly.
+                self._command_activity(now)
+                sequence_header = "N" + str(self._command_sequence).zfill(6)
+                self._outbound.append((sequence_header + command).encode())
+                queued = True
+            self._update_flow_control()
+        self._update_command_wait()
+        self._schedule_keepalive(now)
+        return queued
+
+    def outbound_pending(self) -> int:
+        """Return the number of bytes waiting to be written to the socket."""
+        return len(self._outbound)
+
+    def outbound_buffers(self) -> List[memoryview]:
+        """Return views of the data waiting to be written, for socket.sendmsg."""
+        with self._send_condition:
+            return self._outbound.buffers()
+
+    def data_sent(self, nbytes: int, now: float) -> None:
+        """Record that nbytes from outbound_buffers were written to the socket."""
+        self._command_activity(now)
+        with self._send_condition:
+            self._outbound.advance(nbytes)
+            self._update_flow_control()
+
+    def _update_flow_control(self) -> None:
+        """Pause or resume callers according to the water marks.
+
+        Must be called with _send_condition held.
+        """
+        backlog = self.backlog
+        if not self._send_paused and backlog >= self._high_water:
+            _LOGGER.warning(
+                "%d bytes of commands are waiting for the unit, pushing back on senders",
+                backlog,
+            )
+            self._send_paused = True
+        elif self._send_paused and backlog <= self._low_water:
+            _LOGGER.debug("Command backlog drained, resuming senders")
+            self._send_paused = False
+            self._send_condition.notify_all()
+
+    def set_busy(self, busy: bool) -> bool:
+        """Poll fast while the unit is busy. Returns True if that changed.
+
+        May be called from any thread. Takes effect the next time queue_due_frame is
+        called, so the connection should be woken when this returns True.
+        """
+        changed = self._cadence.busy != busy
+        self._cadence.busy = busy
+        return changed
+
+    def receive_timed_out(self, now: float) -> bool:
+        """Return True if the unit has been silent for too long."""
+        return now - self._last_received_time > RECEIVE_TIMEOUT_SECONDS
+
+    def next_deadline(self) -> Optional[float]:
+        """Return the time at which the session next needs attention, if ever."""
+        entry = self._deadlines.next()
+        return entry[0] if entry is not None else None
+
+    def _command_activity(self, now: float) -> None:
+        """Record that a frame was sent, pushing back the keep-alive."""
+        self._last_command_time = now
+        self._schedule_keepalive(now)
+
+    def _schedule_keepalive(self, now: float) -> None:
+        """Schedule the next poll according to the cadence."""
+        self._poll_interval = self._cadence.interval(now)
+        self._deadlines.set(KEEPALIVE, self._last_command_time + self._poll_interval)
+
+    def _receive_activity(self, now: float) -> None:
+        """Record that data was received, pushing back the watchdog."""
+        self._last_received_time = now
+        self._deadlines.set(WATCHDOG, now + RECEIVE_TIMEOUT_SECONDS)
+
+    def _update_command_wait(self) -> None:
+        """Schedule the timeout of the oldest frame awaiting acknowledgement."""
+        if self._in_flight:
+            self._deadlines.set(
+                COMMAND_WAIT,
+                self._in_flight[0].sent_time + self._command_wait_timeout_seconds,
+            )
+        else:
+            self._deadlines.cancel(COMMAND_WAIT)
+
+    def _acknowledge(self, sequence: int, now: float) -> None:
+        """Complete the frames up to and including sequence."""
+        while self._in_flight and sequence_reached(sequence, self._in_flight[0].sequence):
+            acked = self._in_flight.popleft()
+            _resolve(acked.futures, RinnaiCommandAck(acked.sequence, now - acked.sent_time))
+            _LOGGER.debug("Command %d acknowledged", acked.sequence)
+        self._update_command_wait()
+
+    def _fail_in_flight(self, error: Exception) -> None:
+        """Give up on every frame awaiting acknowledgement."""
+        while self._in_flight:
+            _resolve(self._in_flight.popleft().futures, error=error)
+        self._deadlines.cancel(COMMAND_WAIT)
+
+    def _refresh_due(self, now: float) -> bool:
+        """Return True if an unchanged status should be decoded all the same."""
+        return (
+            self._full_refresh_interval is not None
+            and now - self._last_decode_time >= self._full_refresh_interval
+        )
+
+    def _next_sequence(self) -> int:
+        """Advance the command sequence number past the last one sent and received."""
+        sequence = (self._command_sequence + 1) % SEQUENCE_MODULUS
+        after_received = (self._last_received_sequence_num + 1) % SEQUENCE_MODULUS
+        if not sequence_reached(sequence, after_received):
+            sequence = after_received
+        self._command_sequence = sequence
+        return self._command_sequence
+
+    def _process_received_data(self, now: float) -> bool:
+        while True:
+            try:
+                frame = self._scanner.next_frame()
+            except ValueError as err:
+                _LOGGER.error("%s. Something hasn't parsed correctly, reconnecting", err)
+                self._scanner.clear()
+                return False
+            if frame is None:
+                self._schedule_keepalive(now)
+                return True
+
+            with frame.payload as payload:
+                if frame.sequence is None:
+                    if not self._hello_received:
+                        _LOGGER.info("Hello message successfully received from unit")
+                        self._hello_received = True
+                    else:
+                        _LOGGER.error(
+                            "Hello message received more than once! Has the unit reset "
+                            "somehow?"
+                        )
+                    continue
+
+                self._last_received_sequence_num = frame.sequence
+                _LOGGER.debug(
+                    "Received sequence number %d", self._last_received_sequence_num
+                )
+                self._acknowledge(frame.sequence, now)
+                crc = zlib.crc32(payload)
+                changed = crc != self._last_payload_crc
+                self._cadence.status_received(changed)
+                self._last_payload_crc = crc
+                if not changed and not self._refresh_due(now):
+                    self._statuses_skipped += 1
+                    continue
+                self._last_decode_time = now
+                self._statuses_decoded += 1
+
+                try:
+                    # Decode straight from the receive buffer, without an intermediate
+                    # bytes copy.
+                    json_status = json.loads(str(payload, "utf-8"))
+                except (UnicodeDecodeError, json.JSONDecodeError):
+                    _LOGGER.error("Could not parse JSON data")
+                    continue
+            self._status_handler(json_status)
@@ -0,0 +1,480 @@
+"""Spread the units of a fleet across worker processes."""
+
+import copy
+from concurrent.futures import Future, InvalidStateError
+import functools
+import itertools
+import logging
+import multiprocessing
+from multiprocessing.connection import Connection, wait
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from .diff import snapshot
+from .discovery import DISCOVERY_PORT
+from .pollconnection import UNIT_PORT, RinnaiConnection, RinnaiConnectionState
+from .system_status import RinnaiSystemStatus
+from .util import RinnaiCommandError
+
+_LOGGER = logging.getLogger(__name__)
+
+# Seconds between checks that the workers are still alive.
+SUPERVISE_INTERVAL_SECONDS = 1
+
+# Kinds of request sent to a worker.
+_ADD = "add"
+_REMOVE = "remove"
+_COMMAND = "command"
+_STOP = "stop"
+
+# Kinds of message sent back by a worker.
+_SNAPSHOT = "snapshot"
+_DELTA = "delta"
+_STATE = "state"
+_ACK = "ack"
+
+
+def _apply(status: RinnaiSystemStatus, path: str, value: Any) -> None:
+    """Set the value at a dotted path from snapshot within a status object."""
+    *parents, name = path.split(".")
+    target = status
+    for key in parents:
+        target = target[key] if isinstance(target, dict) else getattr(target, key)
+    if isinstance(target, dict):
+        target[name] = value
+    else:
+        setattr(target, name, value)
+
+
+class _ShardWorker:  # pylint: disable=too-few-public-methods
+    """Runs in a worker process: a RinnaiFleet whose statuses are sent to the parent."""
+
+    def __init__(self, requests: multiprocessing.Queue, results: Connection):
+        # Imported here to keep the parent from depending on system at import time.
+        from .fleet import RinnaiFleet  # pylint: disable=import-outside-toplevel
+
+        self._requests = requests
+        self._results = results
+        # Messages are sent from both the fleet's thread and this process's main one.
+        self._results_lock = threading.Lock()
+        self._fleet = RinnaiFleet()
+        self._systems = {}
+        # Snapshot of the last status sent for each unit.
+        self._sent: Dict[str, Dict[str, Any]] = {}
+
+    def run(self) -> None:
+        """Serve requests from the parent until told to stop."""
+        self._fleet.start()
+        while (request := self._requests.get())[0] != _STOP:
+            handler = getattr(self, "_" + request[0])
+            handler(*request[1:])
+        for ip_address in list(self._systems):
+            self._remove(ip_address)
+        self._fleet.stop()
+        self._results.close()
+
+    def _put(self, message: Tuple) -> None:
+        """Send a message to the parent."""
+        with self._results_lock:
+            self._results.send(message)
+
+    def _add(self, ip_address: str, port: int, discovery_port: int) -> None:
+        system = self._fleet.add_unit(ip_address, port, discovery_port)
+        self._systems[ip_address] = system
+        system.subscribe_updates(functools.partial(self._send_status, ip_address))
+        system.register_socket_state_handler(
+            lambda state: self._put((_STATE, ip_address, state.value))
+        )
+        system.get_status()
+
+    def _remove(self, ip_address: str) -> None:
+        # Imported here to keep the parent from depending on system at import time.
+        from .system import RinnaiSystem  # pylint: disable=import-outside-toplevel
+
+        if self._systems.pop(ip_address, None) is not None:
+            RinnaiSystem.remove_instance(ip_address)
+            self._sent.pop(ip_address, None)
+
+    def _command(self, ip_address: str, command_id: int, command: str) -> None:
+        try:
+            future = self._systems[ip_address].send_command(command)
+        except Exception as err:  # pylint: disable=broad-except
+            self._put((_ACK, command_id, None, err))
+            return
+        future.add_done_callback(functools.partial(self._send_ack, command_id))
+
+    def _send_ack(self, command_id: int, future: Future) -> None:
+        if future.cancelled():
+            self._put((_ACK, command_id, None, RinnaiCommandError("Cancelled")))
+        elif (error := future.exception()) is not None:
+            self._put((_ACK, command_id, None, error))
+        else:
+            self._put((_ACK, command_id, future.result(), None))
+
+    def _send_status(self, ip_address: str) -> None:
+        """Send the unit's new status, as only the values that changed if possible."""
+        status = self._systems[ip_address].get_stored_status()
+        flat = snapshot(status)
+        previous = self._sent.get(ip_address)
+        self._sent[ip_address] = flat
+        if previous is None or previous.keys() != flat.keys():
+            # First status, or zones came or went: send all of it.
+            self._put((_SNAPSHOT, ip_address, status))
+            return
+        delta = {path: value for path, value in flat.items() if previous[path] != value}
+        if delta:
+            self._put((_DELTA, ip_address, delta))
+
+
+def _run_worker(requests: multiprocessing.Queue, results: Connection) -> None:
+    """Entry point of the worker processes."""
+    _ShardWorker(requests, results).run()
+
+
+class RinnaiShardConnection(RinnaiConnection):
+    """Stand-in for a connection that actually runs in a worker process.
+
+    Has the same interface as RinnaiFleetConnection, but the status handler is given
+    RinnaiSystemStatus objects decoded by the worker rather than raw JSON.
+    """
+
+    def __init__(
+        self,
+        fleet: "RinnaiShardedFleet",
+        ip_address: str,
+        status_handler: Callable[[Any], None],
+        port: int = UNIT_PORT,
+        discovery_port: int = DISCOVERY_PORT,
+    ) -> None:
+        """Initialise the connection object."""
+        super().__init__(ip_address)
+        self._fleet = fleet
+        self.port = port
+        self.discovery_port = discovery_port
+        self._status_handler = status_handler
+        self._status: Optional[RinnaiSystemStatus] = None
+
+    def send_command(self, command: str) -> Future:
+        """Route the command to the worker owning the unit.
+
+        Returns a future that resolves once the unit acknowledges the command.
+        """
+        return self._fleet.send_command(self._ip_address, command)
+
+    def set_busy(self, busy: bool) -> None:
+        """Nothing to do, the worker tracks whether the unit is busy itself."""
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Return counters describing the connection."""
+        return self._fleet.get_unit_metrics(self._ip_address)
+
+    def start(self) -> None:
+        """Have a worker connect to the unit."""
+        self._register_client()
+        self._fleet.add(self)
+
+    def stop(self) -> None:
+        """Have the worker drop the unit, and release it."""
+        self._fleet.remove(self)
+        self._release_client()
+
+    def _status_received(self, kind: str, data: Any) -> None:
+        """Rebuild the status from what the worker sent and pass it on."""
+        if kind == _SNAPSHOT:
+            status = data
+        elif self._status is None:
+            return
+        else:
+            # Copied so a status handed out earlier never changes underneath anyone.
+            status = copy.deepcopy(self._status)
+            for path, value in data.items():
+                _apply(status, path, value)
+        self._status = status
+        self._status_handler(status)
+
+    def _state_received(self, value: int) -> None:
+        self._update_socket_state(RinnaiConnectionState(value))
+
+
+class RinnaiShardedFleet:  # pylint: disable=too-many-instance-attributes
+    """A fleet whose units are spread across worker processes.
+
+    Each worker runs a RinnaiFleet of its own, so decoding and status handling for
+    different units happen on different cores. Workers send back only the status
+    values that changed, from which the parent rebuilds each unit's status, so the
+    usual RinnaiSystem interface (subscribe_updates, get_stored_status, commands)
+    keeps working in the parent. Crashed workers are restarted and given their
+    units again.
+    """
+
+    def __init__(self, workers: Optional[int] = None) -> None:
+        """Initialise the fleet. Nothing runs until start is called."""
+        self._worker_count = workers or os.cpu_count() or 1
+        # Spawned rather than forked, since the parent has threads running.
+        self._context = multiprocessing.get_context("spawn")
+        self._workers: List[Optional[multiprocessing.Process]] = [None] * self._worker_count
+        self._requests: List[Optional[multiprocessing.Queue]] = [None] * self._worker_count
+        # A pipe from each worker rather than one shared queue, since a worker dying
+        # while writing to a shared queue can leave it locked for everyone else.
+        self._results: List[Optional[Connection]] = [None] * self._worker_count
+
+        # The unit registry, which outlives any worker: connection and shard by IP.
+        self._lock = threading.Lock()
+        self._connections: Dict[str, RinnaiShardConnection] = {}
+        self._shards: Dict[str, int] = {}
+        self._pending: Dict[int, Tuple[int, Future]] = {}
+        self._command_ids = itertools.count()
+        self._restarts = 0
+
+        self._thread_exit_flag = False
+        self._thread: threading.Thread = None
+
+    def add_unit(
+        self,
+        ip_address: str,
+        port: int = UNIT_PORT,
+        discovery_port: int = DISCOVERY_PORT,
+    ):
+        """Create a RinnaiSystem for the unit at ip_address, run by one of the workers.
+
+        Call get_status on it to connect, as with any other RinnaiSystem.
+        """
+        # Imported here as system depends on this module.
+        from .system import RinnaiSystem  # pylint: disable=import-outside-toplevel
+
+        return RinnaiSystem(
+            ip_address, fleet=self, port=port, discovery_port=discovery_port
+        )
+
+    def create_connection(
+        self,
+        ip_address: str,
+        status_handler: Callable[[Any], None],
+        port: int = UNIT_PORT,
+        discovery_port: int = DISCOVERY_PORT,
+    ) -> RinnaiShardConnection:
+        """Create a connection to the unit, to be run by a worker once started."""
+        return RinnaiShardConnection(self, ip_address, status_handler, port, discovery_port)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Return counters describing the fleet."""
+        with self._lock:
+            units = [0] * self._worker_count
+            for shard in self._shards.values():
+                units[shard] += 1
+            return {
+                "workers": self._worker_count,
+                "units_per_worker": units,
+                "worker_restarts": self._restarts,
+                "commands_pending": len(self._pending),
+            }
+
+    def get_unit_metrics(self, ip_address: str) -> Dict[str, Any]:
+        """Return counters describing one unit."""
+        with self._lock:
+            return {"shard": self._shards.get(ip_address), "worker_restarts": self._restarts}
+
+    def start(self) -> None:
+        """Start the workers, and the thread that listens to them."""
+        if self._thread is not None and self._thread.is_alive():
+            _LOGGER.error("Cannot start multiple fleet threads")
+            return
+        self._thread_exit_flag = False
+        for shard in range(self._worker_count):
+            self._start_worker(shard)
+        self._thread = threading.Thread(
+            target=self._event_loop, name="RinnaiShardedFleet", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the workers and the thread listening to them."""
+        self._thread_exit_flag = True
+        if self._thread is not None:
+            self._thread.join(SUPERVISE_INTERVAL_SECONDS * 5)
+            self._thread = None
+        for shard, worker in enumerate(self._workers):
+            if worker is None:
+                continue
+            with self._lock:
+                requests, self._requests[shard] = self._requests[shard], None
+            requests.put((_STOP,))
+            results = self._results[shard]
+            # Keep reading what it sends, so it is never stuck writing to a full pipe.
+            deadline = time.monotonic() + 5
+            while worker.is_alive() and time.monotonic() < deadline:
+                try:
+                    if results.poll(0.05):
+                        results.recv()
+                except (EOFError, OSError):
+                    worker.join(max(deadline - time.monotonic(), 0))
+            if worker.is_alive():
+                worker.terminate()
+            self._workers[shard] = None
+            results.close()
+            self._results[shard] = None
+        self._fail_pending(None, RinnaiCommandError("Fleet stopped"))
+
+    def add(self, connection: RinnaiShardConnection) -> None:
+        """Give the connection to the least loaded worker."""
+        ip_address = connection._ip_address  # pylint: disable=protected-access
+        with self._lock:
+            units = [0] * self._worker_count
+            for shard in self._shards.values():
+                units[shard] += 1
+            shard = units.index(min(units))
+            self._connections[ip_address] = connection
+            self._shards[ip_address] = shard
+            self._request(
+                shard, (_ADD, ip_address, connection.port, connection.discovery_port)
+            )
+
+    def remove(self, connection: RinnaiShardConnection) -> None:
+        """Take the connection away from its worker."""
+        ip_address = connection._ip_address  # pylint: disable=protected-access
+        with self._lock:
+            self._connections.pop(ip_address, None)
+            shard = self._shards.pop(ip_address, None)
+            if shard is not None:
+                self._request(shard, (_REMOVE, ip_address))
+
+    def send_command(self, ip_address: str, command: str) -> Future:
+        """Route a command to the worker owning the unit."""
+        future = Future()
+        with self._lock:
+            shard = self._shards.get(ip_address)
+            if shard is None:
+                future.set_exception(RinnaiCommandError(f"Unit {ip_address} not started"))
+                return future
+            command_id = next(self._command_ids)
+            if not self._request(shard, (_COMMAND, ip_address, command_id, command)):
+                future.set_exception(
+                    RinnaiCommandError(f"Fleet worker for unit {ip_address} not running")
+                )
+                return future
+            self._pending[command_id] = (shard, future)
+        return future
+
+    def _request(self, shard: int, request: Tuple) -> bool:
+        """Send a request to a worker, if it is running. Called with _lock held.
+
+        Returns False if the worker is not running, in which case _start_worker gives
+        it the units added meanwhile.
+        """
+        requests = self._requests[shard]
+        if requests is None:
+            return False
+        requests.put(request)
+        return True
+
+    def _start_worker(self, shard: int) -> None:
+        """Start the worker for a shard and give it the shard's units."""
+        requests = self._context.Queue()
+        results, writer = self._context.Pipe(duplex=False)
+        worker = self._context.Process(
+            target=_run_worker,
+            args=(requests, writer),
+            name=f"RinnaiShard-{shard}",
+            daemon=True,
+        )
+        worker.start()
+        # Only the worker holds the writing end now, so its death reads as EOF.
+        writer.close()
+        if self._results[shard] is not None:
+            self._results[shard].close()
+        self._results[shard] = results
+        # Under the lock, so no unit is added or removed in between: each ends up
+        # added to the new worker exactly once, ahead of any command for it.
+        with self._lock:
+            for ip_address, owner in self._shards.items():
+                if owner == shard:
+                    connection = self._connections[ip_address]
+                    requests.put(
+                        (_ADD, ip_address, connection.port, connection.discovery_port)
+                    )
+            self._requests[shard] = requests
+        self._workers[shard] = worker
+
+    def _event_loop(self) -> None:
+        """Thread applying what the workers send, and restarting crashed ones."""
+        while not self._thread_exit_flag:
+            readers = [results for results in self._results if results is not None]
+            for results in wait(readers, SUPERVISE_INTERVAL_SECONDS):
+                try:
+                    message = results.recv()
+                except (EOFError, OSError):
+                    # The worker has gone, and is restarted below.
+                    continue
+                self._handle_message(message)
+            self._supervise()
+
+    def _handle_message(self, message: Tuple) -> None:
+        """Pass a message from a worker to whoever it is for."""
+        # pylint: disable=protected-access
+        kind = message[0]
+        if kind == _ACK:
+            _, command_id, result, error = message
+            with self._lock:
+                entry = self._pending.pop(command_id, None)
+            if entry is not None:
+                _resolve(entry[1], result, error)
+            return
+        with self._lock:
+            connection = self._connections.get(message[1])
+        if connection is None:
+            return
+        if kind == _STATE:
+            connection._state_received(message[2])
+        else:
+            connection._status_received(kind, message[2])
+
+    def _supervise(self) -> None:
+        """Restart any worker that has died."""
+        # pylint: disable=protected-access
+        for shard, worker in enumerate(self._workers):
+            if worker is None or worker.is_alive() or self._thread_exit_flag:
+                continue
+            _LOGGER.error(
+                "Fleet worker %d exited with code %s, restarting it",
+                shard,
+                worker.exitcode,
+            )
+            self._restarts += 1
+            with self._lock:
+                # Refuse commands for the shard until the new worker has started.
+                self._requests[shard] = None
+            self._fail_pending(shard, RinnaiCommandError("Fleet worker crashed"))
+            with self._lock:
+                units = [
+                    connection
+                    for ip_address, connection in self._connections.items()
+                    if self._shards.get(ip_address) == shard
+                ]
+            for connection in units:
+                connection._state_received(RinnaiConnectionState.IDLE.value)
+            self._start_worker(shard)
+
+    def _fail_pending(self, shard: Optional[int], error: Exception) -> None:
+        """Fail the commands routed to a shard, or to any shard if None."""
+        with self._lock:
+            failed = [
+                command_id
+                for command_id, (owner, _) in self._pending.items()
+                if shard is None or owner == shard
+            ]
+            futures = [self._pending.pop(command_id)[1] for command_id in failed]
+        for future in futures:
+            _resolve(future, None, error)
+
+
+def _resolve(future: Future, result: Any, error: Optional[Exception]) -> None:
+    """Complete a future, unless the caller has cancelled it."""
+    try:
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        pass
@@ -0,0 +1,532 @@
+"""Simulated NBW2 module, to exercise the connections without any hardware.
+
+Run one from the command line with: python -m pyrinnaitouch.simulator --help
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import re
+import socket
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence
+
+from .const import (
+    ALL_ZONES,
+    COMMON_ZONE,
+    GENERAL_SYSTEM_OPERATION,
+    GENERAL_SYSTEM_STATUS,
+    MAIN_ZONES,
+    OVERALL_OPERATION,
+    STATE_OFF,
+    STATE_ON,
+    SYSTEM,
+    RinnaiUnitId,
+)
+from .discovery import BROADCAST_PREFIX, DISCOVERY_PORT
+from .framing import HELLO
+
+_LOGGER = logging.getLogger(__name__)
+
+# Where announcements go. Loopback, so that tests and benchmarks stay on the host.
+BROADCAST_ADDRESS = "127.255.255.255"
+BROADCAST_INTERVAL = 1
+
+# Unit documents by the mode letter the SYST OSS MD command uses.
+_MODES = {
+    "H": str(RinnaiUnitId.HEATER),
+    "C": str(RinnaiUnitId.COOLER),
+    "E": str(RinnaiUnitId.EVAP),
+}
+# Capability flags in SYST AVM, by unit.
+_CAPABILITIES = {
+    str(RinnaiUnitId.HEATER): "HG",
+    str(RinnaiUnitId.COOLER): "CG",
+    str(RinnaiUnitId.EVAP): "EC",
+}
+
+# A frame from the client: N, the sequence number, then NA or a JSON object.
+_HEADER = re.compile(r"N(\d{6})")
+_IDLE = "NA"
+
+
+def _y_n(value: bool) -> str:
+    return "Y" if value else "N"
+
+
+def _merge(target: Dict[str, Any], source: Dict[str, Any]) -> None:
+    """Merge source into target, ignoring anything target has no place for."""
+    for key, value in source.items():
+        if key not in target:
+            _LOGGER.debug("Ignoring unknown attribute %s", key)
+        elif isinstance(value, dict) and isinstance(target[key], dict):
+            _merge(target[key], value)
+        elif not isinstance(target[key], dict):
+            target[key] = str(value)
+
+
+class RinnaiSimulatedUnit:
+    """State of a simulated unit, kept as the JSON documents the module reports.
+
+    Holds a document for each of the heater, cooler and evaporative cooler that the
+    unit has, and reports the one for the current mode. Commands are merged into
+    those documents, then the status flags that follow from them (calling for heat,
+    compressor running, zones calling for work...) are worked out again. zones are
+    the main zones installed, plus U for a common zone. Measured temperatures are
+    in tenths of a degree, 999 meaning no sensor.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        mode: str = "C",
+        units: Iterable[RinnaiUnitId] = (RinnaiUnitId.HEATER, RinnaiUnitId.COOLER),
+        zones: str = "AB",
+        multi_set_point: bool = False,
+        temperature: int = 999,
+    ) -> None:
+        """Initialise the unit, switched off, in the given mode (H, C or E)."""
+        self._units: Dict[str, Dict[str, Any]] = {}
+        for unit in units:
+            unit_id = str(unit)
+            self._units[unit_id] = _unit_document(unit_id, zones, multi_set_point)
+        if _MODES.get(mode) not in self._units:
+            raise ValueError(f"Mode {mode} is not available on this unit")
+        self._system = {
+            "CFG": {
+                "MTSP": _y_n(multi_set_point),
+                "NC": "00",
+                "DF": "N",
+                "TU": "C",
+                "CF": "1",
+                "VR": "0183",
+                "CV": "0010",
+                "CC": "043",
+                **{"Z" + zone: f"Zone {zone}" for zone in MAIN_ZONES},
+            },
+            "AVM": {
+                **{flag: _y_n(unit_id in self._units) for unit_id, flag in _CAPABILITIES.items()},
+                "RA": "N",
+                "RH": "N",
+                "RC": "N",
+            },
+            "OSS": {
+                "DY": "TUE",
+                "TM": "16:45",
+                "BP": "Y",
+                "RG": "Y",
+                "ST": "N",
+                "MD": mode,
+                "DE": "N",
+                "DU": "N",
+                "AT": "999",
+                "LO": "N",
+            },
+            "FLT": {"AV": "N", "C3": "000"},
+        }
+        # Day and time being entered, while in time setting mode.
+        self._time_setting: Optional[Dict[str, str]] = None
+        self.set_temperature(temperature)
+        self.commands_applied = 0
+
+    @property
+    def unit_id(self) -> str:
+        """Return the unit reported for the current mode."""
+        return _MODES[self._system["OSS"]["MD"]]
+
+    def status(self) -> List[Dict[str, Any]]:
+        """Return the status as the module reports it."""
+        system = self._system
+        if self._time_setting is not None:
+            system = dict(system, STM=dict(self._time_setting))
+        return [{SYSTEM: system}, {self.unit_id: self._units[self.unit_id]}]
+
+    def set_temperature(self, temperature: int, zone: Optional[str] = None) -> None:
+        """Set the temperature measured in a zone, or in every zone if None."""
+        for document in self._units.values():
+            for zone_id in ALL_ZONES:
+                state = document.get(f"Z{zone_id}S")
+                if state is not None and zone in (None, zone_id):
+                    state["MT"] = str(temperature)
+        self._update()
+
+    def apply(self, command: Dict[str, Any]) -> None:
+        """Apply a command, or several merged into one document."""
+        self.commands_applied += 1
+        for unit_id, document in command.items():
+            if unit_id == SYSTEM:
+                self._apply_system(document)
+            elif unit_id in self._units:
+                _merge(self._units[unit_id], document)
+            else:
+                _LOGGER.debug("Ignoring command for missing unit %s", unit_id)
+        self._update()
+
+    def _apply_system(self, document: Dict[str, Any]) -> None:
+        oss = document.get("OSS", {})
+        if oss.get("MD") in _MODES and _MODES[oss["MD"]] in self._units:
+            self._system["OSS"]["MD"] = oss["MD"]
+        if oss.get("ST") == "C":
+            self._time_setting = {
+                "DY": self._system["OSS"]["DY"],
+                "TM": self._system["OSS"]["TM"],
+            }
+        stm = document.get("STM", {})
+        if self._time_setting is not None:
+            self._time_setting.update(
+                {key: str(stm[key]) for key in ("DY", "TM") if key in stm}
+            )
+            if stm.get("SV") == "Y":
+                self._system["OSS"].update(self._time_setting)
+                self._time_setting = None
+
+    def _update(self) -> None:
+        """Work out the status flags from the settings."""
+        for unit_id, document in self._units.items():
+            if unit_id == str(RinnaiUnitId.EVAP):
+                _update_evap(document)
+            else:
+                _update_heater_cooler(unit_id, document)
+
+
+def _unit_document(unit_id: str, zones: str, multi_set_point: bool) -> Dict[str, Any]:
+    """Return the document for a unit that has just been switched off."""
+    document: Dict[str, Any] = {
+        "CFG": {f"Z{zone}IS": _y_n(zone in zones) for zone in ALL_ZONES},
+    }
+    if unit_id == str(RinnaiUnitId.EVAP):
+        document[GENERAL_SYSTEM_OPERATION] = {
+            "SW": STATE_OFF,
+            "OP": "M",
+            "FS": STATE_OFF,
+            "PS": STATE_OFF,
+            "FL": "08",
+            "SP": "19",
+            **{f"Z{zone}UE": "Y" for zone in ALL_ZONES if zone in zones},
+        }
+        document[GENERAL_SYSTEM_STATUS] = {
+            "PW": "N",
+            "BY": "N",
+            "PO": "N",
+            "FO": "N",
+            **{f"Z{zone}AE": "N" for zone in ALL_ZONES if zone in zones},
+        }
+        return document
+
+    document["CFG"].update({"CF": "N", "PS": "Y", "DG": "W"})
+    document[OVERALL_OPERATION] = {"ST": STATE_OFF, "CF": "N", "FL": "08", "SN": "Y"}
+    if not multi_set_point:
+        document[GENERAL_SYSTEM_OPERATION] = {"OP": "M", "SP": "22", "AO": "N"}
+    document[GENERAL_SYSTEM_STATUS] = {"AT": "W", "AZ": "N"}
+    for zone in ALL_ZONES:
+        if zone not in zones:
+            continue
+        operation = {"UE": "Y"}
+        state = {"AE": "N", "MT": "999"}
+        if multi_set_point:
+            operation.update({"SP": "22", "OP": "M", "AO": "N"})
+            state.update({"AT": "W", "AZ": "N", "FS": "N"})
+        document[f"Z{zone}O"] = operation
+        document[f"Z{zone}S"] = state
+    return document
+
+
+def _update_heater_cooler(unit_id: str, document: Dict[str, Any]) -> None:
+    # pylint: disable=too-many-locals
+    heater = unit_id == str(RinnaiUnitId.HEATER)
+    running = document[OVERALL_OPERATION]["ST"] == STATE_ON
+    fan_only = document[OVERALL_OPERATION]["ST"] == "Z"
+    gso = document.get(GENERAL_SYSTEM_OPERATION)
+    working = False
+    for zone in ALL_ZONES:
+        operation = document.get(f"Z{zone}O")
+        if operation is None:
+            continue
+        state = document[f"Z{zone}S"]
+        # The common zone is conditioned whenever the unit runs.
+        enabled = zone == COMMON_ZONE or operation["UE"] == "Y"
+        set_point = int((operation if gso is None else gso).get("SP", "22")) * 10
+        measured = int(state["MT"])
+        if measured == 999:
+            wants = True
+        elif heater:
+            wants = measured < set_point
+        else:
+            wants = measured > set_point
+        calling = running and enabled and wants
+        working = working or calling
+        state["AE"] = _y_n(calling)
+        if "FS" in state:
+            state["FS"] = _y_n((running or fan_only) and enabled)
+            state["GV" if heater else "CP"] = _y_n(calling)
+    gss = document[GENERAL_SYSTEM_STATUS]
+    if heater:
+        gss.update({"HC": _y_n(working), "GV": _y_n(working), "PH": "N"})
+    else:
+        gss.update({"CC": _y_n(working), "CP": _y_n(working)})
+    gss["FS"] = _y_n(working or fan_only)
+
+
+def _update_evap(document: Dict[str, Any]) -> None:
+    gso = document[GENERAL_SYSTEM_OPERATION]
+    gss = document[GENERAL_SYSTEM_STATUS]
+    running = gso["SW"] == STATE_ON
+    auto = gso["OP"] == "A"
+    gss["FO"] = _y_n(running and (auto or gso["FS"] == STATE_ON))
+    gss["PO"] = _y_n(running and (auto or gso["PS"] == STATE_ON))
+
+
+class _RinnaiSimulatorProtocol(asyncio.Protocol):
+    """One client of the simulator."""
+
+    def __init__(self, simulator: "RinnaiSimulator") -> None:
+        self._simulator = simulator
+        self._transport: asyncio.Transport = None
+        self._unit: RinnaiSimulatedUnit = None
+        self._buffer = ""
+        self._outbound: asyncio.Queue = asyncio.Queue()
+        self._writer: asyncio.Task = None
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        self._transport = transport
+        self._unit = self._simulator.unit(transport.get_extra_info("sockname")[0])
+        self._simulator.connections += 1
+        self._writer = asyncio.get_running_loop().create_task(self._write())
+        self._reply("000000", greeting=True)
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        self._writer.cancel()
+
+    def data_received(self, data: bytes) -> None:
+        self._buffer += data.decode("utf-8", "replace")
+        decoder = json.JSONDecoder()
+        while True:
+            match = _HEADER.search(self._buffer)
+            if match is None:
+                # Keep what may be the start of the next header.
+                self._buffer = self._buffer[-6:]
+                return
+            body = match.end()
+            if self._buffer.startswith(_IDLE, body):
+                end = body + len(_IDLE)
+            elif self._buffer.startswith("{", body):
+                try:
+                    command, end = decoder.raw_decode(self._buffer, body)
+                except json.JSONDecodeError:
+                    # Not all here yet, unless it is garbage.
+                    if len(self._buffer) - body > 65536:
+                        self._buffer = self._buffer[body:]
+                        continue
+                    self._buffer = self._buffer[match.start():]
+                    return
+                self._unit.apply(command)
+            elif len(self._buffer) - body < len(_IDLE):
+                self._buffer = self._buffer[match.start():]
+                return
+            else:
+                _LOGGER.debug("Ignoring malformed frame %s", self._buffer[match.start():])
+                self._buffer = self._buffer[body:]
+                continue
+            self._simulator.frames_received += 1
+            self._buffer = self._buffer[end:]
+            self._reply(match.group(1))
+
+    def _reply(self, sequence: str, greeting: bool = False) -> None:
+        """Queue the status for sending once the latency has passed."""
+        frame = (
+            (HELLO if greeting else b"")
+            + b"N"
+            + sequence.encode()
+            + json.dumps(self._unit.status()).encode()
+        )
+        self._outbound.put_nowait((time.monotonic() + self._simulator.latency, frame))
+
+    async def _write(self) -> None:
+        """Write queued frames in order, each when due, in chunks if configured."""
+        simulator = self._simulator
+        while True:
+            due, frame = await self._outbound.get()
+            delay = due - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if self._transport.is_closing():
+                return
+            chunk_size = simulator.chunk_size or len(frame)
+            for start in range(0, len(frame), chunk_size):
+                if start and simulator.chunk_delay:
+                    await asyncio.sleep(simulator.chunk_delay)
+                    if self._transport.is_closing():
+                        return
+                self._transport.write(frame[start : start + chunk_size])
+            simulator.frames_sent += 1
+
+
+class RinnaiSimulator:  # pylint: disable=too-many-instance-attributes
+    """Serve simulated units over TCP and announce them on the discovery port.
+
+    Behaves like the module as far as the connections can tell: greets each client
+    with *HELLO* and the status, answers every N###### frame with the status under
+    the same sequence number, and applies the commands in between. A unit is
+    simulated for each local address clients connect to, so one simulator bound to
+    0.0.0.0 passes for as many units as it announces addresses. The settings below
+    may be changed while running:
+
+    latency is the seconds each frame is held before being answered, like a unit
+    that takes that long to process it. Frames are answered in order, but later
+    frames are not held up by earlier ones. chunk_size splits every frame sent into
+    pieces of that many bytes, chunk_delay seconds apart, to exercise reassembly.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        port: int = 0,
+        discovery_port: int = DISCOVERY_PORT,
+        *,
+        host: str = "127.0.0.1",
+        addresses: Sequence[str] = ("127.0.0.1",),
+        broadcast_address: str = BROADCAST_ADDRESS,
+        broadcast_interval: float = BROADCAST_INTERVAL,
+        unit_factory: Callable[[], RinnaiSimulatedUnit] = RinnaiSimulatedUnit,
+        latency: float = 0,
+        chunk_size: Optional[int] = None,
+        chunk_delay: float = 0,
+    ) -> None:
+        """Initialise the simulator. Nothing is served until it is started."""
+        # The port actually listened on, once started.
+        self.port = port
+        self._discovery_port = discovery_port
+        self._host = host
+        self._addresses = list(addresses)
+        self._broadcast_address = broadcast_address
+        self._broadcast_interval = broadcast_interval
+        self._unit_factory = unit_factory
+        self.latency = latency
+        self.chunk_size = chunk_size
+        self.chunk_delay = chunk_delay
+
+        self.units: Dict[str, RinnaiSimulatedUnit] = {}
+        self.connections = 0
+        self.frames_received = 0
+        self.frames_sent = 0
+
+        self._loop: asyncio.AbstractEventLoop = None
+        self._thread: threading.Thread = None
+        self._stopped: asyncio.Event = None
+
+    def unit(self, ip_address: str = "127.0.0.1") -> RinnaiSimulatedUnit:
+        """Return the unit simulated at the given address, creating it if need be."""
+        if ip_address not in self.units:
+            self.units[ip_address] = self._unit_factory()
+        return self.units[ip_address]
+
+    def start(self) -> "RinnaiSimulator":
+        """Serve from a thread of its own, returning once listening."""
+        ready = threading.Event()
+        self._thread = threading.Thread(
+            target=asyncio.run, args=(self.serve(ready),), name="RinnaiSimulator", daemon=True
+        )
+        self._thread.start()
+        ready.wait(10)
+        return self
+
+    def stop(self) -> None:
+        """Stop serving, if started with start."""
+        if self._thread is None:
+            return
+        self._loop.call_soon_threadsafe(self._stopped.set)
+        self._thread.join(5)
+        self._thread = None
+
+    def __enter__(self) -> "RinnaiSimulator":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    async def serve(self, ready: Optional[threading.Event] = None) -> None:
+        """Serve on the running event loop until stopped."""
+        self._loop = asyncio.get_running_loop()
+        self._stopped = asyncio.Event()
+        server = await self._loop.create_server(
+            lambda: _RinnaiSimulatorProtocol(self), self._host, self.port, backlog=1024
+        )
+        self.port = server.sockets[0].getsockname()[1]
+        broadcaster = self._loop.create_task(self._broadcast())
+        _LOGGER.debug("Simulator listening on port %d", self.port)
+        if ready is not None:
+            ready.set()
+        async with server:
+            await self._stopped.wait()
+        broadcaster.cancel()
+
+    async def _broadcast(self) -> None:
+        """Announce every address, as each unit's module would."""
+        sockets = []
+        for address in self._addresses:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+            sock.bind((address, 0))
+            sockets.append(sock)
+        try:
+            while True:
+                for sock in sockets:
+                    try:
+                        sock.sendto(
+                            BROADCAST_PREFIX + b"\0",
+                            (self._broadcast_address, self._discovery_port),
+                        )
+                    except OSError as e:
+                        _LOGGER.debug("Broadcast failed: %s", e)
+                await asyncio.sleep(self._broadcast_interval)
+        finally:
+            for sock in sockets:
+                sock.close()
+
+
+def main() -> None:
+    """Run a simulator until interrupted."""
+    parser = argparse.ArgumentParser(description=RinnaiSimulator.__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument("--port", type=int, default=27847)
+    parser.add_argument("--discovery-port", type=int, default=DISCOVERY_PORT)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--address", action="append", dest="addresses")
+    parser.add_argument("--broadcast-address", default=BROADCAST_ADDRESS)
+    parser.add_argument("--mode", choices=sorted(_MODES), default="C")
+    parser.add_argument("--zones", default="AB")
+    parser.add_argument("--multi-set-point", action="store_true")
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--chunk-size", type=int)
+    parser.add_argument("--chunk-delay", type=float, default=0)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    def unit_factory():
+        return RinnaiSimulatedUnit(
+            args.mode,
+            (RinnaiUnitId.HEATER, RinnaiUnitId.COOLER, RinnaiUnitId.EVAP),
+            args.zones,
+            args.multi_set_point,
+        )
+
+    simulator = RinnaiSimulator(
+        args.port,
+        args.discovery_port,
+        host=args.host,
+        addresses=args.addresses or ["0.0.0.0"],
+        broadcast_address=args.broadcast_address,
+        unit_factory=unit_factory,
+        latency=args.latency,
+        chunk_size=args.chunk_size,
+        chunk_delay=args.chunk_delay,
+    )
+    try:
+        asyncio.run(simulator.serve())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Hand statuses from the connection's thread to the thread processing them."""
+
+from collections import deque
+import queue
+import threading
+import time
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from .const import SYSTEM
+
+# Put on the mailbox when the connection stops, to end the processing thread.
+EXIT = "sys.exit"
+
+
+def is_time_setting(document: Any) -> bool:
+    """Return True if the document is the unit's signal that its time is being set."""
+    return (
+        isinstance(document, list)
+        and bool(document)
+        and isinstance(document[0], dict)
+        and SYSTEM in document[0]
+        and "STM" in document[0][SYSTEM]
+    )
+
+
+class RinnaiStatusMailbox:
+    """The latest status from the unit, and the control messages not yet processed.
+
+    Every status replaces the last, so however far processing falls behind only the
+    newest is decoded; the statuses replaced are counted as dropped. Control
+    messages, the exit request and the time setting signal, are kept in a lane of
+    their own and taken in the order they were put relative to the status. A time
+    setting signal directly after another replaces it too. Use in place of the
+    SimpleQueue handed to RinnaiPollConnection: put and get behave the same, but get
+    never returns more than one status behind.
+    """
+
+    def __init__(self) -> None:
+        """Initialise the mailbox, empty."""
+        self._condition = threading.Condition(threading.Lock())
+        # Counts what is put, to keep the order of the status and control messages.
+        self._sequence = 0
+        self._status: Optional[Tuple[int, Any]] = None
+        self._control: Deque[Tuple[int, Any]] = deque()
+        self._statuses_put = 0
+        self._statuses_dropped = 0
+        self._control_dropped = 0
+
+    def __len__(self) -> int:
+        """Return the number of messages waiting."""
+        with self._condition:
+            return len(self._control) + (self._status is not None)
+
+    def put(self, message: Any) -> None:
+        """Put a status or control message, replacing any status waiting."""
+        with self._condition:
+            self._sequence += 1
+            if message == EXIT or is_time_setting(message):
+                if (
+                    self._control
+                    and is_time_setting(message)
+                    and is_time_setting(self._control[-1][1])
+                ):
+                    self._control.pop()
+                    self._control_dropped += 1
+                self._control.append((self._sequence, message))
+            else:
+                self._statuses_put += 1
+                if self._status is not None:
+                    self._statuses_dropped += 1
+                self._status = (self._sequence, message)
+            self._condition.notify()
+
+    def get(self, block: bool = True, timeout: Optional[float] = None) -> Any:
+        """Take the oldest message waiting, waiting for one if block is True.
+
+        Raises queue.Empty if there is none within timeout.
+        """
+        with self._condition:
+            if block and timeout is None:
+                self._condition.wait_for(self._waiting)
+            elif block:
+                deadline = time.monotonic() + timeout
+                while not self._waiting():
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+            if not self._waiting():
+                raise queue.Empty
+            if self._status is not None and (
+                not self._control or self._status[0] < self._control[0][0]
+            ):
+                message = self._status[1]
+                self._status = None
+                return message
+            return self._control.popleft()[1]
+
+    def get_nowait(self) -> Any:
+        """Take the oldest message waiting. Raises queue.Empty if there is none."""
+        return self.get(False)
+
+    def _waiting(self) -> bool:
+        return self._status is not None or bool(self._control)
+
+    def get_metrics(self) -> Dict[str, Any]:
+        """Return counters of the statuses put, and those replaced before processing."""
+        with self._condition:
+            return {
+                "mailbox_statuses": self._statuses_put,
+                "mailbox_statuses_dropped": self._statuses_dropped,
+                "mailbox_time_settings_dropped": self._control_dropped,
+            }
@@ -0,0 +1,106 @@
+"""Call subscribers only when the fields they are interested in change."""
+
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+from .diff import RinnaiChangeSet
+
+# Stands for any one segment of a path, e.g. unit_status.zones.*.temperature.
+WILDCARD = "*"
+
+
+class _Node:  # pylint: disable=too-few-public-methods
+    """Subscribers to one path, and the nodes for the paths below it."""
+
+    __slots__ = ("children", "handlers")
+
+    def __init__(self) -> None:
+        self.children: Dict[str, "_Node"] = {}
+        self.handlers: List[Callable[[RinnaiChangeSet], Any]] = []
+
+
+class RinnaiChangeIndex:
+    """Subscribers to change sets, indexed by the paths they are interested in.
+
+    A subscriber to a path hears about changes to that field and, if it is a zone
+    or other part of the status, to every field in it: unit_status.zones.B covers
+    unit_status.zones.B.temperature. The paths are kept in a tree of their
+    segments, so matching a change costs a lookup per segment however many
+    subscribers there are, and only matching subscribers are ever called.
+    """
+
+    def __init__(self) -> None:
+        """Initialise the index, with no subscribers."""
+        self._root = _Node()
+        self._paths: Dict[Callable[[RinnaiChangeSet], Any], List[Tuple[str, ...]]] = {}
+
+    def __len__(self) -> int:
+        """Return the number of subscribers."""
+        return len(self._paths)
+
+    def __contains__(self, handler: Callable[[RinnaiChangeSet], Any]) -> bool:
+        return handler in self._paths
+
+    def add(self, handler: Callable[[RinnaiChangeSet], Any], paths: Iterable[str]) -> None:
+        """Subscribe handler to changes to any of the dotted paths."""
+        for path in paths:
+            segments = tuple(path.split("."))
+            if not all(segments):
+                raise ValueError(f"Invalid status path {path!r}")
+            node = self._root
+            for segment in segments:
+                node = node.children.setdefault(segment, _Node())
+            if handler not in node.handlers:
+                node.handlers.append(handler)
+            self._paths.setdefault(handler, []).append(segments)
+
+    def remove(self, handler: Callable[[RinnaiChangeSet], Any]) -> bool:
+        """Unsubscribe handler from all its paths. Returns False if not subscribed."""
+        all_segments = self._paths.pop(handler, None)
+        if all_segments is None:
+            return False
+        for segments in all_segments:
+            self._remove(self._root, segments, handler)
+        return True
+
+    def _remove(self, node: _Node, segments: Tuple[str, ...], handler) -> None:
+        """Remove handler from the node at segments below node, and prune it if empty."""
+        if not segments:
+            if handler in node.handlers:
+                node.handlers.remove(handler)
+            return
+        child = node.children.get(segments[0])
+        if child is None:
+            return
+        self._remove(child, segments[1:], handler)
+        if not child.handlers and not child.children:
+            del node.children[segments[0]]
+
+    def match(self, changes: RinnaiChangeSet) -> Dict[Callable, List[str]]:
+        """Return the paths of the changes each interested subscriber should get."""
+        matched: Dict[Callable, List[str]] = {}
+        root = self._root
+        if not root.children:
+            return matched
+        for path in changes.paths:
+            nodes = [root]
+            for segment in path.split("."):
+                found = []
+                for node in nodes:
+                    if (child := node.children.get(segment)) is not None:
+                        found.append(child)
+                    if (child := node.children.get(WILDCARD)) is not None:
+                        found.append(child)
+                if not found:
+                    break
+                for node in found:
+                    for handler in node.handlers:
+                        paths = matched.setdefault(handler, [])
+                        if not paths or paths[-1] != path:
+                            paths.append(path)
+                nodes = found
+        return matched
+
+    def dispatch(self, changes: RinnaiChangeSet) -> None:
+        """Call every interested subscriber with the changes it is interested in."""
+        for handler, paths in self.match(changes).items():
+            handler(changes.select(paths))
@@ -1,9 +1,10 @@
 ﻿"""Main system control"""
 
+import asyncio
+from concurrent.futures import Future
 import logging
-import queue
 from datetime import datetime
-from typing import Any
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Optional, Tuple, Union
 
 from .const import RinnaiSystemMode, RinnaiUnitId
 
@@ -12,8 +13,15 @@ try:
 except ImportError:
     from typing_extensions import Self
 
-from .pollconnection import RinnaiPollConnection
+from .asyncconnection import RinnaiAsyncConnection
+from .capture import RinnaiCaptureWriter
+from .diff import RinnaiChangeSet, diff, snapshot
+from .dispatch import RinnaiDispatcher, RinnaiMailbox
+from .subscriptions import RinnaiChangeIndex
+from .discovery import DISCOVERY_PORT
+from .pollconnection import UNIT_PORT, RinnaiPollConnection
 from .event import Event
+from .statusmailbox import EXIT, RinnaiStatusMailbox, is_time_setting
 from .system_status import RinnaiSystemStatus
 from .commands import (
     EVAP_ON_CMD,
@@ -57,34 +65,103 @@ from .commands import (
 
 from .util import daemonthreaded
 
+if TYPE_CHECKING:
+    from .fleet import RinnaiFleet
+    from .shard import RinnaiShardedFleet
+
 _LOGGER = logging.getLogger(__name__)
 
 
+def _merge_changes(
+    pending: Tuple[RinnaiChangeSet], args: Tuple[RinnaiChangeSet]
+) -> Tuple[RinnaiChangeSet]:
+    """Combine the change set a subscriber has not had yet with the next one."""
+    return (pending[0].merge(args[0]),)
+
+
 class RinnaiSystem:
-    """Main controller class to interact with the Rinnai Touch Wifi unit."""
+    """Main controller class to interact with the Rinnai Touch Wifi unit.
+
+    The coroutines sending commands, such as turn_unit_on or set_unit_zone_temp,
+    return the future from send_command once the command is queued, so it can be
+    awaited with asyncio.wrap_future for the unit's acknowledgement. They return
+    None if the command is not valid in the current mode, and raise
+    RinnaiBackpressureError if the unit has stopped draining commands.
+    """
 
     # pylint: disable=too-many-instance-attributes,too-many-public-methods
 
     instances = {}
 
-    def __init__(self, ip_address: str) -> None:
-        self._receiverqueue = queue.SimpleQueue()
-        self._connection = RinnaiPollConnection(ip_address, self._receiverqueue)
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        ip_address: str,
+        use_asyncio: bool = False,
+        *,
+        fleet: Optional[Union["RinnaiFleet", "RinnaiShardedFleet"]] = None,
+        port: int = UNIT_PORT,
+        discovery_port: int = DISCOVERY_PORT,
+        capture: Optional[RinnaiCaptureWriter] = None,
+        dispatcher: Optional[RinnaiDispatcher] = None,
+    ) -> None:
+        """Set up the connection to the unit.
+
+        By default the connection runs on threads of its own. With use_asyncio it
+        runs on the event loop get_status is called from, and with a fleet it is one
+        of many run by the fleet's thread. capture records the traffic of the
+        threaded connection, see RinnaiCaptureWriter. Subscribers are called on
+        the threads of dispatcher, see RinnaiDispatcher, so a slow one does not hold
+        up the statuses. Without one the threaded and fleet connections share a
+        default dispatcher, see RinnaiDispatcher.get_default, while with use_asyncio
+        subscribers are called straight away on the event loop they must not block.
+        """
+        # The latest status from the threaded connection, and its control messages.
+        self._receiverqueue = RinnaiStatusMailbox()
+        # Whether the connection and status handling run on threads of their own.
+        self._threaded = not use_asyncio and fleet is None
+        if fleet is not None:
+            # Statuses are handled directly on the fleet's thread.
+            self._connection = fleet.create_connection(
+                ip_address, self._handle_status_json, port, discovery_port
+            )
+        elif use_asyncio:
+            # Statuses are handled directly on the event loop, no polling thread.
+            self._connection = RinnaiAsyncConnection(
+                ip_address, self._handle_status_json, port, discovery_port
+            )
+        else:
+            self._connection = RinnaiPollConnection(
+                ip_address, self._receiverqueue, port, discovery_port, capture=capture
+            )
         self._lastupdated = 0
         self._status = RinnaiSystemStatus()
+        # Every field of the status last handed out, to work out what changed. Only
+        # kept while there are change subscribers, and taken again when one turns up.
+        self._snapshot: Optional[Dict[str, Any]] = None
+        self._snapshot_stale = False
+        self._watching_changes = False
         self._nosendupdates = 0
         RinnaiSystem.instances[ip_address] = self
         self._on_updated = Event()
+        self._on_changed = Event()
+        # Change subscribers interested in particular fields only.
+        self._change_index = RinnaiChangeIndex()
+        if dispatcher is None and use_asyncio:
+            dispatcher = RinnaiDispatcher(workers=0)
+        self._dispatcher = dispatcher or RinnaiDispatcher.get_default()
+        # The mailbox of every subscriber, by the kind of subscription and handler.
+        self._mailboxes: Dict[Tuple[str, Any], RinnaiMailbox] = {}
 
         # Start the thread
-        self.poll_loop()
+        if self._threaded:
+            self.poll_loop()
 
     @staticmethod
-    def get_instance(ip_address: str) -> Self:
+    def get_instance(ip_address: str, use_asyncio: bool = False) -> Self:
         """Get a single instance of the system defined by its IP address."""
         if ip_address in RinnaiSystem.instances:
             return RinnaiSystem.instances[ip_address]
-        return RinnaiSystem(ip_address)
+        return RinnaiSystem(ip_address, use_asyncio)
 
     @staticmethod
     def remove_instance(ip_address: str) -> None:
@@ -96,312 +173,409 @@ class RinnaiSystem:
         else:
             _LOGGER.warning("No instance found for IP: %s", ip_address)
 
-    def subscribe_updates(self, obj_method: Any) -> None:
-        """Subscribe to updates when the system status refreshes."""
-        self._on_updated += obj_method
+    def _mailbox(
+        self, kind: str, obj_method: Any, loop: Optional[asyncio.AbstractEventLoop]
+    ) -> RinnaiMailbox:
+        """Return a new mailbox for a subscriber, remembering it for unsubscribing.
+
+        A handler subscribed again has its earlier subscription replaced.
+        """
+        if (kind, obj_method) in self._mailboxes:
+            if kind == "updates":
+                self.unsubscribe_updates(obj_method)
+            else:
+                self.unsubscribe_changes(obj_method)
+        mailbox = self._dispatcher.mailbox(
+            obj_method,
+            loop,
+            _merge_changes if kind == "changes" else None,
+        )
+        self._mailboxes[(kind, obj_method)] = mailbox
+        return mailbox
+
+    def subscribe_updates(
+        self, obj_method: Any, loop: Optional[asyncio.AbstractEventLoop] = None
+    ) -> None:
+        """Subscribe to updates when the system status refreshes.
+
+        Given an event loop, obj_method is called on it rather than on the thread
+        handling the statuses or a thread of the dispatcher.
+        """
+        self._on_updated += self._mailbox("updates", obj_method, loop)
 
     def unsubscribe_updates(self, obj_method: Any) -> None:
         """Unsubscribe from updates received when the system status refreshes."""
-        self._on_updated -= obj_method
+        self._on_updated -= self._mailboxes.pop(("updates", obj_method), obj_method)
+
+    def subscribe_changes(
+        self,
+        obj_method: Any,
+        paths: Optional[Iterable[str]] = None,
+        loop: Optional[asyncio.AbstractEventLoop] = None,
+    ) -> None:
+        """Subscribe to the fields that changed whenever the system status does.
+
+        obj_method is called with a RinnaiChangeSet after the update subscribers,
+        and only if something actually changed. Given paths, such as has_fault,
+        unit_status.is_on or unit_status.zones.B.temperature, it is only called
+        when one of those fields changes (or any field within one, for paths like
+        unit_status.zones.B), with just those changes. A * segment matches any
+        one segment, e.g. unit_status.zones.*.temperature. Changes obj_method has
+        not been called with yet are merged, should it fall behind.
+        """
+        mailbox = self._mailbox("changes", obj_method, loop)
+        if paths is None:
+            self._on_changed += mailbox
+        else:
+            self._change_index.add(mailbox, paths)
+        if self._snapshot_stale:
+            self._snapshot = snapshot(self._status)
+            self._snapshot_stale = False
+        self._watching_changes = True
+
+    def unsubscribe_changes(self, obj_method: Any) -> None:
+        """Unsubscribe from the fields that changed."""
+        mailbox = self._mailboxes.pop(("changes", obj_method), obj_method)
+        if not self._change_index.remove(mailbox):
+            self._on_changed -= mailbox
+        self._watching_changes = any(kind == "changes" for kind, _ in self._mailboxes)
+
+    def get_subscriber_metrics(self) -> Dict[str, Dict[str, Any]]:
+        """Get counters describing how each subscriber keeps up with updates.
+
+        Subscribers are named after their handlers. Those flagged slow took longer
+        than the dispatcher's slow_handler_seconds to handle their last update.
+        """
+        return {
+            f"{kind}:{mailbox.name}": mailbox.get_metrics()
+            for (kind, _), mailbox in self._mailboxes.items()
+        }
 
     @daemonthreaded
     def poll_loop(self) -> None:
         """Main poll thread to receive updated messages from the unit."""
 
         # enter loop, wait for received (new) messages and push them to hass
-        while True:
-            new_status_json = self._receiverqueue.get()
-            if new_status_json:
-                if "sys.exit" in new_status_json:
-                    break
-                if (
-                    isinstance(new_status_json, list)
-                    and "SYST" in new_status_json[0]
-                    and "STM" in new_status_json[0]["SYST"]
-                ):
-                    self._status.set_timesetting(True)
-                    self._on_updated()
-                else:
-                    status = RinnaiSystemStatus()
-                    res = status.handle_status(new_status_json)
-                    if res:
-                        self._status = status
-                        self._on_updated()
-                    else:
-                        _LOGGER.error("JSON Error: %s", new_status_json)
+        while self._handle_status_json(self._receiverqueue.get()):
+            pass
         _LOGGER.debug("Shutting down the polling thread")
 
-    async def set_cooling_mode(self) -> bool:
+    def _handle_status_json(self, new_status_json: Any) -> bool:
+        """Process a single message from the unit. Returns False on exit request."""
+        if isinstance(new_status_json, RinnaiSystemStatus):
+            # Already decoded, by a RinnaiShardedFleet worker.
+            self._status = new_status_json
+            self._status_updated()
+            return True
+        if new_status_json:
+            if new_status_json == EXIT:
+                return False
+            if is_time_setting(new_status_json):
+                self._status.set_timesetting(True)
+                self._status_updated()
+            else:
+                status = RinnaiSystemStatus()
+                res = status.handle_status(new_status_json)
+                if res:
+                    self._status = status
+                    self._connection.set_busy(status.unit_status.is_busy)
+                    self._status_updated()
+                else:
+                    _LOGGER.error("JSON Error: %s", new_status_json)
+        return True
+
+    def _status_updated(self) -> None:
+        """Tell the subscribers about a new status, and what changed in it."""
+        if not self._watching_changes:
+            self._snapshot = None
+            self._snapshot_stale = True
+            self._on_updated()
+            return
+        new_snapshot = snapshot(self._status)
+        changes = diff(self._snapshot, new_snapshot)
+        self._snapshot = new_snapshot
+        self._on_updated()
+        if changes:
+            self._on_changed(changes)
+            self._change_index.dispatch(changes)
+
+    async def set_cooling_mode(self) -> Optional[Future]:
         """Set system to cooling mode."""
         return self.validate_and_send(MODE_COOL_CMD)
 
-    async def set_evap_mode(self) -> bool:
+    async def set_evap_mode(self) -> Optional[Future]:
         """Set system to evap mode."""
         return self.validate_and_send(MODE_EVAP_CMD)
 
-    async def set_heater_mode(self) -> bool:
+    async def set_heater_mode(self) -> Optional[Future]:
         """Set system to heater mode."""
         return self.validate_and_send(MODE_HEAT_CMD)
 
-    async def turn_unit_on(self) -> bool:
+    async def turn_unit_on(self) -> Optional[Future]:
         """Turn unit on (and system)."""
         cmd = UNIT_ON_CMD
         if self.validate_command(cmd):
-            self.send_command(cmd.format(unit_id=self._status.unit_status.unit_id))
-            return True
-        return False
+            return self.send_command(
+                cmd.format(unit_id=self._status.unit_status.unit_id)
+            )
+        return None
 
-    async def turn_heater_on(self) -> bool:
+    async def turn_heater_on(self) -> Optional[Future]:
         """Turn unit on (and system)."""
         cmd = UNIT_ON_CMD
         if self.validate_command(cmd):
-            self.send_command(cmd.format(unit_id=str(RinnaiUnitId.HEATER)))
-            return True
-        return False
+            return self.send_command(cmd.format(unit_id=str(RinnaiUnitId.HEATER)))
+        return None
 
-    async def turn_cooler_on(self) -> bool:
+    async def turn_cooler_on(self) -> Optional[Future]:
         """Turn unit on (and system)."""
         cmd = UNIT_ON_CMD
         if self.validate_command(cmd):
-            self.send_command(cmd.format(unit_id=str(RinnaiUnitId.COOLER)))
-            return True
-        return False
+            return self.send_command(cmd.format(unit_id=str(RinnaiUnitId.COOLER)))
+        return None
 
-    async def turn_unit_off(self) -> bool:
+    async def turn_unit_off(self) -> Optional[Future]:
         """Turn unit off (and system)."""
         cmd = UNIT_OFF_CMD
         if self.validate_command(cmd):
-            self.send_command(cmd.format(unit_id=self._status.unit_status.unit_id))
-            return True
-        return False
+            return self.send_command(
+                cmd.format(unit_id=self._status.unit_status.unit_id)
+            )
+        return None
 
-    async def turn_unit_fan_only(self) -> bool:
+    async def turn_unit_fan_only(self) -> Optional[Future]:
         """Turn circ fan on in while system is off."""
         cmd = UNIT_CIRC_FAN_ON
         if self.validate_command(cmd):
-            self.send_command(cmd.format(unit_id=self._status.unit_status.unit_id))
-            return True
-        return False
+            return self.send_command(
+                cmd.format(unit_id=self._status.unit_status.unit_id)
+            )
+        return None
 
-    async def set_unit_temp(self, temp: int) -> bool:
+    async def set_unit_temp(self, temp: int) -> Optional[Future]:
         """Set target temperature."""
         cmd = UNIT_SET_TEMP
         if self.validate_command(cmd):
-            self.send_command(
+            return self.send_command(
                 cmd.format(unit_id=self._status.unit_status.unit_id, temp=f"{temp:02d}")
             )
-            return True
-        return False
+        return None
 
-    async def set_unit_auto(self) -> bool:
+    async def set_unit_auto(self) -> Optional[Future]:
         """Set to auto mode."""
         cmd = UNIT_SET_AUTO
         if self.validate_command(cmd):
-            self.send_command(cmd.format(unit_id=self._status.unit_status.unit_id))
-            return True
-        return False
+            return self.send_command(
+                cmd.format(unit_id=self._status.unit_status.unit_id)
+            )
+        return None
 
-    async def set_unit_manual(self) -> bool:
+    async def set_unit_manual(self) -> Optional[Future]:
         """Set to manual mode."""
         cmd = UNIT_SET_MANUAL
         if self.validate_command(cmd):
-            self.send_command(cmd.format(unit_id=self._status.unit_status.unit_id))
-            return True
-        return False
+            return self.send_command(
+                cmd.format(unit_id=self._status.unit_status.unit_id)
+            )
+        return None
 
-    async def unit_advance(self) -> bool:
+    async def unit_advance(self) -> Optional[Future]:
         """Press advance button."""
         cmd = UNIT_ADVANCE
         if self.validate_command(cmd):
-            self.send_command(cmd.format(unit_id=self._status.unit_status.unit_id))
-            return True
-        return False
+            return self.send_command(
+                cmd.format(unit_id=self._status.unit_status.unit_id)
+            )
+        return None
 
-    async def unit_advance_cancel(self) -> bool:
+    async def unit_advance_cancel(self) -> Optional[Future]:
         """Press advance cancel button."""
         cmd = UNIT_ADVANCE_CANCEL
         if self.validate_command(cmd):
-            self.send_command(cmd.format(unit_id=self._status.unit_status.unit_id))
-            return True
-        return False
+            return self.send_command(
+                cmd.format(unit_id=self._status.unit_status.unit_id)
+            )
+        return None
 
-    async def turn_unit_zone_on(self, zone: str) -> bool:
+    async def turn_unit_zone_on(self, zone: str) -> Optional[Future]:
         """Turn a zone on."""
         cmd = UNIT_ZONE_ON
         if self.validate_command(cmd):
-            self.send_command(
+            return self.send_command(
                 cmd.format(unit_id=self._status.unit_status.unit_id, zone=zone)
             )
-            return True
-        return False
+        return None
 
-    async def turn_unit_zone_off(self, zone: str) -> bool:
+    async def turn_unit_zone_off(self, zone: str) -> Optional[Future]:
         """Turn a zone off."""
         cmd = UNIT_ZONE_OFF
         if self.validate_command(cmd):
-            self.send_command(
+            return self.send_command(
                 cmd.format(unit_id=self._status.unit_status.unit_id, zone=zone)
             )
-            return True
-        return False
+        return None
 
-    async def set_unit_zone_temp(self, zone: str, temp: int) -> bool:
+    async def set_unit_zone_temp(self, zone: str, temp: int) -> Optional[Future]:
         """Set target temperature for a zone."""
         cmd = UNIT_ZONE_SET_TEMP
         if self.validate_command(cmd):
-            self.send_command(
+            return self.send_command(
                 cmd.format(
                     unit_id=self._status.unit_status.unit_id,
                     zone=zone,
                     temp=f"{temp:02d}",
                 )
             )
-            return True
-        return False
+        return None
 
-    async def set_unit_zone_auto(self, zone: str) -> bool:
+    async def set_unit_zone_auto(self, zone: str) -> Optional[Future]:
         """Set zone to auto mode."""
         cmd = UNIT_ZONE_SET_AUTO
         if self.validate_command(cmd):
-            self.send_command(
+            return self.send_command(
                 cmd.format(unit_id=self._status.unit_status.unit_id, zone=zone)
             )
-            return True
-        return False
+        return None
 
-    async def set_unit_zone_manual(self, zone: str) -> bool:
+    async def set_unit_zone_manual(self, zone: str) -> Optional[Future]:
         """Set zone to manual mode."""
         cmd = UNIT_ZONE_SET_MANUAL
         if self.validate_command(cmd):
-            self.send_command(
+            return self.send_command(
                 cmd.format(unit_id=self._status.unit_status.unit_id, zone=zone)
             )
-            return True
-        return False
+        return None
 
-    async def set_unit_zone_advance(self, zone: str) -> bool:
+    async def set_unit_zone_advance(self, zone: str) -> Optional[Future]:
         """Press zone advance button."""
         cmd = UNIT_ZONE_ADVANCE
         if self.validate_command(cmd):
-            self.send_command(
+            return self.send_command(
                 cmd.format(unit_id=self._status.unit_status.unit_id, zone=zone)
             )
-            return True
-        return False
+        return None
 
-    async def set_unit_zone_advance_cancel(self, zone: str) -> bool:
+    async def set_unit_zone_advance_cancel(self, zone: str) -> Optional[Future]:
         """Press zone advance cacnel button."""
         cmd = UNIT_ZONE_ADVANCE_CANCEL
         if self.validate_command(cmd):
-            self.send_command(
+            return self.send_command(
                 cmd.format(unit_id=self._status.unit_status.unit_id, zone=zone)
             )
-            return True
-        return False
+        return None
 
-    async def turn_evap_on(self) -> bool:
+    async def turn_evap_on(self) -> Optional[Future]:
         """Turn on evap (and system)."""
         return self.validate_and_send(EVAP_ON_CMD)
 
-    async def turn_evap_off(self) -> bool:
+    async def turn_evap_off(self) -> Optional[Future]:
         """Turn off evap (and system)."""
         return self.validate_and_send(EVAP_OFF_CMD)
 
-    async def turn_evap_pump_on(self) -> bool:
+    async def turn_evap_pump_on(self) -> Optional[Future]:
         """Turn water pump on in evap mode."""
         return self.validate_and_send(EVAP_PUMP_ON)
 
-    async def turn_evap_pump_off(self) -> bool:
+    async def turn_evap_pump_off(self) -> Optional[Future]:
         """Turn water pump off in evap mode."""
         return self.validate_and_send(EVAP_PUMP_OFF)
 
-    async def turn_evap_fan_on(self) -> bool:
+    async def turn_evap_fan_on(self) -> Optional[Future]:
         """Turn fan on in evap mode."""
         return self.validate_and_send(EVAP_FAN_ON)
 
-    async def turn_evap_fan_off(self) -> bool:
+    async def turn_evap_fan_off(self) -> Optional[Future]:
         """Turn fan off in evap mode."""
         return self.validate_and_send(EVAP_FAN_OFF)
 
-    async def set_evap_fanspeed(self, speed: int) -> bool:
+    async def set_evap_fanspeed(self, speed: int) -> Optional[Future]:
         """Set fan speed in evap mode."""
         cmd = EVAP_FAN_SPEED
         if self.validate_command(cmd):
-            self.send_command(cmd.format(speed=f"{speed:02d}"))
-            return True
-        return False
+            return self.send_command(cmd.format(speed=f"{speed:02d}"))
+        return None
 
-    async def set_unit_fanspeed(self, speed: int) -> bool:
+    async def set_unit_fanspeed(self, speed: int) -> Optional[Future]:
         """Set fan speed."""
         cmd = UNIT_CIRC_FAN_SPEED
         if self.validate_command(cmd):
-            self.send_command(
+            return self.send_command(
                 cmd.format(
                     unit_id=self._status.unit_status.unit_id, speed=f"{speed:02d}"
                 )
             )
-            return True
-        return False
+        return None
 
-    async def set_evap_comfort(self, comfort: int) -> bool:
+    async def set_evap_comfort(self, comfort: int) -> Optional[Future]:
         """Set comfort level in Evap auto mode."""
         cmd = EVAP_SET_COMFORT
         if self.validate_command(cmd):
-            self.send_command(cmd.format(comfort=comfort))
-            return True
-        return False
+            return self.send_command(cmd.format(comfort=comfort))
+        return None
 
-    async def turn_evap_zone_on(self, zone: str) -> bool:
+    async def turn_evap_zone_on(self, zone: str) -> Optional[Future]:
         """Turn zone off in Evap mode."""
         cmd = EVAP_ZONE_ON
         if self.validate_command(cmd):
-            self.send_command(cmd.format(zone=zone))
-            return True
-        return False
+            return self.send_command(cmd.format(zone=zone))
+        return None
 
-    async def turn_evap_zone_off(self, zone: str) -> bool:
+    async def turn_evap_zone_off(self, zone: str) -> Optional[Future]:
         """Turn zone off in Evap mode."""
         cmd = EVAP_ZONE_OFF
         if self.validate_command(cmd):
-            self.send_command(cmd.format(zone=zone))
-            return True
-        return False
+            return self.send_command(cmd.format(zone=zone))
+        return None
 
-    async def set_evap_zone_auto(self, zone: str) -> bool:
+    async def set_evap_zone_auto(self, zone: str) -> Optional[Future]:
         """Set zone to Auto mode on Evap."""
         cmd = EVAP_ZONE_SET_AUTO
         if self.validate_command(cmd):
-            self.send_command(cmd.format(zone=zone))
-            return True
-        return False
+            return self.send_command(cmd.format(zone=zone))
+        return None
 
-    async def set_evap_zone_manual(self, zone: str) -> bool:
+    async def set_evap_zone_manual(self, zone: str) -> Optional[Future]:
         """Set zone to manual mode on Evap."""
         cmd = EVAP_ZONE_SET_MANUAL
         if self.validate_command(cmd):
-            self.send_command(cmd.format(zone=zone))
-            return True
-        return False
+            return self.send_command(cmd.format(zone=zone))
+        return None
 
-    async def set_system_time(self, set_datetime: datetime = None) -> bool:
-        """Set system time."""
+    async def set_system_time(self, set_datetime: datetime = None) -> Optional[Future]:
+        """Set system time.
+
+        Returns the future of the last of the three commands this takes, or None if
+        any of them is not valid in the current mode.
+        """
         now = datetime.now()
         if set_datetime is not None and isinstance(set_datetime, datetime):
             now = set_datetime
         set_time = now.strftime("%H:%M")
         set_day = now.strftime("%a").upper()
-        result = self.validate_and_send(SYSTEM_ENTER_TIME_SETTING)
+        entered = self.validate_and_send(SYSTEM_ENTER_TIME_SETTING)
         cmd = SYSTEM_SET_TIME
+        sent = None
         if self.validate_command(cmd):
-            result = (
-                self.send_command(cmd.format(day=set_day, time=set_time)) and result
-            )
-        return self.validate_and_send(SYSTEM_SAVE_TIME) and result
+            sent = self.send_command(cmd.format(day=set_day, time=set_time))
+        saved = self.validate_and_send(SYSTEM_SAVE_TIME)
+        if entered is None or sent is None:
+            return None
+        return saved
 
     def get_stored_status(self) -> RinnaiSystemStatus:
         """Get the current status without a refresh."""
         return self._status
 
+    def get_metrics(self) -> Dict[str, Any]:
+        """Get counters describing the connection to the unit.
+
+        For the threaded connection these include the statuses that were replaced
+        by newer ones before they could be processed.
+        """
+        if self._threaded:
+            return {**self._connection.get_metrics(), **self._receiverqueue.get_metrics()}
+        return self._connection.get_metrics()
+
     def validate_command(self, cmd: str) -> bool:
         """Validate a command is appropriat to the current operating mode."""
         if cmd in MODE_COMMANDS:
@@ -415,21 +589,30 @@ class RinnaiSystem:
             return True
         return False
 
-    def send_command(self, cmd: str) -> None:
-        """Send the command to the unit."""
-        self._connection.send_command(cmd)
+    def send_command(self, cmd: str) -> Future:
+        """Send the command to the unit.
+
+        Returns a concurrent.futures.Future that resolves to a RinnaiCommandAck with
+        the round trip latency once the unit acknowledges the command, or fails with
+        RinnaiCommandError on timeout or disconnect. Use asyncio.wrap_future to await
+        it. Raises RinnaiBackpressureError if the unit has stopped draining commands.
+        """
+        return self._connection.send_command(cmd)
 
-    def validate_and_send(self, cmd: str) -> bool:
-        """Validate and send a command."""
+    def validate_and_send(self, cmd: str) -> Optional[Future]:
+        """Validate and send a command.
+
+        Returns the future from send_command, or None if the command is not valid in
+        the current mode. Raises RinnaiBackpressureError as send_command does.
+        """
         if self.validate_command(cmd):
-            self.send_command(cmd)
-            return True
+            return self.send_command(cmd)
         _LOGGER.error(
             "Validation of command failed. Not sending. CMD: %s, Mode: %s",
             cmd,
             self._status.mode,
         )
-        return False
+        return None
 
     def register_socket_state_handler(self, socket_handler: Any) -> None:
         """Register a socket state handler to receive updates."""
@@ -440,14 +623,24 @@ class RinnaiSystem:
         self._connection.unregister_socket_state_handler(socket_handler)
 
     def get_status(self) -> RinnaiSystemStatus:
-        """Retrieve (initially empty) status from the unit."""
-        self._connection.start_thread()
+        """Retrieve (initially empty) status from the unit.
+
+        With use_asyncio this must be called from the event loop that will own the
+        connection.
+        """
+        if self._threaded:
+            self._connection.start_thread()
+        else:
+            self._connection.start()
         return self._status
 
     def shutdown(self) -> None:
         """Call this when removing the integration from home assistant."""
         try:
-            self._connection.stop_thread()
+            if self._threaded:
+                self._connection.stop_thread()
+            else:
+                self._connection.stop()
             _LOGGER.debug("Connection thread stopped")
         except Exception:  # pylint: disable=broad-except
             _LOGGER.exception("Error stopping the connection thread")
@@ -78,6 +78,16 @@ class RinnaiUnitStatus():
         self.fan_operating: bool = False #mtsp for heating and cooling it's per zone
         self.zones: Dict[str, Zone] = {}
 
+    @property
+    def is_busy(self) -> bool:
+        """Return True while the unit is working towards a new state."""
+        return (
+            self.preheating
+            or self.prewetting
+            or self.cooler_busy
+            or any(zone.calling_for_work for zone in self.zones.values())
+        )
+
     def set_mode(self,mode: str) -> None:
         """Set auto/manual mode."""
         # A = Auto Mode and M = Manual Mode
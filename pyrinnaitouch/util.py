@@ -46,3 +46,9 @@ class UnknownModeException(Exception):
     # __str__ is to print() the value
     def __str__(self):
         return repr(self.value)
+
+class RinnaiBackpressureError(Exception):
+    """Exception raised when the unit is not draining the commands sent to it"""
+
+class RinnaiCommandError(Exception):
+    """Exception raised when the unit did not acknowledge a command"""
@@ -7,7 +7,7 @@ with open("README.md", "r") as fh:  # pylint: disable=unspecified-encoding
 
 setup(
     name="pyrinnaitouch",
-    packages=find_packages(exclude=["tests", "tests.*"]),
+    packages=find_packages(exclude=["tests", "tests.*", "benchmarks", "benchmarks.*"]),
     version="0.13.3b1",
     license="mit",
     description="A python interface to the Rinnai Touch Wifi controller",
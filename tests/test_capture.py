@@ -0,0 +1,90 @@
+"""Tests for recording and replaying the traffic of a connection."""
+import os
+import threading
+import time
+
+from pyrinnaitouch.capture import (
+    RinnaiCaptureDirection,
+    RinnaiCaptureReader,
+    RinnaiCaptureReplay,
+    RinnaiCaptureWriter,
+)
+from pyrinnaitouch.const import RinnaiSystemMode
+from pyrinnaitouch.simulator import RinnaiSimulator
+from pyrinnaitouch.system import RinnaiSystem
+from pyrinnaitouch.system_status import RinnaiSystemStatus
+from .test_simulator import _free_udp_port
+from .test_system_parse import get_test_json
+
+
+def test_record_and_replay(tmp_path):
+    """A recorded connection replays to the same statuses, with or without an index."""
+    path = str(tmp_path / "unit.cap")
+    discovery_port = _free_udp_port()
+    with RinnaiSimulator(
+        discovery_port=discovery_port, broadcast_interval=0.1, chunk_size=50
+    ) as simulator, RinnaiCaptureWriter(path) as capture:
+        system = RinnaiSystem(
+            "127.0.0.1", port=simulator.port, discovery_port=discovery_port, capture=capture
+        )
+        updated = threading.Event()
+        system.subscribe_updates(updated.set)
+        system.get_status()
+        try:
+            assert updated.wait(5)
+            system.send_command('{"CGOM": {"GSO": {"SP": "19" } } }').result(5)
+        finally:
+            RinnaiSystem.remove_instance("127.0.0.1")
+        assert len(capture) > 3
+
+    with RinnaiCaptureReader(path) as reader:
+        directions = [record.direction for record in reader]
+        assert directions[0] == RinnaiCaptureDirection.CONNECTED
+        assert RinnaiCaptureDirection.SENT in directions
+        assert reader[1].timestamp >= reader[0].timestamp
+        assert bytes(reader[1].data[:7]) == b"*HELLO*"
+
+        status = RinnaiSystemStatus()
+        replay = RinnaiCaptureReplay(reader, status.handle_status, speed=None)
+        start = time.monotonic()
+        replay.run()
+        assert time.monotonic() - start < 0.5
+        assert replay.records == len(reader)
+        assert replay.errors == 0
+        assert status.mode == RinnaiSystemMode.COOLING
+        sent = b"".join(
+            bytes(record.data)
+            for record in reader
+            if record.direction == RinnaiCaptureDirection.SENT
+        )
+        assert b'"SP": "19"' in sent
+        count = len(reader)
+        # Records kept from inside the block do not stop the reader closing.
+        records = list(reader)
+    assert records[1].data.startswith(b"*HELLO*")
+
+    # Lose the index and half of the last record, as if the process had died.
+    with open(path, "r+b") as file:
+        file.truncate(os.path.getsize(path) - (count * 8 + 24) - 3)
+    with RinnaiCaptureReader(path) as reader:
+        assert len(reader) == count - 1
+
+
+def test_replay_identical_statuses(tmp_path):
+    """Replay hands over every status, even those identical to the last."""
+    path = str(tmp_path / "unit.cap")
+    status = get_test_json().encode()
+    with RinnaiCaptureWriter(path) as capture:
+        capture.record(RinnaiCaptureDirection.CONNECTED)
+        capture.record(RinnaiCaptureDirection.RECEIVED, b"*HELLO*N000001" + status)
+        capture.record(RinnaiCaptureDirection.RECEIVED, b"N000002" + status)
+
+    with RinnaiCaptureReader(path) as reader:
+        statuses = []
+        RinnaiCaptureReplay(reader, statuses.append, speed=None).run()
+        assert len(statuses) == 2
+        statuses.clear()
+        RinnaiCaptureReplay(
+            reader, statuses.append, speed=None, full_refresh_interval=None
+        ).run()
+        assert len(statuses) == 1
@@ -0,0 +1,111 @@
+"""Tests for working out what changed between statuses."""
+import json
+
+from pyrinnaitouch.const import RinnaiSystemMode
+from pyrinnaitouch.diff import RinnaiChange, diff, snapshot
+from pyrinnaitouch.dispatch import RinnaiDispatcher
+from pyrinnaitouch.simulator import RinnaiSimulatedUnit
+from pyrinnaitouch.system import RinnaiSystem
+from pyrinnaitouch.system_status import RinnaiSystemStatus
+
+
+def _status(unit):
+    status = RinnaiSystemStatus()
+    assert status.handle_status(unit.status())
+    return status
+
+
+def test_diff():
+    """Only the fields that changed are reported, flagged by the parts they are in."""
+    unit = RinnaiSimulatedUnit("C", zones="ABU", multi_set_point=True)
+    before = snapshot(_status(unit))
+    unit.apply(json.loads('{"CGOM": {"ZBO": {"SP": "16" } } }'))
+    unit.set_temperature(200, "B")
+    changes = diff(before, snapshot(_status(unit)))
+    assert sorted(changes.paths) == [
+        "unit_status.zones.B.set_temp",
+        "unit_status.zones.B.temperature",
+    ]
+    assert changes.get("unit_status.zones.B.set_temp").new == "16"
+    assert changes.mask == RinnaiChange.ZONE_B
+    assert changes.affects(RinnaiChange.ZONES)
+    assert not changes.affects(RinnaiChange.UNIT | RinnaiChange.ZONE_A)
+
+    unit.apply(json.loads('{"SYST": {"OSS": {"MD": "H" } } }'))
+    changes = diff(before, snapshot(_status(unit)))
+    assert changes.get("mode").new == RinnaiSystemMode.HEATING
+    assert changes.affects(RinnaiChange.MODE | RinnaiChange.UNIT)
+    assert not diff(before, before)
+
+
+def test_change_subscribers():
+    """Subscribers are given what changed, and only called when something did."""
+    unit = RinnaiSimulatedUnit("C", zones="AB")
+    # Subscribers are called straight away, so the changes can be checked in turn.
+    system = RinnaiSystem("127.0.0.9", dispatcher=RinnaiDispatcher(workers=0))
+    changes = []
+    system.subscribe_changes(changes.append)
+    try:
+        # pylint: disable=protected-access
+        system._handle_status_json(unit.status())
+        assert "unit_status.zones.A.user_enabled" in changes[0]
+        system._handle_status_json(unit.status())
+        assert len(changes) == 1
+        unit.apply(json.loads('{"CGOM": {"OOP": {"ST": "N" } } }'))
+        system._handle_status_json(unit.status())
+        assert changes[1].get("unit_status.is_on").new is True
+        assert changes[1].mask & RinnaiChange.UNIT
+    finally:
+        RinnaiSystem.remove_instance("127.0.0.9")
+
+
+def test_path_subscriptions():
+    """Subscribers to paths only hear about changes to those fields."""
+    unit = RinnaiSimulatedUnit("C", zones="ABU", multi_set_point=True)
+    # Subscribers are called straight away, so the changes can be checked in turn.
+    system = RinnaiSystem("127.0.0.9", dispatcher=RinnaiDispatcher(workers=0))
+    calls = {"zone_b": [], "temperatures": [], "is_on": [], "fault": []}
+    system.subscribe_changes(calls["zone_b"].append, ["unit_status.zones.B"])
+    system.subscribe_changes(
+        calls["temperatures"].append, ["unit_status.zones.*.temperature"]
+    )
+    system.subscribe_changes(calls["is_on"].append, ["unit_status.is_on"])
+    system.subscribe_changes(calls["fault"].append, ["has_fault"])
+    try:
+        # pylint: disable=protected-access
+        system._handle_status_json(unit.status())
+        assert all(len(changes) == 1 for changes in calls.values())
+        assert calls["is_on"][0].paths == {"unit_status.is_on"}
+
+        unit.set_temperature(200, "B")
+        system._handle_status_json(unit.status())
+        assert calls["zone_b"][1].paths == {"unit_status.zones.B.temperature"}
+        assert calls["zone_b"][1].mask == RinnaiChange.ZONE_B
+        assert calls["temperatures"][1].get("unit_status.zones.B.temperature").new == "200"
+        assert len(calls["is_on"]) == 1 and len(calls["fault"]) == 1
+
+        system.unsubscribe_changes(calls["zone_b"].append)
+        unit.set_temperature(210)
+        system._handle_status_json(unit.status())
+        assert len(calls["zone_b"]) == 2
+        assert len(calls["temperatures"][2]) == 3
+    finally:
+        RinnaiSystem.remove_instance("127.0.0.9")
+
+
+def test_late_change_subscriber():
+    """A subscriber joining late hears about changes from then on, not everything."""
+    unit = RinnaiSimulatedUnit("C", zones="AB")
+    system = RinnaiSystem("127.0.0.9", dispatcher=RinnaiDispatcher(workers=0))
+    changes = []
+    try:
+        # pylint: disable=protected-access
+        system._handle_status_json(unit.status())
+        assert system._snapshot is None
+        system.subscribe_changes(changes.append)
+        unit.apply(json.loads('{"CGOM": {"OOP": {"ST": "N" } } }'))
+        system._handle_status_json(unit.status())
+        assert changes[0].get("unit_status.is_on").new is True
+        assert "unit_status.zones.A.user_enabled" not in changes[0]
+    finally:
+        RinnaiSystem.remove_instance("127.0.0.9")
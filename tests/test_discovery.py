@@ -0,0 +1,103 @@
+"""Tests for the shared discovery listener."""
+import asyncio
+import socket
+import threading
+
+from pyrinnaitouch.discovery import RinnaiDiscovery
+from .test_simulator import _wait_until
+
+
+def _free_udp_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_discovery_wakes_waiter_and_caches():
+    """A broadcast wakes the waiter for its address and is then remembered."""
+    port = _free_udp_port()
+    discovery = RinnaiDiscovery.get_instance(port)
+    assert RinnaiDiscovery.get_instance(port) is discovery
+    discovery.acquire()
+    try:
+        other = discovery.discover("127.0.0.2")
+        found = discovery.discover("127.0.0.1")
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.sendto(b"Rinnai_NBW2_Module\x00\x01\x02", ("127.0.0.1", port))
+        info = found.result(5)
+        assert info.ip_address == "127.0.0.1"
+        assert info.module == "Rinnai_NBW2_Module"
+        assert not other.done()
+        other.cancel()
+
+        # Seen recently, so no need to wait for the next broadcast.
+        assert discovery.discover("127.0.0.1").result(0) == info
+        assert discovery.inventory() == {"127.0.0.1": info}
+    finally:
+        discovery.release()
+
+
+def _broadcast(port, address="127.0.0.1"):
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.sendto(b"Rinnai_NBW2_Module\x00\x01\x02", (address, port))
+
+
+def _listener_threads():
+    return [thread for thread in threading.enumerate() if thread.name == "RinnaiDiscovery"]
+
+
+def test_restart_while_stopping():
+    """Stopping and starting at once leaves exactly one listener, which works."""
+    port = _free_udp_port()
+    discovery = RinnaiDiscovery.get_instance(port)
+
+    def churn():
+        for _ in range(20):
+            discovery.acquire()
+            discovery.release()
+
+    threads = [threading.Thread(target=churn) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+    _wait_until(lambda: not _listener_threads())
+
+    discovery.acquire()
+    try:
+        assert len(_listener_threads()) == 1
+        found = discovery.discover("127.0.0.1")
+        _broadcast(port)
+        assert found.result(5).ip_address == "127.0.0.1"
+    finally:
+        discovery.release()
+    _wait_until(lambda: not _listener_threads())
+
+
+def test_listen_on_event_loop():
+    """Held from an event loop only, the port is listened on without a thread."""
+    port = _free_udp_port()
+    discovery = RinnaiDiscovery.get_instance(port)
+
+    async def discover():
+        loop = asyncio.get_running_loop()
+        threads = threading.active_count()
+        discovery.acquire(loop)
+        try:
+            found = discovery.discover("127.0.0.1")
+            # Let the loop open the endpoint before broadcasting.
+            await asyncio.sleep(0.05)
+            _broadcast(port)
+            info = await asyncio.wait_for(asyncio.wrap_future(found), 5)
+            assert threading.active_count() == threads
+
+            # A threaded user takes over the listening, and hands it back.
+            discovery.acquire()
+            assert len(_listener_threads()) == 1
+            discovery.release()
+            assert not _listener_threads()
+            return info
+        finally:
+            discovery.release(loop)
+
+    assert asyncio.run(discover()).ip_address == "127.0.0.1"
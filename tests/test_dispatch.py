@@ -0,0 +1,109 @@
+"""Tests for calling subscribers off the status handling thread."""
+import asyncio
+import json
+import threading
+import time
+
+from pyrinnaitouch.dispatch import RinnaiDispatcher
+from pyrinnaitouch.system import RinnaiSystem
+from pyrinnaitouch.simulator import RinnaiSimulatedUnit
+from .test_simulator import _wait_until
+
+
+def test_slow_subscriber():
+    """A slow subscriber neither holds up the others nor falls behind."""
+    unit = RinnaiSimulatedUnit("C", zones="AB")
+    unit.apply(json.loads('{"CGOM": {"OOP": {"ST": "N" } } }'))
+    dispatcher = RinnaiDispatcher(workers=2, slow_handler_seconds=0.05)
+    system = RinnaiSystem("127.0.0.9", dispatcher=dispatcher)
+    release = threading.Event()
+    fast, slow, changes = [], [], []
+
+    def slow_handler():
+        release.wait(5)
+        slow.append(system.get_stored_status().unit_status.set_temp)
+
+    system.subscribe_updates(
+        lambda: fast.append(system.get_stored_status().unit_status.set_temp)
+    )
+    system.subscribe_updates(slow_handler)
+    system.subscribe_changes(changes.append, ["unit_status.set_temp"])
+    try:
+        # pylint: disable=protected-access
+        for temp in range(20, 25):
+            unit.apply(json.loads(f'{{"CGOM": {{"GSO": {{"SP": "{temp}" }} }} }}'))
+            system._handle_status_json(unit.status())
+        _wait_until(lambda: fast and fast[-1] == 24)
+        assert not slow
+        time.sleep(0.1)
+        release.set()
+        _wait_until(lambda: slow and slow[-1] == 24)
+        name = "updates:test_slow_subscriber.<locals>.slow_handler"
+        _wait_until(lambda: system.get_subscriber_metrics()[name]["delivered"] == 2)
+        _wait_until(lambda: changes and changes[-1].get("unit_status.set_temp").new == 24)
+        # Updates that arrived while the slow one was busy came down to one.
+        assert len(slow) == 2
+        # However many were merged, each subscriber call follows on from the last.
+        temps = [change.get("unit_status.set_temp") for change in changes]
+        assert all(temp.old == previous.new for previous, temp in zip(temps, temps[1:]))
+        slow_metrics = system.get_subscriber_metrics()[name]
+        assert slow_metrics["dropped"] == 3
+        assert slow_metrics["slow_calls"] >= 1
+        assert slow_metrics["max_handler_seconds"] > 0.05
+    finally:
+        RinnaiSystem.remove_instance("127.0.0.9")
+        dispatcher.shutdown()
+
+
+def test_loop_subscriber():
+    """A subscriber can be called on its own event loop."""
+    unit = RinnaiSimulatedUnit("H", zones="A")
+    system = RinnaiSystem("127.0.0.9")
+
+    async def subscribe_and_wait():
+        loop = asyncio.get_running_loop()
+        called = asyncio.Event()
+        threads = []
+
+        def handler():
+            threads.append(threading.get_ident())
+            called.set()
+
+        system.subscribe_updates(handler, loop)
+        # pylint: disable=protected-access
+        await loop.run_in_executor(None, system._handle_status_json, unit.status())
+        await asyncio.wait_for(called.wait(), 5)
+        system.unsubscribe_updates(handler)
+        return threads
+
+    try:
+        assert asyncio.run(subscribe_and_wait()) == [threading.get_ident()]
+        assert not system.get_subscriber_metrics()
+    finally:
+        RinnaiSystem.remove_instance("127.0.0.9")
+
+
+def test_subscribe_twice():
+    """Subscribing a handler again replaces its subscription rather than orphaning it."""
+    unit = RinnaiSimulatedUnit("H", zones="A")
+    system = RinnaiSystem("127.0.0.9")
+    calls = []
+
+    def handler(*args):
+        calls.append(args)
+
+    try:
+        system.subscribe_updates(handler)
+        system.subscribe_updates(handler)
+        system.subscribe_changes(handler)
+        system.subscribe_changes(handler, ["mode"])
+        # pylint: disable=protected-access
+        system._handle_status_json(unit.status())
+        _wait_until(lambda: len(calls) == 2)
+        time.sleep(0.1)
+        assert len(calls) == 2
+        system.unsubscribe_updates(handler)
+        system.unsubscribe_changes(handler)
+        assert not system.get_subscriber_metrics()
+    finally:
+        RinnaiSystem.remove_instance("127.0.0.9")
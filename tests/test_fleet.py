@@ -0,0 +1,116 @@
+"""Tests for driving units from a fleet."""
+import socket
+import threading
+
+from pyrinnaitouch.discovery import RinnaiDiscovery
+from pyrinnaitouch.fleet import RinnaiFleet
+from pyrinnaitouch.const import RinnaiSystemMode
+from pyrinnaitouch.pollconnection import RinnaiConnection, RinnaiConnectionState
+from pyrinnaitouch.system import RinnaiSystem
+from .test_system_parse import get_test_json
+
+
+def _serve_one(server):
+    """Greet one client, then answer each frame with the sample status."""
+    client, _ = server.accept()
+    with client:
+        try:
+            client.sendall(b"*HELLO*N000000" + get_test_json().encode())
+            while data := client.recv(4096):
+                client.sendall(data[:7] + get_test_json().encode())
+        except ConnectionError:
+            # The client dropped the connection.
+            pass
+
+
+def test_fleet_unit_status():
+    """A unit added to a fleet connects and parses statuses on the fleet's thread."""
+    with socket.create_server(("127.0.0.1", 0)) as server:
+        port = server.getsockname()[1]
+        threading.Thread(target=_serve_one, args=(server,), daemon=True).start()
+        # Seen recently, so there is no need to wait for a broadcast.
+        RinnaiDiscovery.get_instance(port).touch("127.0.0.1")
+
+        fleet = RinnaiFleet()
+        system = fleet.add_unit("127.0.0.1", port=port, discovery_port=port)
+        updated = threading.Event()
+        system.subscribe_updates(updated.set)
+        system.get_status()
+        fleet.start()
+        try:
+            assert updated.wait(5)
+            assert system.get_stored_status().mode == RinnaiSystemMode.COOLING
+            ack = system.send_command('{"CGOM": {"GSO": {"SP": "21" } } }').result(5)
+            assert ack.sequence == 2
+        finally:
+            RinnaiSystem.remove_instance("127.0.0.1")
+            fleet.stop()
+
+
+def test_fleet_unit_error():
+    """A unit whose handling raises is dropped, without stopping the others."""
+    servers = [socket.create_server((address, 0)) for address in ("127.0.0.1", "127.0.0.2")]
+    port = servers[0].getsockname()[1]
+    discovery = RinnaiDiscovery.get_instance(port)
+    fleet = RinnaiFleet()
+    systems = []
+    for server in servers:
+        threading.Thread(target=_serve_one, args=(server,), daemon=True).start()
+        address, unit_port = server.getsockname()
+        discovery.touch(address)
+        systems.append(fleet.add_unit(address, port=unit_port, discovery_port=port))
+
+    def broken_handler(state):
+        if state == RinnaiConnectionState.CONNECTED:
+            raise RuntimeError("Handler failed")
+
+    systems[0].register_socket_state_handler(broken_handler)
+    updated = threading.Event()
+    systems[1].subscribe_updates(updated.set)
+    for system in systems:
+        system.get_status()
+    fleet.start()
+    try:
+        assert updated.wait(5)
+        ack = systems[1].send_command('{"CGOM": {"GSO": {"SP": "21" } } }').result(5)
+        assert ack.sequence == 2
+        # pylint: disable=protected-access
+        assert fleet._thread.is_alive()
+        assert systems[0].get_metrics()["connect_failures"] >= 1
+    finally:
+        RinnaiSystem.remove_instance("127.0.0.1")
+        RinnaiSystem.remove_instance("127.0.0.2")
+        fleet.stop()
+        for server in servers:
+            server.close()
+
+
+def test_fleet_stop_releases():
+    """Stopping the fleet releases every unit, even those it never took on."""
+    with socket.create_server(("127.0.0.1", 0)) as server:
+        port = server.getsockname()[1]
+        threading.Thread(target=_serve_one, args=(server,), daemon=True).start()
+        RinnaiDiscovery.get_instance(port).touch("127.0.0.1")
+
+        fleet = RinnaiFleet()
+        running = fleet.add_unit("127.0.0.1", port=port, discovery_port=port)
+        updated = threading.Event()
+        running.subscribe_updates(updated.set)
+        running.get_status()
+        fleet.start()
+        assert updated.wait(5)
+        # pylint: disable=protected-access
+        wake_sockets = (fleet._wake_reader, fleet._wake_writer)
+        fleet.stop()
+        assert RinnaiConnection.clients["127.0.0.1"] == 0
+        assert all(wake_socket.fileno() == -1 for wake_socket in wake_sockets)
+        assert fleet._selector is None
+
+        # Handed over, but the fleet is stopped without ever having been started.
+        idle = RinnaiFleet()
+        waiting = idle.add_unit("127.0.0.4", port=port, discovery_port=port)
+        waiting.get_status()
+        idle.stop()
+        assert RinnaiConnection.clients["127.0.0.4"] == 0
+        RinnaiSystem.remove_instance("127.0.0.1")
+        RinnaiSystem.remove_instance("127.0.0.4")
@@ -0,0 +1,106 @@
+"""Tests for the incremental frame scanner."""
+import json
+
+import pytest
+
+from pyrinnaitouch.framing import RinnaiFrameScanner, RinnaiOutboundQueue
+from .test_system_parse import get_test_json
+
+
+def _collect(scanner):
+    """Drain complete frames from the scanner as (sequence, bytes) tuples."""
+    frames = []
+    while (frame := scanner.next_frame()) is not None:
+        with frame.payload as payload:
+            frames.append((frame.sequence, bytes(payload)))
+    return frames
+
+
+def test_hello_and_status():
+    """A greeting followed by a status frame fed in one go."""
+    status = get_test_json().encode()
+    scanner = RinnaiFrameScanner()
+    scanner.feed(b"*HELLO*N000012" + status)
+    frames = _collect(scanner)
+    assert frames == [(None, b"*HELLO*"), (12, status)]
+    assert json.loads(frames[1][1])[0]["SYST"]["CFG"]["MTSP"] == "N"
+    assert len(scanner) == 0
+
+
+def test_byte_by_byte():
+    """Frames fragmented down to single bytes are reassembled."""
+    payload = b'[{"A": ["x]", "\\"[", [1, [2]]]}]'
+    scanner = RinnaiFrameScanner()
+    frames = []
+    for byte in b"N000001" + payload + b"N000002" + payload:
+        scanner.feed(bytes([byte]))
+        frames.extend(_collect(scanner))
+    assert frames == [(1, payload), (2, payload)]
+
+
+def test_nested_arrays():
+    """The frame ends at the matching bracket, not the first closing one."""
+    scanner = RinnaiFrameScanner()
+    scanner.feed(b'N000003[[1],[2]]N000004[3]')
+    assert _collect(scanner) == [(3, b"[[1],[2]]"), (4, b"[3]")]
+
+
+def test_recovery_after_garbage():
+    """Leading garbage is skipped up to the next frame header."""
+    scanner = RinnaiFrameScanner()
+    scanner.feed(b"garbageN000005[5]")
+    assert _collect(scanner) == [(5, b"[5]")]
+
+
+def test_unrecoverable_garbage():
+    """Data without any frame header is reported."""
+    scanner = RinnaiFrameScanner()
+    scanner.feed(b"complete garbage")
+    with pytest.raises(ValueError):
+        scanner.next_frame()
+
+
+def test_oversized_frame():
+    """A frame that never closes is not buffered forever."""
+    scanner = RinnaiFrameScanner(max_frame_size=64)
+    scanner.feed(b"N000006[" + b"1," * 64)
+    with pytest.raises(ValueError):
+        scanner.next_frame()
+
+
+def test_receive_into_buffer():
+    """Data received in place is consumed by offset and the buffer reused."""
+    scanner = RinnaiFrameScanner(buffer_size=32)
+    for sequence in range(20):
+        data = b"N%06d[%d]" % (sequence, sequence)
+        with scanner.get_buffer(len(data)) as view:
+            view[: len(data)] = data
+        scanner.buffer_updated(len(data))
+        assert _collect(scanner) == [(sequence, b"[%d]" % sequence)]
+    assert scanner.capacity == 32
+    assert scanner.high_water_mark == len(b"N000019[19]")
+
+
+def test_receive_buffer_grows():
+    """A frame larger than the buffer makes it grow."""
+    payload = b"[" + b"1," * 40 + b"1]"
+    scanner = RinnaiFrameScanner(buffer_size=16)
+    for offset in range(0, len(payload) + 7, 10):
+        scanner.feed((b"N000001" + payload)[offset : offset + 10])
+    assert _collect(scanner) == [(1, payload)]
+    assert scanner.capacity >= len(payload) + 7
+
+
+def test_outbound_partial_sends():
+    """Partial writes advance through the queued frames without copying them."""
+    queue = RinnaiOutboundQueue()
+    queue.append(b"N000001NA")
+    queue.append(b"N000002NA")
+    assert len(queue) == 18
+    queue.advance(4)
+    assert [bytes(view) for view in queue.buffers()] == [b"001NA", b"N000002NA"]
+    queue.advance(7)
+    assert [bytes(view) for view in queue.buffers()] == [b"00002NA"]
+    queue.advance(7)
+    assert len(queue) == 0
+    assert not queue.buffers()
@@ -0,0 +1,75 @@
+"""Tests for running connections through the impairment proxy."""
+import socket
+import time
+
+from pyrinnaitouch.impairment import RinnaiImpairment, RinnaiImpairmentProxy
+from pyrinnaitouch.pollconnection import RinnaiConnectionState
+from pyrinnaitouch.simulator import RinnaiSimulator
+from pyrinnaitouch.system import RinnaiSystem
+from .test_simulator import _free_udp_port, _wait_until
+
+
+def test_latency_and_reset_recovery():
+    """Commands take the added latency, and a reset mid-frame is recovered from."""
+    discovery_port = _free_udp_port()
+    with RinnaiSimulator(
+        discovery_port=discovery_port, broadcast_interval=0.1
+    ) as simulator, RinnaiImpairmentProxy(
+        simulator.port,
+        upstream=RinnaiImpairment(latency=0.02),
+        downstream=RinnaiImpairment(latency=0.02, jitter=0.01, chunk_size=5),
+    ) as proxy:
+        system = RinnaiSystem("127.0.0.1", port=proxy.port, discovery_port=discovery_port)
+        connection = system._connection  # pylint: disable=protected-access
+        system.get_status()
+        try:
+            _wait_until(lambda: system.get_stored_status().unit_status.unit_id == "CGOM")
+            ack = system.send_command('{"CGOM": {"GSO": {"SP": "19" } } }').result(5)
+            assert 0.04 <= ack.latency < 1
+
+            # Cut the connection part way through the next status.
+            proxy.reset_after(proxy.downstream.bytes_forwarded + 100)
+            dropped = time.monotonic()
+            system.send_command('{"CGOM": {"GSO": {"SP": "20" } } }')
+            _wait_until(lambda: proxy.resets == 1)
+            _wait_until(lambda: connection.get_metrics()["reconnects"] == 1)
+            assert connection.socket_state() == RinnaiConnectionState.CONNECTED
+            assert connection.get_metrics()["last_reconnect_seconds"] < 1
+            assert time.monotonic() - dropped < 2
+            _wait_until(lambda: proxy.connections == 2)
+        finally:
+            RinnaiSystem.remove_instance("127.0.0.1")
+
+
+def test_bandwidth_and_stall():
+    """Bytes are held while stalled, and trickle through at the bandwidth cap."""
+    with socket.create_server(("127.0.0.1", 0)) as server, RinnaiImpairmentProxy(
+        server.getsockname()[1], downstream=RinnaiImpairment(bandwidth=10000)
+    ) as proxy:
+        client = socket.create_connection(("127.0.0.1", proxy.port))
+        upstream, _ = server.accept()
+        with client, upstream:
+            proxy.stall(0.2)
+            start = time.monotonic()
+            upstream.sendall(b"x" * 2000)
+            received = b""
+            while len(received) < 2000:
+                received += client.recv(4096)
+            # Held for the stall, then 0.2 s at 10000 bytes a second.
+            assert 0.35 <= time.monotonic() - start < 1
+
+
+def test_chunks_arrive_separately():
+    """Data split into chunks reaches the receiver one chunk at a time."""
+    with socket.create_server(("127.0.0.1", 0)) as server, RinnaiImpairmentProxy(
+        server.getsockname()[1],
+        downstream=RinnaiImpairment(chunk_size=5, chunk_interval=0.02),
+    ) as proxy:
+        client = socket.create_connection(("127.0.0.1", proxy.port))
+        upstream, _ = server.accept()
+        with client, upstream:
+            upstream.sendall(b"x" * 20)
+            reads = []
+            while sum(reads) < 20:
+                reads.append(len(client.recv(4096)))
+            assert reads == [5, 5, 5, 5]
@@ -0,0 +1,45 @@
+"""Tests for the reconnect policy."""
+import random
+
+import pytest
+
+from pyrinnaitouch.discovery import RECENTLY_SEEN_SECONDS
+from pyrinnaitouch.reconnect import RinnaiReconnectPolicy
+
+
+def test_reconnect_policy():
+    """Reconnect straight away, back off with jitter, and rediscover after failures."""
+    policy = RinnaiReconnectPolicy(
+        initial_delay=1, max_delay=8, backoff_factor=2, discovery_after_failures=3,
+        rng=random.Random(1),
+    )
+    # The first connection waits for a broadcast.
+    assert policy.needs_discovery()
+    assert policy.discovery_max_age(0) == RECENTLY_SEEN_SECONDS
+    policy.attempt_started(0, True)
+    policy.attempt_succeeded(0.5)
+    assert not policy.needs_discovery()
+
+    # After a drop the last known endpoint is tried first, with growing delays.
+    policy.disconnected(100)
+    now = 100
+    for failure, ceiling in enumerate((1, 2, 4, 8, 8)):
+        assert policy.needs_discovery() == (failure >= 3)
+        policy.attempt_started(now, policy.needs_discovery())
+        now += 0.1
+        delay = policy.attempt_failed(now)
+        assert ceiling / 2 <= delay <= ceiling
+        now += delay
+    # Only broadcasts since the last failure count.
+    assert policy.discovery_max_age(now) == pytest.approx(delay)
+
+    policy.attempt_started(now, True)
+    policy.attempt_succeeded(now + 0.1)
+    assert not policy.needs_discovery()
+    metrics = policy.get_metrics()
+    assert metrics["reconnects"] == 1
+    assert metrics["connect_failures"] == 5
+    assert metrics["consecutive_connect_failures"] == 0
+    assert metrics["last_reconnect_seconds"] == pytest.approx(now + 0.1 - 100)
+    assert [attempt.succeeded for attempt in policy.attempts] == [True] + [False] * 5 + [True]
+    assert [attempt.discovered for attempt in policy.attempts][-3:] == [True, True, True]
@@ -0,0 +1,209 @@
+"""Tests for the transport independent session."""
+import json
+from queue import SimpleQueue
+import time
+
+import pytest
+
+from pyrinnaitouch.pollconnection import RinnaiPollConnection
+from pyrinnaitouch.session import RinnaiSession
+from pyrinnaitouch.util import RinnaiBackpressureError, RinnaiCommandError
+
+
+def test_backpressure():
+    """Senders are pushed back at the high water mark until the low water mark."""
+    session = RinnaiSession(lambda status: None, high_water=100, low_water=40)
+    session.reset(0)
+    # Distinct settings, so that none of them are coalesced.
+    commands = (f'{{"HGOM": {{"GSO": {{"F{field}": "Y" }} }} }}' for field in range(100))
+    while not session.get_metrics()["send_paused"]:
+        session.send_command(next(commands), timeout=0)
+    with pytest.raises(RinnaiBackpressureError):
+        session.send_command(next(commands), timeout=0)
+
+    # Release and "send" frames, acknowledging each one, until the senders resume.
+    while session.get_metrics()["send_paused"]:
+        assert session.queue_due_frame(0)
+        frame = b"".join(session.outbound_buffers())
+        session.data_sent(len(frame), 0)
+        session.data_received(frame[:7] + b"[{}]", 0)
+    assert session.backlog <= 40
+    session.send_command(next(commands), timeout=0)
+
+
+def test_poll_connection_backpressure():
+    """The threaded connection pushes back at once rather than block the caller."""
+    connection = RinnaiPollConnection("127.0.0.9", SimpleQueue())
+    commands = (f'{{"HGOM": {{"GSO": {{"F{field}": "Y" }} }} }}' for field in range(1000))
+    while not connection.get_metrics()["send_paused"]:
+        connection.send_command(next(commands))
+    start = time.monotonic()
+    with pytest.raises(RinnaiBackpressureError):
+        connection.send_command(next(commands))
+    assert time.monotonic() - start < 0.5
+
+
+def test_coalescing():
+    """A newer setting replaces a pending one for the same path."""
+    session = RinnaiSession(lambda status: None)
+    session.reset(0)
+    for temp in range(16, 25):
+        session.send_command(f'{{"HGOM": {{"ZAO": {{"SP": "{temp}" }} }} }}')
+    session.send_command('{"HGOM": {"ZBO": {"SP": "20" } } }')
+    metrics = session.get_metrics()
+    assert metrics["commands_queued"] == 2
+    assert metrics["commands_superseded"] == 8
+
+    assert session.queue_due_frame(0)
+    frame = b"".join(session.outbound_buffers())
+    assert json.loads(frame[7:]) == {"HGOM": {"ZAO": {"SP": "24"}, "ZBO": {"SP": "20"}}}
+
+
+def test_no_coalescing_across_system_commands():
+    """Mode switches keep the commands either side of them in order."""
+    session = RinnaiSession(lambda status: None)
+    session.send_command('{"CGOM": {"GSO": {"SP": "20" } } }')
+    session.send_command('{"SYST": {"OSS": {"MD": "H" } } }')
+    session.send_command('{"SYST": {"OSS": {"MD": "C" } } }')
+    session.send_command('{"CGOM": {"GSO": {"SP": "22" } } }')
+    metrics = session.get_metrics()
+    assert metrics["commands_queued"] == 4
+    assert metrics["commands_superseded"] == 0
+
+
+def test_no_coalescing_across_switches():
+    """Switching the unit on and off keeps the settings in between in order."""
+    session = RinnaiSession(lambda status: None)
+    session.reset(0)
+    session.send_command('{"HGOM": {"OOP": {"ST": "N" } } }')
+    session.send_command('{"HGOM": {"ZAO": {"SP": "21" } } }')
+    session.send_command('{"HGOM": {"OOP": {"ST": "F" } } }')
+    assert session.get_metrics()["commands_superseded"] == 0
+
+    frames = []
+    while session.queue_due_frame(0):
+        frame = b"".join(session.outbound_buffers())
+        session.data_sent(len(frame), 0)
+        frames.append(json.loads(frame[7:]))
+        session.data_received(frame[:7] + b"[{}]", 0)
+    assert frames == [
+        {"HGOM": {"OOP": {"ST": "N"}}},
+        {"HGOM": {"ZAO": {"SP": "21"}}},
+        {"HGOM": {"OOP": {"ST": "F"}}},
+    ]
+
+
+def test_merging():
+    """Settings for one unit share a frame, switches and other units do not."""
+    session = RinnaiSession(lambda status: None)
+    session.reset(0)
+    for zone in "ABCD":
+        session.send_command(f'{{"HGOM": {{"Z{zone}O": {{"SP": "21" }} }} }}')
+    session.send_command('{"HGOM": {"OOP": {"ST": "F" } } }')
+    session.send_command('{"CGOM": {"GSO": {"SP": "22" } } }')
+    session.send_command('{"CGOM": {"OOP": {"FL": "05" } } }')
+
+    frames = []
+    while session.queue_due_frame(0):
+        frame = b"".join(session.outbound_buffers())
+        session.data_sent(len(frame), 0)
+        frames.append(json.loads(frame[7:]))
+        session.data_received(frame[:7] + b"[{}]", 0)
+
+    assert frames == [
+        {"HGOM": {f"Z{zone}O": {"SP": "21"} for zone in "ABCD"}},
+        {"HGOM": {"OOP": {"ST": "F"}}},
+        {"CGOM": {"GSO": {"SP": "22"}, "OOP": {"FL": "05"}}},
+    ]
+    metrics = session.get_metrics()
+    assert metrics["commands_sent"] == 7
+    assert metrics["command_frames_sent"] == 3
+    assert metrics["commands_merged"] == 4
+
+
+def test_acknowledgement_futures():
+    """Futures resolve on acknowledgement, across wrap-around, and fail on timeout."""
+    session = RinnaiSession(lambda status: None)
+    session.reset(0)
+    session._command_sequence = 253  # pylint: disable=protected-access
+    session._last_received_sequence_num = 252  # pylint: disable=protected-access
+
+    first = session.send_command('{"HGOM": {"OOP": {"ST": "N" } } }')
+    assert session.queue_due_frame(1)
+    assert b"".join(session.outbound_buffers()).startswith(b"N000254")
+    session.data_sent(len(session.outbound_buffers()[0]), 1)
+    # A frame from before the command does not acknowledge it.
+    session.data_received(b"N000250[{}]", 1.5)
+    assert not first.done()
+    # Sequence numbers wrap at 255, so 1 comes after 254.
+    session.data_received(b"N000001[{}]", 2.25)
+    assert first.result().sequence == 254
+    assert first.result().latency == pytest.approx(1.25)
+
+    second = session.send_command('{"HGOM": {"OOP": {"ST": "F" } } }')
+    assert session.queue_due_frame(3)
+    assert b"".join(session.outbound_buffers()).startswith(b"N000002")
+    assert not session.queue_due_frame(5)
+    assert not second.done()
+    # Past the command wait timeout.
+    session.queue_due_frame(8.5)
+    with pytest.raises(RinnaiCommandError):
+        second.result(0)
+
+
+def test_command_window():
+    """Up to command_window frames are in flight, and an ack covers earlier ones."""
+    session = RinnaiSession(lambda status: None, command_window=2)
+    session.reset(0)
+    futures = [
+        session.send_command(f'{{"{unit}": {{"OOP": {{"ST": "N" }} }} }}')
+        for unit in ("HGOM", "CGOM", "ECOM")
+    ]
+    assert session.queue_due_frame(0)
+    assert session.get_metrics()["commands_in_flight"] == 2
+    assert not session.queue_due_frame(0)
+
+    session.data_received(b"N000003[{}]", 0.5)
+    assert [future.result(0).sequence for future in futures[:2]] == [2, 3]
+    assert session.queue_due_frame(0.5)
+    assert not futures[2].done()
+
+
+def test_poll_cadence():
+    """Idle polls back off while the status is unchanged and speed up when busy."""
+    session = RinnaiSession(lambda status: None)
+    session.reset(0)
+    assert session.next_deadline() == 10
+
+    # The first status counts as a change, later identical ones back off.
+    now = 0
+    for interval, next_interval in ((10, 10), (10, 15), (15, 20), (20, 20)):
+        now += interval
+        assert session.queue_due_frame(now)
+        header = b"".join(session.outbound_buffers())[:7]
+        session.data_sent(len(header) + 2, now)
+        session.data_received(header + b"[{}]", now)
+        assert session.get_metrics()["poll_interval"] == next_interval
+
+    assert session.set_busy(True)
+    assert session.queue_due_frame(now + 2)
+    assert session.get_metrics()["poll_interval"] == 2
+
+
+def test_unchanged_statuses_skipped():
+    """Identical statuses are only decoded when the full refresh is due."""
+    statuses = []
+    session = RinnaiSession(statuses.append, full_refresh_interval=60)
+    session.reset(0)
+    for now, payload in ((0, b'[{"A": 1}]'), (1, b'[{"A": 1}]'), (2, b'[{"A": 2}]'),
+                         (3, b'[{"A": 2}]'), (62, b'[{"A": 2}]'), (63, b'[{"A": 2}]')):
+        session.data_received(b"N000001" + payload, now)
+    assert statuses == [[{"A": 1}], [{"A": 2}], [{"A": 2}]]
+    metrics = session.get_metrics()
+    assert metrics["statuses_decoded"] == 3
+    assert metrics["statuses_skipped"] == 3
+
+    # A new connection always starts with a full decode.
+    session.reset(64)
+    session.data_received(b"N000001" + b'[{"A": 2}]', 64)
+    assert len(statuses) == 4
@@ -0,0 +1,136 @@
+"""Tests for spreading a fleet across worker processes."""
+from concurrent.futures import Future
+import copy
+import json
+import multiprocessing
+import queue
+import socket
+import threading
+import time
+
+from pyrinnaitouch.const import RinnaiSystemMode
+from pyrinnaitouch.diff import snapshot
+from pyrinnaitouch.shard import _ACK, RinnaiShardedFleet, _apply, _ShardWorker
+from pyrinnaitouch.util import RinnaiCommandError
+from pyrinnaitouch.system import RinnaiSystem
+from pyrinnaitouch.system_status import RinnaiSystemStatus
+from .test_fleet import _serve_one
+from .test_system_parse import get_test_json
+
+
+def _announce(discovery_port, stop):
+    """Broadcast as a module would until stopped."""
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        while not stop.wait(0.1):
+            sock.sendto(b"Rinnai_NBW2_Module\x00", ("127.0.0.1", discovery_port))
+
+
+def test_delta_roundtrip():
+    """Applying the values that differ to the old status gives the new one."""
+    old = RinnaiSystemStatus()
+    old.handle_status(json.loads(get_test_json()))
+    new = copy.deepcopy(old)
+    new.unit_status.zones["A"].temperature = 215
+    new.unit_status.set_temp = 17
+
+    before = snapshot(old)
+    after = snapshot(new)
+    delta = {path: value for path, value in after.items() if before[path] != value}
+    assert delta == {
+        "unit_status.zones.A.temperature": 215,
+        "unit_status.set_temp": 17,
+    }
+    for path, value in delta.items():
+        _apply(old, path, value)
+    assert snapshot(old) == after
+
+
+def test_sharded_unit_status():
+    """A unit run by a worker process reports its status and acks to the parent."""
+    with socket.create_server(("127.0.0.1", 0)) as server, socket.socket(
+        socket.AF_INET, socket.SOCK_DGRAM
+    ) as probe:
+        port = server.getsockname()[1]
+        probe.bind(("127.0.0.1", 0))
+        discovery_port = probe.getsockname()[1]
+        probe.close()
+        stop = threading.Event()
+        threading.Thread(target=_serve_one, args=(server,), daemon=True).start()
+        threading.Thread(
+            target=_announce, args=(discovery_port, stop), daemon=True
+        ).start()
+
+        fleet = RinnaiShardedFleet(workers=1)
+        system = fleet.add_unit("127.0.0.1", port=port, discovery_port=discovery_port)
+        updated = threading.Event()
+        system.subscribe_updates(updated.set)
+        system.get_status()
+        fleet.start()
+        try:
+            assert updated.wait(30)
+            assert system.get_stored_status().mode == RinnaiSystemMode.COOLING
+            ack = system.send_command('{"CGOM": {"GSO": {"SP": "21" } } }').result(10)
+            assert ack.sequence == 2
+        finally:
+            stop.set()
+            RinnaiSystem.remove_instance("127.0.0.1")
+            fleet.stop()
+
+
+def test_failed_command_acknowledged():
+    """A command that fails in the worker fails in the parent too."""
+    results, writer = multiprocessing.Pipe(duplex=False)
+    worker = _ShardWorker(queue.SimpleQueue(), writer)
+    future = Future()
+    # pylint: disable=protected-access
+    future.add_done_callback(lambda future: worker._send_ack(7, future))
+    future.set_exception(RinnaiCommandError("No acknowledgement"))
+    assert results.poll(1)
+    kind, command_id, result, error = results.recv()
+    assert (kind, command_id, result) == (_ACK, 7, None)
+    assert isinstance(error, RinnaiCommandError)
+
+
+def test_sharded_worker_restart():
+    """Commands sent while a worker restarts fail rather than go missing."""
+    with socket.create_server(("127.0.0.1", 0)) as server, socket.socket(
+        socket.AF_INET, socket.SOCK_DGRAM
+    ) as probe:
+        port = server.getsockname()[1]
+        probe.bind(("127.0.0.1", 0))
+        discovery_port = probe.getsockname()[1]
+        probe.close()
+        stop = threading.Event()
+
+        def serve_twice():
+            _serve_one(server)
+            _serve_one(server)
+
+        threading.Thread(target=serve_twice, daemon=True).start()
+        threading.Thread(
+            target=_announce, args=(discovery_port, stop), daemon=True
+        ).start()
+
+        fleet = RinnaiShardedFleet(workers=1)
+        system = fleet.add_unit("127.0.0.1", port=port, discovery_port=discovery_port)
+        updated = threading.Event()
+        system.subscribe_updates(updated.set)
+        system.get_status()
+        fleet.start()
+        try:
+            assert updated.wait(30)
+            fleet._workers[0].kill()  # pylint: disable=protected-access
+            fleet._workers[0].join()  # pylint: disable=protected-access
+            # Every command is either acknowledged by the new worker or fails.
+            while True:
+                future = system.send_command('{"CGOM": {"GSO": {"SP": "21" } } }')
+                try:
+                    future.result(30)
+                    break
+                except RinnaiCommandError:
+                    time.sleep(0.05)
+            assert fleet.get_metrics()["worker_restarts"] == 1
+        finally:
+            stop.set()
+            RinnaiSystem.remove_instance("127.0.0.1")
+            fleet.stop()
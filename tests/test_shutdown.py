@@ -0,0 +1,79 @@
+"""Tests for stopping and restarting threaded connections."""
+import socket
+import threading
+import time
+
+from pyrinnaitouch.discovery import RinnaiDiscovery
+from pyrinnaitouch.pollconnection import RinnaiConnectionState
+from pyrinnaitouch.system import RinnaiSystem
+from .test_fleet import _serve_one
+
+# Stopping and starting again must not wait on anything in the connection layer.
+MAX_RESTART_SECONDS = 0.1
+
+
+def _wait_for_state(system, state, timeout=5):
+    """Wait until the system's connection reaches the given state."""
+    deadline = time.monotonic() + timeout
+    while system._connection.socket_state() != state:  # pylint: disable=protected-access
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def _restart(ip_address, port):
+    """Remove the system for the unit and create it again, as a reload would."""
+    start = time.perf_counter()
+    RinnaiSystem.remove_instance(ip_address)
+    system = RinnaiSystem(ip_address, port=port, discovery_port=port)
+    system.get_status()
+    return system, time.perf_counter() - start
+
+
+def test_restart_connected():
+    """A connected unit is let go of and connected to again straight away."""
+    with socket.create_server(("127.0.0.1", 0)) as server:
+        port = server.getsockname()[1]
+        threading.Thread(target=_serve_one, args=(server,), daemon=True).start()
+        RinnaiDiscovery.get_instance(port).touch("127.0.0.1")
+
+        system = RinnaiSystem("127.0.0.1", port=port, discovery_port=port)
+        updated = threading.Event()
+        system.subscribe_updates(updated.set)
+        system.get_status()
+        assert updated.wait(5)
+
+        system, seconds = _restart("127.0.0.1", port)
+        RinnaiSystem.remove_instance("127.0.0.1")
+        assert seconds < MAX_RESTART_SECONDS
+
+
+def test_restart_waiting():
+    """Neither waiting for a broadcast nor backing off after a refusal holds up a stop."""
+    with socket.create_server(("127.0.0.1", 0)) as server:
+        port = server.getsockname()[1]
+    # Nothing broadcasts, so the connection waits for discovery.
+    system = RinnaiSystem("127.0.0.2", port=port, discovery_port=port)
+    system.get_status()
+    time.sleep(0.05)
+    # Seen from now on, but nothing listens, so the next connection backs off after
+    # being refused.
+    RinnaiDiscovery.get_instance(port).touch("127.0.0.2")
+    system, seconds = _restart("127.0.0.2", port)
+    assert seconds < MAX_RESTART_SECONDS
+
+    _wait_for_state(system, RinnaiConnectionState.REFUSED)
+    system, seconds = _restart("127.0.0.2", port)
+    RinnaiSystem.remove_instance("127.0.0.2")
+    assert seconds < MAX_RESTART_SECONDS
+
+
+def test_stop_closes_wake_sockets():
+    """Stopping the connection closes the sockets used to wake its thread."""
+    with socket.create_server(("127.0.0.1", 0)) as server:
+        port = server.getsockname()[1]
+    system = RinnaiSystem("127.0.0.3", port=port, discovery_port=port)
+    system.get_status()
+    # pylint: disable=protected-access
+    wake_sockets = (system._connection._wake_reader, system._connection._wake_writer)
+    RinnaiSystem.remove_instance("127.0.0.3")
+    assert all(wake_socket.fileno() == -1 for wake_socket in wake_sockets)
@@ -0,0 +1,121 @@
+"""Tests for driving the connections against the unit simulator."""
+import asyncio
+import json
+import socket
+import threading
+import time
+
+from pyrinnaitouch.const import RinnaiSystemMode, RinnaiUnitId
+from pyrinnaitouch.simulator import RinnaiSimulatedUnit, RinnaiSimulator
+from pyrinnaitouch.system import RinnaiSystem
+from pyrinnaitouch.system_status import RinnaiSystemStatus
+
+
+def _free_udp_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_until(condition, timeout=5):
+    """Wait for a status handled on another thread to show up."""
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_simulated_unit_commands():
+    """Commands change the simulated unit the way the parser expects."""
+    unit = RinnaiSimulatedUnit(
+        "H", (RinnaiUnitId.HEATER, RinnaiUnitId.EVAP), zones="ABU", multi_set_point=True
+    )
+    unit.set_temperature(180)
+    unit.apply(json.loads('{"HGOM": {"OOP": {"ST": "N" } } }'))
+    unit.apply(json.loads('{"HGOM": {"ZBO": {"SP": "16", "OP": "A" } } }'))
+    status = RinnaiSystemStatus()
+    assert status.handle_status(unit.status())
+    assert status.mode == RinnaiSystemMode.HEATING
+    assert status.is_multi_set_point
+    assert status.system_on
+    assert sorted(status.unit_status.zones) == ["A", "B", "U"]
+    assert status.unit_status.zones["A"].calling_for_work
+    assert status.unit_status.zones["B"].set_temp == "16"
+    assert status.unit_status.zones["B"].auto_mode
+    # Already warmer than its set point.
+    assert not status.unit_status.zones["B"].calling_for_work
+    assert status.unit_status.is_busy
+
+    unit.apply(json.loads('{"SYST": {"OSS": {"MD": "E" } } }'))
+    unit.apply(json.loads('{"ECOM": {"GSO": {"SW": "N", "OP": "A", "SP": "12" } } }'))
+    status = RinnaiSystemStatus()
+    assert status.handle_status(unit.status())
+    assert status.mode == RinnaiSystemMode.EVAP
+    assert status.unit_status.comfort == "12"
+    # No cooler fitted, so the mode does not change.
+    unit.apply(json.loads('{"SYST": {"OSS": {"MD": "C" } } }'))
+    assert unit.unit_id == "ECOM"
+
+
+def test_simulator_fragmented():
+    """A connection copes with the simulator's frames arriving a few bytes at a time."""
+    discovery_port = _free_udp_port()
+    with RinnaiSimulator(
+        discovery_port=discovery_port, broadcast_interval=0.1, chunk_size=7
+    ) as simulator:
+        system = RinnaiSystem(
+            "127.0.0.1", port=simulator.port, discovery_port=discovery_port
+        )
+        updated = threading.Event()
+        system.subscribe_updates(updated.set)
+        system.get_status()
+        try:
+            assert updated.wait(5)
+            assert system.get_stored_status().mode == RinnaiSystemMode.COOLING
+            assert not system.get_stored_status().system_on
+
+            asyncio.run(system.turn_unit_on())
+            ack = system.send_command('{"CGOM": {"GSO": {"SP": "19" } } }').result(5)
+            assert ack.sequence > 0
+            _wait_until(lambda: system.get_stored_status().unit_status.set_temp == 19)
+            assert system.get_stored_status().system_on
+            assert simulator.unit().commands_applied >= 1
+        finally:
+            RinnaiSystem.remove_instance("127.0.0.1")
+
+
+def test_simulator_asyncio():
+    """The asyncio connection talks to the unit from the event loop alone."""
+    discovery_port = _free_udp_port()
+
+    async def drive(port):
+        threads = set(threading.enumerate())
+        system = RinnaiSystem(
+            "127.0.0.1", use_asyncio=True, port=port, discovery_port=discovery_port
+        )
+        updated = asyncio.Event()
+        system.subscribe_updates(updated.set)
+        system.get_status()
+        try:
+            await asyncio.wait_for(updated.wait(), 5)
+            assert system.get_stored_status().mode == RinnaiSystemMode.COOLING
+
+            ack = await asyncio.wait_for(
+                asyncio.wrap_future(await system.turn_unit_on()), 5
+            )
+            assert ack.sequence > 0
+            future = system.send_command('{"CGOM": {"GSO": {"SP": "19" } } }')
+            assert (await asyncio.wait_for(asyncio.wrap_future(future), 5)).sequence > 0
+            while system.get_stored_status().unit_status.set_temp != 19:
+                updated.clear()
+                await asyncio.wait_for(updated.wait(), 5)
+            assert system.get_stored_status().system_on
+            assert set(threading.enumerate()) == threads
+        finally:
+            RinnaiSystem.remove_instance("127.0.0.1")
+        return system
+
+    with RinnaiSimulator(discovery_port=discovery_port, broadcast_interval=0.1) as simulator:
+        system = asyncio.run(drive(simulator.port))
+        assert simulator.unit().commands_applied >= 1
+    assert system.get_metrics()["commands_sent"] >= 2
@@ -0,0 +1,39 @@
+"""Tests for handing the latest status to the processing thread."""
+import queue
+import threading
+
+import pytest
+
+from pyrinnaitouch.statusmailbox import EXIT, RinnaiStatusMailbox
+
+TIME_SETTING = [{"SYST": {"STM": {"DY": "MON"}}}]
+
+
+def test_latest_status_wins():
+    """Only the newest status is kept, but control messages keep their place."""
+    mailbox = RinnaiStatusMailbox()
+    for index in range(5):
+        mailbox.put([{"SYST": {"OSS": {"TM": f"10:0{index}"}}}])
+    mailbox.put(TIME_SETTING)
+    mailbox.put(TIME_SETTING)
+    mailbox.put([{"SYST": {"OSS": {"TM": "10:05"}}}])
+    mailbox.put(EXIT)
+    assert len(mailbox) == 3
+    # The status put before the signals was replaced by the one after them.
+    assert mailbox.get() is TIME_SETTING
+    assert mailbox.get() == [{"SYST": {"OSS": {"TM": "10:05"}}}]
+    assert mailbox.get() == EXIT
+    with pytest.raises(queue.Empty):
+        mailbox.get(timeout=0.01)
+    assert mailbox.get_metrics() == {
+        "mailbox_statuses": 6,
+        "mailbox_statuses_dropped": 5,
+        "mailbox_time_settings_dropped": 1,
+    }
+
+    mailbox.put([{"SYST": {"OSS": {"TM": "10:06"}}}])
+    assert mailbox.get_nowait() == [{"SYST": {"OSS": {"TM": "10:06"}}}]
+    timer = threading.Timer(0.05, mailbox.put, (EXIT,))
+    timer.start()
+    assert mailbox.get(timeout=5) == EXIT
+    timer.join()